@@ -1,19 +1,75 @@
 # import necessary modules
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Header, Response
+from fastapi.responses import StreamingResponse
 from app.core.database import AsyncSession
 from app.core.database import get_db
 from app.core.security import verify_token
-from app.blob_schemas import  BlobResponse , BlobCreate
+from app.blob_schemas import  BlobResponse , BlobCreate, BatchCreateResponse, BatchItemResult, TRUSTED_PAYLOAD
 from app.core.logger import setup_logger
 from app.core.config import settings
+from app.api.ranges import (
+    etag_for,
+    http_date,
+    if_range_matches,
+    is_entity_tag,
+    parse_range_header,
+)
+from app.api.responses import FileRangeResponse
+import asyncio
 import base64
+import mimetypes
 import uuid
+from typing import AsyncIterator, Optional
 from app.storage import get_storage_backend
+from app.storage.base import RangeNotSatisfiable
+from app.storage.ftp_storage import ftp_pool
+from app.storage.local_storage import LocalStorage
+from app.storage.executors import ftp_io, local_io
+from app.storage.group_commit import local_commit
+from app.storage.cache import blob_cache
+from app.storage.disk_cache import disk_cache
+from app.storage.single_flight import blob_flights
+from app.storage.locator import MetadataBatch
 
 # Define API router
 router = APIRouter()
 logger = setup_logger(__name__)
 
+
+async def _iter_upload(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    """Read an upload in fixed-size chunks so it is never fully in memory."""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _wants_raw(accept: Optional[str]) -> bool:
+    """Whether the Accept header ranks raw bytes above the JSON representation."""
+    if not accept:
+        return False
+
+    quality = {}
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[media_type.strip().lower()] = q
+
+    raw = quality.get("application/octet-stream", 0.0)
+    json = quality.get(
+        "application/json", quality.get("application/*", quality.get("*/*", 0.0))
+    )
+    return raw > json
+
+
 # Create blob endpoint
 @router.post("/blobs", response_model=BlobCreate, status_code=201)
 async def create_blob(
@@ -22,27 +78,24 @@ async def create_blob(
     _=Depends(verify_token),
 ):
     try:
-        # 1️⃣ Read bytes
-        file_bytes: bytes = await file.read()
-        # 2️⃣ Extract filename
+        # 1️⃣ Extract filename
         filename = file.filename
-        # 3️⃣ Optional path logic
+        # 2️⃣ Optional path logic
         path = f"{settings.MEDIA_DIR}/{filename}"
-        # 2️⃣ Encode → Base64
-        base64_data = base64.b64encode(file_bytes)#
-
-        logger.debug(f"Base64 encoded data size: {len(base64_data)}")
 
         storage_backend = get_storage_backend()
 
         blob_id = str(uuid.uuid4())
         logger.debug(f"Generated blob ID: {blob_id}")
 
-        blob_data_response = await storage_backend.save(    
+        # 3️⃣ Stream the upload to the backend chunk by chunk
+        blob_data_response = await storage_backend.save_stream(
             blob_id=blob_id,
-            data=base64_data,
+            chunks=_iter_upload(file, settings.UPLOAD_CHUNK_SIZE),
             filename=filename,
             path=path,
+            size=file.size,
+            db=db,
         )
 
         logger.debug(f"Blob data response for blob id : {blob_id}")
@@ -57,31 +110,105 @@ async def create_blob(
         raise
     except Exception as e:
         logger.error(f"Error creating blob: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+# Batch upload endpoint
+@router.post("/blobs:batch", response_model=BatchCreateResponse)
+async def create_blobs_batch(
+    files: list[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    _=Depends(verify_token),
+):
+    if len(files) > settings.BATCH_UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BATCH_UPLOAD_MAX_FILES} files per batch",
+        )
+
+    storage_backend = get_storage_backend()
+    # rows of the blobs written are inserted together once all are written
+    batch = MetadataBatch(max_pending_bytes=settings.BATCH_UPLOAD_MAX_PENDING_BYTES)
+    semaphore = asyncio.Semaphore(settings.BATCH_UPLOAD_CONCURRENCY)
+
+    async def save(file: UploadFile) -> BatchItemResult:
+        blob_id = str(uuid.uuid4())
+        async with semaphore:
+            try:
+                # no db: the request's session cannot be shared by concurrent writes
+                saved = await storage_backend.save_stream(
+                    blob_id=blob_id,
+                    chunks=_iter_upload(file, settings.UPLOAD_CHUNK_SIZE),
+                    filename=file.filename,
+                    path=f"{settings.MEDIA_DIR}/{file.filename}",
+                    size=file.size,
+                    metadata_batch=batch,
+                )
+            except Exception as e:
+                logger.error(f"Error saving batch file {file.filename}: {e}")
+                saved = None
+
+        if not saved:
+            return BatchItemResult(filename=file.filename, status=500, error="Failed to save blob data")
+        return BatchItemResult(filename=file.filename, id=blob_id, status=201)
+
+    items = await asyncio.gather(*(save(file) for file in files))
+
+    await batch.flush(db)
+    # the objects are in the backend but not indexed: report them failed
+    for item in items:
+        if item.id is not None and str(item.id) in batch.failed:
+            item.id, item.status, item.error = None, 500, "Failed to index blob"
+
+    created = sum(item.status == 201 for item in items)
+    logger.info(f"Batch of {len(items)} files: {created} blobs created")
+    return BatchCreateResponse(created=created, failed=len(items) - created, items=items)
+
 
 # Get blob endpoint
 @router.get("/blobs/{blob_id}", response_model=BlobResponse , response_model_exclude_none=True)
 async def get_blob(
     blob_id: uuid.UUID,
+    accept: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
     db: AsyncSession = Depends(get_db),
     _=Depends(verify_token),
 ):
+    # clients asking for application/octet-stream get the bytes, not Base64
+    if _wants_raw(accept):
+        raw_response = await get_blob_content(blob_id, range_header, if_range, _)
+        raw_response.headers["Vary"] = "Accept"
+        return raw_response
+
     try:
         storage_backend = get_storage_backend()
-        blob_metadata = await storage_backend.retrieve(str(blob_id))
+        stored_blob = await storage_backend.retrieve(str(blob_id))
 
-        if not blob_metadata:
+        if not stored_blob:
             raise HTTPException(status_code=404, detail="Blob not found")
 
-        return BlobResponse(
-            id=blob_id,
-            data=blob_metadata.data,
-            size=blob_metadata.size,
-            created_at=blob_metadata.created_at,
-            name=blob_metadata.name,
-            path=blob_metadata.path,
-            storage_backend=blob_metadata.storage_backend,
-            storage_path=blob_metadata.storage_path
+        # the only place the payload is Base64 encoded; we just encoded it,
+        # so skip the decode check
+        blob_response = BlobResponse.model_validate(
+            {
+                "id": blob_id,
+                "data": base64.b64encode(stored_blob.data),
+                "size": stored_blob.size,
+                "created_at": stored_blob.created_at,
+                "name": stored_blob.name,
+                "path": stored_blob.path,
+                "storage_backend": stored_blob.storage_backend,
+                "storage_path": stored_blob.storage_path,
+            },
+            context=TRUSTED_PAYLOAD,
+        )
+
+        # serialized here: returning a Response keeps FastAPI from
+        # validating the model a second time against response_model
+        return Response(
+            content=blob_response.model_dump_json(exclude_none=True),
+            media_type="application/json",
+            headers={"Vary": "Accept"},
         )
 
     except HTTPException:
@@ -89,3 +216,130 @@ async def get_blob(
     except Exception as e:
         logger.error(f"Error retrieving blob {blob_id}: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+# Get raw blob content endpoint
+@router.get("/blobs/{blob_id}/content", response_class=StreamingResponse)
+async def get_blob_content(
+    blob_id: uuid.UUID,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    _=Depends(verify_token),
+):
+    try:
+        storage_backend = get_storage_backend()
+        etag = etag_for(blob_id)
+        blob_stream = None
+
+        byte_range = parse_range_header(range_header)
+        # a stale entity tag means the client wants the whole blob again
+        if byte_range and if_range and is_entity_tag(if_range):
+            if not if_range_matches(if_range, etag, None):
+                byte_range = None
+
+        if byte_range:
+            try:
+                blob_stream = await storage_backend.retrieve_range(str(blob_id), *byte_range)
+            except RangeNotSatisfiable as e:
+                raise HTTPException(
+                    status_code=416,
+                    detail="Range not satisfiable",
+                    headers={"Content-Range": f"bytes */{e.size}"},
+                )
+
+            # an If-Range date can only be checked against the stored blob
+            if blob_stream and if_range and not if_range_matches(if_range, etag, blob_stream.created_at):
+                await blob_stream.chunks.aclose()
+                byte_range = None
+
+        if not byte_range:
+            blob_stream = await storage_backend.retrieve_stream(str(blob_id))
+
+        if not blob_stream:
+            raise HTTPException(status_code=404, detail="Blob not found")
+
+        media_type, _encoding = mimetypes.guess_type(blob_stream.name or "")
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(blob_stream.length),
+            "ETag": etag,
+        }
+        if blob_stream.created_at:
+            headers["Last-Modified"] = http_date(blob_stream.created_at)
+
+        status_code = 200
+        if byte_range:
+            status_code = 206
+            headers["Content-Range"] = (
+                f"bytes {blob_stream.start}-{blob_stream.end}/{blob_stream.size}"
+            )
+
+        if blob_stream.file_path:
+            # nothing was read yet: hand the file itself to the server
+            await blob_stream.chunks.aclose()
+            response = await FileRangeResponse.open(
+                blob_stream.file_path,
+                blob_stream.start,
+                blob_stream.length,
+                status_code=status_code,
+                media_type=media_type or "application/octet-stream",
+                headers=headers,
+            )
+            if not response:
+                # deleted or evicted since it was located
+                raise HTTPException(status_code=404, detail="Blob not found")
+            return response
+
+        return StreamingResponse(
+            blob_stream.chunks,
+            status_code=status_code,
+            media_type=media_type or "application/octet-stream",
+            headers=headers,
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming blob {blob_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+# Delete blob endpoint
+@router.delete("/blobs/{blob_id}", status_code=204)
+async def delete_blob(
+    blob_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    _=Depends(verify_token),
+):
+    try:
+        storage_backend = get_storage_backend()
+        deleted = await storage_backend.delete(str(blob_id), db=db)
+    except NotImplementedError:
+        raise HTTPException(status_code=501, detail="Storage backend does not support deletes")
+    except Exception as e:
+        logger.error(f"Error deleting blob {blob_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    logger.info(f"Blob deleted with ID: {blob_id}")
+    return Response(status_code=204)
+
+
+# Storage connection pool metrics
+@router.get("/storage/stats")
+async def get_storage_stats(_=Depends(verify_token)):
+    stats = {
+        "ftp": ftp_pool.stats(),
+        "io": {"local": local_io.stats(), "ftp": ftp_io.stats()},
+        "local_fsync": local_commit.stats(),
+        "single_flight": blob_flights.stats(),
+    }
+    if settings.LOCAL_PACK_ENABLED:
+        stats["packs"] = await LocalStorage().pack_stats()
+    if settings.BLOB_CACHE_ENABLED:
+        stats["cache"] = blob_cache.stats()
+    if settings.DISK_CACHE_ENABLED:
+        stats["disk_cache"] = disk_cache.stats()
+    return stats
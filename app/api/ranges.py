@@ -0,0 +1,77 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+import uuid
+
+
+def etag_for(blob_id: uuid.UUID) -> str:
+    """Blobs are immutable, so the id is a strong validator."""
+    return f'"{blob_id}"'
+
+
+def http_date(dt: datetime) -> str:
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_range_header(value: Optional[str]) -> Optional[tuple[int, Optional[int]]]:
+    """
+    Parse a single `bytes=` Range header into (start, end) for retrieve_range().
+
+    Suffix ranges (`bytes=-500`) come back with a negative start. Other units,
+    multiple ranges or bad syntax return None so the whole blob is served,
+    which RFC 9110 allows.
+    """
+    if not value:
+        return None
+
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if not first:
+            suffix = int(last)
+            return (-suffix, None) if suffix > 0 else None
+
+        start = int(first)
+        end = int(last) if last else None
+    except ValueError:
+        return None
+
+    if start < 0 or (end is not None and end < start):
+        return None
+
+    return start, end
+
+
+def is_entity_tag(if_range: str) -> bool:
+    return if_range.strip().startswith(('"', "W/"))
+
+
+def if_range_matches(
+    if_range: str, etag: str, last_modified: Optional[datetime]
+) -> bool:
+    """
+    Whether the representation the client holds is still current.
+
+    Entity tags must match exactly (weak tags never do); dates must equal
+    Last-Modified at one second precision.
+    """
+    if_range = if_range.strip()
+
+    if is_entity_tag(if_range):
+        return if_range == etag
+
+    if last_modified is None:
+        return False
+
+    try:
+        date = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+
+    return date == last_modified.replace(microsecond=0)
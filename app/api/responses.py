@@ -0,0 +1,119 @@
+import mmap
+import os
+from typing import Mapping, Optional
+
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.storage.executors import local_io
+
+
+class FileRangeResponse(Response):
+    """
+    Serve bytes [start, start + length) of a file on disk.
+
+    Whole files go out through the ASGI `http.response.pathsend` extension
+    when the server offers it, so the kernel sends them (sendfile) and the
+    payload never enters Python. Otherwise, and for ranges, the file is
+    mmap'ed and sliced on the local I/O threads: no read() loop and no
+    copies beyond the slice handed to the server.
+
+    Build it with `open()`, which maps the file before any header is sent:
+    a file deleted or evicted after it was located is a 404, not a
+    truncated body.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        length: int,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.path = path
+        self.start = start
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.init_headers(headers)
+        self.headers["content-length"] = str(length)
+        self._mapping = None
+
+    @classmethod
+    async def open(cls, path: str, start: int, length: int, **kwargs) -> Optional["FileRangeResponse"]:
+        """The response for `path`, or None if the file is gone or too short."""
+        try:
+            mapping = await local_io.run(cls._map, path)
+        except FileNotFoundError:
+            return None
+
+        mapped, size, _inode = mapping
+        if start + length > size:
+            if mapped is not None:
+                mapped.close()
+            return None
+
+        response = cls(path, start, length, **kwargs)
+        response._mapping = mapping
+        return response
+
+    @staticmethod
+    def _map(path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            # empty files cannot be mapped
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else None
+            return mapped, stat.st_size, stat.st_ino
+
+    @staticmethod
+    def _still_at(path: str, inode: int) -> bool:
+        try:
+            return os.stat(path).st_ino == inode
+        except FileNotFoundError:
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        mapped, size, inode = self._mapping or await local_io.run(self._map, self.path)
+        self._mapping = None
+
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+
+            whole_file = self.start == 0 and self.length == size
+            # the server reopens the path: only hand it over while it still
+            # names the mapped file, else serve the mapping
+            if (
+                whole_file
+                and "http.response.pathsend" in scope.get("extensions", {})
+                and await local_io.run(self._still_at, self.path, inode)
+            ):
+                await send({"type": "http.response.pathsend", "path": self.path})
+            else:
+                stop = self.start + self.length
+                chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+                for offset in range(self.start, stop, chunk_size):
+                    chunk = await local_io.run(
+                        mapped.__getitem__, slice(offset, min(offset + chunk_size, stop))
+                    )
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if mapped is not None:
+                mapped.close()
+
+        if self.background is not None:
+            await self.background()
@@ -1,66 +1,95 @@
 from app.core.database import AsyncSession
 from sqlalchemy.future import select
-from app.blob_models import BlobData, BlobMetadata
-from app.blob_schemas import BlobCreate, BlobResponse
+from sqlalchemy import delete, func, insert, text, update
+from sqlalchemy.orm import joinedload
+from app.blob_models import BlobChunk, BlobContent, BlobData, BlobMetadata
+from app.blob_schemas import BlobResponse
 from app.core.logger import setup_logger
-import base64
 
 logger = setup_logger(__name__)
 
-# ---------- BlobData ----------
-async def create_blob_data(
-    blob: BlobCreate,
-    db: AsyncSession ,
-) -> BlobResponse | None:
+# ---------- BlobData + BlobMetadata ----------
+async def create_blob_with_metadata(
+    db: AsyncSession,
+    blob_metadata: BlobMetadata,
+    data: bytes,
+) -> BlobMetadata | None:
+    """Insert the payload and its metadata in one transaction, flushed once."""
     try:
-        #  require: decode Base64 → bytes
-        binary_data = base64.b64decode(blob.data, validate=True)
-
-        db_blob = BlobData(
-            id=blob.id,
-            data=binary_data,   # BYTEA 
+        blob_metadata.blob_data = BlobData(
+            id=blob_metadata.id,
+            data=data,   # BYTEA, already raw
         )
 
-        db.add(db_blob)
+        db.add(blob_metadata)
+        # every column is set client side: nothing to refresh afterwards
         await db.commit()
-        await db.refresh(db_blob)
-
-        return BlobCreate(
-            id=db_blob.id,
-            data=blob.data,            # return Base6
-        )
+        return blob_metadata
 
     except Exception as e:
-        logger.error(f"Error creating BlobData with ID {blob.id}: {e}")
+        await db.rollback()
+        logger.error(f"Error creating blob with ID {blob_metadata.id}: {e}")
         return None
 
-# ---------- Retrieve BlobData ----------
-async def get_blob_data(
-    blob_id,
+# ---------- Retrieve BlobData + BlobMetadata ----------
+async def get_blob_with_metadata(
     db: AsyncSession,
-) -> BlobCreate | None:
+    blob_id,
+    shared_content: bool = False,
+) -> BlobMetadata | None:
+    """Metadata with its payload eagerly joined: one SELECT, raw BYTEA."""
     try:
         result = await db.execute(
-            select(BlobData).where(BlobData.id == blob_id)
+            select(BlobMetadata)
+            .options(joinedload(BlobMetadata.blob_data, innerjoin=True))
+            .where(BlobMetadata.id == blob_id)
+            .where(BlobMetadata.shared_content == shared_content)
         )
-        db_blob = result.scalar_one_or_none()
-
-        if not db_blob:
-            return None
+        return result.scalar_one_or_none()
+    except Exception as e:
+        logger.error(f"Error retrieving blob with ID {blob_id}: {e}")
+        return None
 
-        # bytes → Base64
-        base64_data = base64.b64encode(db_blob.data).decode("utf-8")
 
-        return BlobCreate(
-            id=blob_id,
-            data=base64_data
+# ---------- Stream BlobData ----------
+async def get_blob_data_info(
+    db: AsyncSession,
+    blob_id,
+    shared_content: bool = False,
+):
+    """Payload length plus metadata, without loading the payload itself."""
+    try:
+        result = await db.execute(
+            select(
+                func.length(BlobData.data).label("size"),
+                BlobMetadata.created_at,
+                BlobMetadata.name,
+            )
+            .join(BlobMetadata, BlobMetadata.id == BlobData.id)
+            .where(BlobData.id == blob_id)
+            .where(BlobMetadata.shared_content == shared_content)
         )
-
+        return result.one_or_none()
     except Exception as e:
-        logger.error(f"Error retrieving BlobData with ID {blob_id}: {e}")
+        logger.error(f"Error retrieving BlobData info with ID {blob_id}: {e}")
         return None
 
 
+async def get_blob_data_slice(
+    db: AsyncSession,
+    blob_id,
+    offset: int,
+    length: int,
+) -> bytes | None:
+    """`length` bytes of the payload starting at `offset` (0-based)."""
+    result = await db.execute(
+        # SQL substring() is 1-based
+        select(func.substring(BlobData.data, offset + 1, length))
+        .where(BlobData.id == blob_id)
+    )
+    return result.scalar_one_or_none()
+
+
 # ---------- BlobMetadata ----------
 async def create_blob_metadata(
     db: AsyncSession,
@@ -68,13 +97,50 @@ async def create_blob_metadata(
 ) -> BlobMetadata | None:
     try:
         db.add(blob_metadata)
+        # callers set created_at, so no refresh round trip is needed
         await db.commit()
-        await db.refresh(blob_metadata)
         return blob_metadata
     except Exception as e:
+        await db.rollback()
         logger.error(f"Error creating BlobMetadata with ID {blob_metadata.id}: {e}")
         return None
 
+# ---------- Batch of BlobMetadata (+ BlobData) ----------
+# rows per INSERT: asyncpg takes at most 32767 bind parameters a statement
+_INSERT_BATCH_ROWS = 1000
+
+
+async def create_blob_metadata_many(
+    db: AsyncSession,
+    blobs: list[BlobMetadata],
+) -> bool:
+    """
+    Insert the metadata of many blobs, and the payloads of those that
+    carry blob_data, with multi-row INSERTs in one transaction.
+    """
+    metadata_columns = [column.key for column in BlobMetadata.__table__.columns]
+    try:
+        for start in range(0, len(blobs), _INSERT_BATCH_ROWS):
+            part = blobs[start:start + _INSERT_BATCH_ROWS]
+            await db.execute(
+                insert(BlobMetadata).values(
+                    [{key: getattr(blob, key) for key in metadata_columns} for blob in part]
+                )
+            )
+            payloads = [
+                {"id": blob.id, "data": blob.blob_data.data}
+                for blob in part
+                if blob.blob_data is not None
+            ]
+            if payloads:
+                await db.execute(insert(BlobData).values(payloads))
+        await db.commit()
+        return True
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error creating a batch of {len(blobs)} BlobMetadata rows: {e}")
+        return False
+
 # ---------- Retrieve BlobMetadata ----------
 async def get_blob_metadata(
     db: AsyncSession,
@@ -88,3 +154,190 @@ async def get_blob_metadata(
     except Exception as e:
         logger.error(f"Error retrieving BlobMetadata with ID {blob_id}: {e}")
         return None
+
+
+# ---------- Update BlobMetadata ----------
+async def update_blob_encoding(
+    db: AsyncSession,
+    blob_id: str,
+    content_encoding: str,
+    uncompressed_size: int,
+) -> bool:
+    """Record how a freshly stored blob is encoded at rest."""
+    try:
+        result = await db.execute(
+            update(BlobMetadata)
+            .where(BlobMetadata.id == blob_id)
+            .values(content_encoding=content_encoding, uncompressed_size=uncompressed_size)
+        )
+        await db.commit()
+        return result.rowcount > 0
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error updating encoding of BlobMetadata with ID {blob_id}: {e}")
+        return False
+
+
+# ---------- Delete BlobMetadata ----------
+async def delete_blob_metadata(
+    db: AsyncSession,
+    blob_id: str,
+    shared_content: bool = False,
+) -> bool:
+    """Delete a blob's metadata row (and its blob_data, by cascade)."""
+    try:
+        result = await db.execute(
+            delete(BlobMetadata)
+            .where(BlobMetadata.id == blob_id)
+            .where(BlobMetadata.shared_content == shared_content)
+        )
+        await db.commit()
+        return result.rowcount > 0
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error deleting BlobMetadata with ID {blob_id}: {e}")
+        raise
+
+
+# ---------- BlobContent (deduplicated blobs) ----------
+# These do not commit: the caller commits once its content object is in
+# place, and the digest stays locked until then.
+async def lock_content(
+    db: AsyncSession,
+    digest: str,
+) -> BlobContent | None:
+    """Lock a digest for the rest of the transaction and fetch its content row."""
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:digest))"), {"digest": digest}
+    )
+    result = await db.execute(
+        select(BlobContent).where(BlobContent.digest == digest)
+    )
+    return result.scalar_one_or_none()
+
+
+async def reference_content(
+    db: AsyncSession,
+    content: BlobContent | None,
+    digest: str,
+    size: int,
+) -> None:
+    """Count one more reference to a (locked) digest, creating its row if needed."""
+    if content is None:
+        db.add(BlobContent(digest=digest, size=size, refcount=1))
+    else:
+        content.refcount += 1
+    # referencing rows' foreign keys need the content row first
+    await db.flush()
+
+
+async def release_content(
+    db: AsyncSession,
+    digest: str,
+) -> int:
+    """Drop one reference to a digest (locking it); returns the references left."""
+    content = await lock_content(db, digest)
+    if content is None:
+        return 0
+
+    content.refcount -= 1
+    if content.refcount <= 0:
+        await db.delete(content)
+    await db.flush()
+    return max(content.refcount, 0)
+
+
+async def add_content_reference(
+    db: AsyncSession,
+    content: BlobContent | None,
+    digest: str,
+    size: int,
+    blob_metadata: BlobMetadata,
+) -> None:
+    """Count one more reference to a (locked) digest and add the blob's row."""
+    await reference_content(db, content, digest, size)
+
+    blob_metadata.content_digest = digest
+    db.add(blob_metadata)
+    await db.flush()
+
+
+async def release_content_reference(
+    db: AsyncSession,
+    blob_id: str,
+) -> tuple[str, int] | None:
+    """
+    Delete a deduplicated blob's row and drop its reference.
+
+    Returns the digest and the references left to it (the content row is
+    gone at 0), or None if the blob is not a reference.
+    """
+    result = await db.execute(
+        delete(BlobMetadata)
+        .where(BlobMetadata.id == blob_id, BlobMetadata.content_digest.is_not(None))
+        .returning(BlobMetadata.content_digest)
+    )
+    digest = result.scalar_one_or_none()
+    if digest is None:
+        return None
+
+    return digest, await release_content(db, digest)
+
+
+# ---------- BlobChunk (chunked blobs) ----------
+async def create_chunked_blob(
+    db: AsyncSession,
+    blob_metadata: BlobMetadata,
+    chunks: list[BlobChunk],
+) -> BlobMetadata | None:
+    """Insert a chunked blob's metadata and manifest in one transaction."""
+    try:
+        blob_metadata.chunk_count = len(chunks)
+        db.add(blob_metadata)
+        await db.flush()
+        db.add_all(chunks)
+        await db.commit()
+        return blob_metadata
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error creating chunked blob with ID {blob_metadata.id}: {e}")
+        return None
+
+
+async def get_blob_chunks(
+    db: AsyncSession,
+    blob_id: str,
+) -> list[BlobChunk]:
+    """Manifest of a chunked blob, in order."""
+    result = await db.execute(
+        select(BlobChunk)
+        .where(BlobChunk.blob_id == blob_id)
+        .order_by(BlobChunk.position)
+    )
+    return list(result.scalars())
+
+
+async def release_blob_chunks(
+    db: AsyncSession,
+    blob_id: str,
+) -> list[tuple[str, int]] | None:
+    """
+    Delete a chunked blob's rows and drop the references of its chunks.
+
+    Returns each chunk digest with the references left to it, or None if
+    the blob is not chunked. Digests are locked in sorted order, so
+    concurrent deletes cannot deadlock. Does not commit.
+    """
+    result = await db.execute(
+        delete(BlobChunk).where(BlobChunk.blob_id == blob_id).returning(BlobChunk.digest)
+    )
+    digests = sorted(result.scalars())
+    result = await db.execute(
+        delete(BlobMetadata)
+        .where(BlobMetadata.id == blob_id, BlobMetadata.chunk_count.is_not(None))
+        .returning(BlobMetadata.id)
+    )
+    if result.scalar_one_or_none() is None:
+        return None
+
+    return [(digest, await release_content(db, digest)) for digest in digests]
@@ -1,4 +1,4 @@
-from sqlalchemy import UUID, Column, String, DateTime, Integer, Enum, Text, Index, ForeignKey
+from sqlalchemy import UUID, BigInteger, Boolean, Column, String, DateTime, Integer, Enum, Text, Index, ForeignKey, false
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -10,11 +10,13 @@ import uuid
 class BlobData(Base):
     __tablename__ = "blob_data"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4) 
+    # payload of blobs kept by the database backend; every blob, whatever the
+    # backend, has a blob_metadata row
+    id = Column(UUID(as_uuid=True), ForeignKey("blob_metadata.id", ondelete="CASCADE"), primary_key=True, default=uuid.uuid4)
     data = Column(BYTEA, nullable=False)  
     
     # relationship with BlobMetadata
-    blob_metadata = relationship("BlobMetadata", back_populates="blob_data", uselist=False, cascade="all, delete-orphan")
+    blob_metadata = relationship("BlobMetadata", back_populates="blob_data")
 
     # single blob_data has one blob_metadata
     def __repr__(self):
@@ -24,24 +26,65 @@ class BlobData(Base):
 class BlobMetadata(Base):
     __tablename__ = "blob_metadata"
     
-    id = Column(UUID(as_uuid=True), ForeignKey("blob_data.id", ondelete="CASCADE"), primary_key=True, default=uuid.uuid4)
-    size = Column(Integer, nullable=False)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    size = Column(BigInteger, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     storage_backend = Column(Enum(StorageBackend, create_constraint=True), nullable=False)
-    storage_path = Column(Text, nullable=True) 
+    storage_path = Column(Text, nullable=True)  # exact key of the object in its backend
+    content_encoding = Column(String(16), nullable=True)  # ContentEncoding, NULL for legacy objects
+    # compressed blobs: payload size before compression (size is the stored size)
+    uncompressed_size = Column(BigInteger, nullable=True)
+    # deduplicated blobs: the shared content they reference (no storage_path of their own)
+    content_digest = Column(String(64), ForeignKey("blob_content.digest"), nullable=True)
+    # chunked blobs: number of blob_chunk rows they are made of
+    chunk_count = Column(Integer, nullable=True)
+    # content objects of deduplicated blobs: internal, never served by id
+    shared_content = Column(Boolean, nullable=False, default=False, server_default=false())
     
     name = Column(String(500), nullable=True)
     path = Column(Text, nullable=True)  
     
-    # relationship with BlobData
-    blob_data = relationship("BlobData", back_populates="blob_metadata")
+    # relationship with BlobData (database backend only)
+    blob_data = relationship("BlobData", back_populates="blob_metadata", uselist=False, cascade="all, delete-orphan")
 
     # Indexes
     __table_args__ = (
         Index('idx_name_path', 'name', 'path'),
         Index('idx_created_at', 'created_at'),
         Index('idx_storage_backend', 'storage_backend'),
+        Index('idx_content_digest', 'content_digest'),
     )
     # 
     def __repr__(self):
-        return f"<BlobMetadata(id={self.id}, size={self.size}, backend={self.storage_backend})>"
\ No newline at end of file
+        return f"<BlobMetadata(id={self.id}, size={self.size}, backend={self.storage_backend})>"
+
+
+class BlobContent(Base):
+    __tablename__ = "blob_content"
+
+    # one stored content object per sha256, shared by deduplicated blobs
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False)    # blob_metadata / blob_chunk rows referencing it
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<BlobContent(digest={self.digest}, refcount={self.refcount})>"
+
+
+class BlobChunk(Base):
+    __tablename__ = "blob_chunk"
+
+    # manifest of a chunked blob: its content-defined chunks, in order
+    blob_id = Column(UUID(as_uuid=True), ForeignKey("blob_metadata.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    digest = Column(String(64), ForeignKey("blob_content.digest"), nullable=False)
+    offset = Column(BigInteger, nullable=False)   # of the chunk's first byte in the blob
+    size = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index('idx_chunk_digest', 'digest'),
+    )
+
+    def __repr__(self):
+        return f"<BlobChunk(blob_id={self.blob_id}, position={self.position}, digest={self.digest})>"
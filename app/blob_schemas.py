@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, ValidationInfo, field_validator
 from datetime import datetime
 from typing import Optional
 import base64
@@ -7,13 +7,23 @@ from datetime import datetime, timezone
 from pydantic import BaseModel, field_serializer
 
 
+# Validation context for models built from payloads the service encoded
+# itself: the Base64 check (a full decode of the payload) is skipped.
+TRUSTED_PAYLOAD = {"trusted_payload": True}
+
+
+def _is_trusted(info: ValidationInfo) -> bool:
+    return bool(info.context and info.context.get("trusted_payload"))
+
 
 class BlobCreate(BaseModel):
     id: uuid.UUID = Field(default_factory=uuid.uuid4)  
-    data: bytes  # Base64 encoded
+    data: Optional[bytes] = None  # Base64 encoded, not echoed by streamed uploads
 
     @field_validator('data')
-    def validate_base64(cls, v):
+    def validate_base64(cls, v, info: ValidationInfo):
+        if v is None or _is_trusted(info):
+            return v
         try:
             # Try to decode the base64 data
             base64.b64decode(v, validate=True)
@@ -35,7 +45,9 @@ class BlobResponse(BaseModel):
     storage_path: Optional[str] = None
 
     @field_validator('data')
-    def validate_base64(cls, v):
+    def validate_base64(cls, v, info: ValidationInfo):
+        if _is_trusted(info):
+            return v
         try:
             # Try to decode the base64 data
             base64.b64decode(v, validate=True)
@@ -71,4 +83,17 @@ class ErrorResponse(BaseModel):
 
 class StorageConfig(BaseModel):
     backend: str
-    config: dict
\ No newline at end of file
+    config: dict
+
+
+class BatchItemResult(BaseModel):
+    filename: Optional[str] = None
+    id: Optional[uuid.UUID] = None   # None when the file was not stored
+    status: int                      # 201 when created, 500 otherwise
+    error: Optional[str] = None
+
+
+class BatchCreateResponse(BaseModel):
+    created: int
+    failed: int
+    items: list[BatchItemResult]     # in the order the files were sent
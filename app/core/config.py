@@ -11,6 +11,22 @@ class StorageBackend(str, Enum):
     LOCAL = "local"
     FTP = "ftp"
 
+class ContentEncoding(str, Enum):
+    IDENTITY = "identity"   # raw bytes
+    BASE64 = "base64"       # how blobs were stored before the binary-native format
+    ZLIB = "zlib"           # compressed at rest (see Compression)
+    ZSTD = "zstd"
+
+class Compression(str, Enum):
+    NONE = "none"
+    ZLIB = "zlib"
+    ZSTD = "zstd"           # needs the optional zstandard package
+
+class PayloadSigning(str, Enum):
+    SIGNED = "signed"         # SHA256 of the whole payload, needs it spooled first
+    STREAMING = "streaming"   # aws-chunked, each chunk signed as it is sent
+    UNSIGNED = "unsigned"     # UNSIGNED-PAYLOAD, integrity left to TLS
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 class Settings(BaseSettings):
@@ -37,6 +53,29 @@ class Settings(BaseSettings):
     S3_BUCKET: str = "simple-drive"
     S3_REGION: str = "us-east-1"
 
+    # S3 HTTP connection pool (shared by all requests, kept alive between them)
+    S3_POOL_MAX_CONNECTIONS: int = Field(100, env="S3_POOL_MAX_CONNECTIONS")
+    S3_POOL_MAX_KEEPALIVE: int = Field(20, env="S3_POOL_MAX_KEEPALIVE")
+    S3_KEEPALIVE_EXPIRY: float = Field(30.0, env="S3_KEEPALIVE_EXPIRY")
+    S3_CONNECT_TIMEOUT: float = Field(10.0, env="S3_CONNECT_TIMEOUT")
+    S3_READ_TIMEOUT: float = Field(60.0, env="S3_READ_TIMEOUT")
+    # How upload payloads are signed, and the aws-chunked frame size
+    S3_PAYLOAD_SIGNING: PayloadSigning = Field(PayloadSigning.STREAMING, env="S3_PAYLOAD_SIGNING")
+    S3_SIGNED_CHUNK_SIZE: int = Field(64 * 1024, env="S3_SIGNED_CHUNK_SIZE")
+
+    # S3 multipart upload: objects from the threshold up are sent in parts
+    # (S3 requires parts of at least 5 MiB, except the last one)
+    S3_MULTIPART_THRESHOLD: int = Field(64 * 1024 * 1024, env="S3_MULTIPART_THRESHOLD")
+    S3_MULTIPART_PART_SIZE: int = Field(16 * 1024 * 1024, env="S3_MULTIPART_PART_SIZE")
+    S3_MULTIPART_CONCURRENCY: int = Field(4, env="S3_MULTIPART_CONCURRENCY")
+    # Parallel ranged GETs for spans from the threshold up
+    S3_PARALLEL_GET_THRESHOLD: int = Field(64 * 1024 * 1024, env="S3_PARALLEL_GET_THRESHOLD")
+    S3_DOWNLOAD_PART_SIZE: int = Field(8 * 1024 * 1024, env="S3_DOWNLOAD_PART_SIZE")
+    S3_DOWNLOAD_CONCURRENCY: int = Field(4, env="S3_DOWNLOAD_CONCURRENCY")
+    # Attempts after the first for a failed part, with exponential backoff
+    S3_MAX_RETRIES: int = Field(3, env="S3_MAX_RETRIES")
+    S3_RETRY_BACKOFF: float = Field(0.5, env="S3_RETRY_BACKOFF")
+
     # aws credentials
     AWS_ACCESS_KEY_ID: str = Field(..., env="AWS_ACCESS_KEY_ID")    
     AWS_SECRET_ACCESS_KEY: str = Field(..., env="AWS_SECRET_ACCESS_KEY")
@@ -48,13 +87,106 @@ class Settings(BaseSettings):
     FTP_USERNAME: str = Field(..., env="FTP_USERNAME")
     FTP_PASSWORD: str = Field(..., env="FTP_PASSWORD")  
     FTP_DIRECTORY: str = Field("/", env="FTP_DIRECTORY")
+    # Pool of logged-in FTPS sessions reused across requests
+    FTP_POOL_SIZE: int = Field(4, env="FTP_POOL_SIZE")
+    # seconds to wait for a free session
+    FTP_POOL_TIMEOUT: float = Field(30.0, env="FTP_POOL_TIMEOUT")
+    # sessions idle longer than this are probed with NOOP on checkout
+    FTP_POOL_CHECK_AFTER: float = Field(5.0, env="FTP_POOL_CHECK_AFTER")
+    FTP_POOL_KEEPALIVE_INTERVAL: float = Field(60.0, env="FTP_POOL_KEEPALIVE_INTERVAL")
 
     # Local storage configuration
     LOCAL_STORAGE_PATH: str = "./storage"
+    # Saves are acknowledged only once fsynced; the last fsyncs of saves
+    # landing within LOCAL_FSYNC_WINDOW seconds are shared (0: one per save)
+    LOCAL_FSYNC: bool = Field(True, env="LOCAL_FSYNC")
+    LOCAL_FSYNC_WINDOW: float = Field(0.002, env="LOCAL_FSYNC_WINDOW")
+    # Pack files: blobs up to LOCAL_PACK_MAX_BLOB_SIZE are appended to shared
+    # segment files instead of getting one file each
+    LOCAL_PACK_ENABLED: bool = Field(False, env="LOCAL_PACK_ENABLED")
+    LOCAL_PACK_MAX_BLOB_SIZE: int = Field(16 * 1024, env="LOCAL_PACK_MAX_BLOB_SIZE")
+    LOCAL_PACK_SEGMENT_SIZE: int = Field(64 * 1024 * 1024, env="LOCAL_PACK_SEGMENT_SIZE")
+    # sealed segments are compacted once this share of them is deleted blobs
+    LOCAL_PACK_COMPACT_RATIO: float = Field(0.5, env="LOCAL_PACK_COMPACT_RATIO")
+    LOCAL_PACK_COMPACT_INTERVAL: float = Field(300.0, env="LOCAL_PACK_COMPACT_INTERVAL")
+
+    # Dedicated threads for blocking backend I/O (also their concurrency limit)
+    LOCAL_IO_THREADS: int = Field(8, env="LOCAL_IO_THREADS")
+    FTP_IO_THREADS: int = Field(4, env="FTP_IO_THREADS")
 
     # Database storage configuration
     DB_STORAGE_TABLE: str = "blob_storage"
 
+    # Upload streaming: size of each chunk read from the request body
+    UPLOAD_CHUNK_SIZE: int = Field(1024 * 1024, env="UPLOAD_CHUNK_SIZE")
+    # Batch uploads (POST /blobs:batch): files per request, and how many of
+    # them are written to the backend at once
+    BATCH_UPLOAD_MAX_FILES: int = Field(1000, env="BATCH_UPLOAD_MAX_FILES")
+    BATCH_UPLOAD_CONCURRENCY: int = Field(8, env="BATCH_UPLOAD_CONCURRENCY")
+    # Database backend: payload bytes a batch holds before inserting its rows so far
+    BATCH_UPLOAD_MAX_PENDING_BYTES: int = Field(64 * 1024 * 1024, env="BATCH_UPLOAD_MAX_PENDING_BYTES")
+    # Download streaming: size of each chunk read from the backend
+    DOWNLOAD_CHUNK_SIZE: int = Field(1024 * 1024, env="DOWNLOAD_CHUNK_SIZE")
+
+    # Objects with no recorded content encoding were written Base64 encoded;
+    # keep decoding them until the store has been rewritten
+    LEGACY_BASE64_READS: bool = Field(True, env="LEGACY_BASE64_READS")
+
+    # Look for blobs missing from the locator index by listing the backend
+    # (S3 bucket, FTP directory, flat local layout). Off, misses are 404 at
+    # once: index old objects with app.storage.backfill_locations instead
+    LEGACY_LOCATION_SCANS: bool = Field(False, env="LEGACY_LOCATION_SCANS")
+
+    # Blob locator index: recent id -> storage key lookups kept in memory,
+    # for at most LOCATOR_CACHE_TTL seconds (deletes by other workers show then)
+    LOCATOR_CACHE_SIZE: int = Field(10_000, env="LOCATOR_CACHE_SIZE")
+    LOCATOR_CACHE_TTL: float = Field(30.0, env="LOCATOR_CACHE_TTL")
+
+    # Read-through cache of whole blobs in front of the storage backend (per worker)
+    BLOB_CACHE_ENABLED: bool = Field(False, env="BLOB_CACHE_ENABLED")
+    BLOB_CACHE_MAX_BYTES: int = Field(256 * 1024 * 1024, env="BLOB_CACHE_MAX_BYTES")
+    # larger blobs are never cached
+    BLOB_CACHE_MAX_OBJECT_SIZE: int = Field(8 * 1024 * 1024, env="BLOB_CACHE_MAX_OBJECT_SIZE")
+    BLOB_CACHE_TTL: float = Field(300.0, env="BLOB_CACHE_TTL")
+
+    # Concurrent retrieves of the same blob share one backend fetch; at most
+    # this many callers wait on one fetch, the rest make their own
+    SINGLE_FLIGHT_ENABLED: bool = Field(True, env="SINGLE_FLIGHT_ENABLED")
+    SINGLE_FLIGHT_MAX_WAITERS: int = Field(1000, env="SINGLE_FLIGHT_MAX_WAITERS")
+
+    # On-disk cache of S3 / FTP blobs shared by the workers of a host
+    DISK_CACHE_ENABLED: bool = Field(False, env="DISK_CACHE_ENABLED")
+    DISK_CACHE_PATH: str = Field("./cache", env="DISK_CACHE_PATH")
+    DISK_CACHE_MAX_BYTES: int = Field(10 * 1024 * 1024 * 1024, env="DISK_CACHE_MAX_BYTES")
+    # larger blobs are always streamed from the remote
+    DISK_CACHE_MAX_OBJECT_SIZE: int = Field(1024 * 1024 * 1024, env="DISK_CACHE_MAX_OBJECT_SIZE")
+
+    # Content-addressed deduplication: each distinct upload (by sha256) is
+    # stored once; uploads are spooled in memory up to DEDUP_SPOOL_MEMORY
+    # bytes, on disk beyond that, while they are hashed
+    DEDUP_ENABLED: bool = Field(False, env="DEDUP_ENABLED")
+    DEDUP_SPOOL_MEMORY: int = Field(8 * 1024 * 1024, env="DEDUP_SPOOL_MEMORY")
+    # Chunk-level dedup: uploads are split into content-defined chunks
+    # (FastCDC-style) that are stored once each, so versions of a file
+    # share the chunks they have in common
+    DEDUP_CHUNKING: bool = Field(False, env="DEDUP_CHUNKING")
+    DEDUP_CHUNK_MIN_SIZE: int = Field(512 * 1024, env="DEDUP_CHUNK_MIN_SIZE")
+    DEDUP_CHUNK_AVG_SIZE: int = Field(1024 * 1024, env="DEDUP_CHUNK_AVG_SIZE")
+    DEDUP_CHUNK_MAX_SIZE: int = Field(4 * 1024 * 1024, env="DEDUP_CHUNK_MAX_SIZE")
+    # chunks fetched ahead of the one being sent when reading a chunked blob
+    DEDUP_CHUNK_READ_AHEAD: int = Field(2, env="DEDUP_CHUNK_READ_AHEAD")
+
+    # Compression at rest, per backend; payloads that already look compressed
+    # (sampled entropy above COMPRESSION_MAX_ENTROPY bits per byte) are stored as is
+    LOCAL_COMPRESSION: Compression = Field(Compression.NONE, env="LOCAL_COMPRESSION")
+    S3_COMPRESSION: Compression = Field(Compression.NONE, env="S3_COMPRESSION")
+    FTP_COMPRESSION: Compression = Field(Compression.NONE, env="FTP_COMPRESSION")
+    DB_COMPRESSION: Compression = Field(Compression.NONE, env="DB_COMPRESSION")
+    # codec level, None for the codec's default (zlib 6, zstd 3)
+    COMPRESSION_LEVEL: Optional[int] = Field(None, env="COMPRESSION_LEVEL")
+    COMPRESSION_MAX_ENTROPY: float = Field(7.5, env="COMPRESSION_MAX_ENTROPY")
+    COMPRESSION_SAMPLE_SIZE: int = Field(64 * 1024, env="COMPRESSION_SAMPLE_SIZE")
+
     # Media directory
     # BASE_DIR: str = str(Path(__file__).resolve().parent.parent.parent)
     MEDIA_DIR: str = os.path.join(BASE_DIR, "media")
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from .config import settings
@@ -26,4 +27,14 @@ class Base(DeclarativeBase):
 
 async def get_db():
     async with async_session() as db:
-        yield db
\ No newline at end of file
+        yield db
+
+
+@asynccontextmanager
+async def use_session(db: AsyncSession | None = None):
+    """Reuse `db` when given, otherwise open a short-lived session."""
+    if db is not None:
+        yield db
+    else:
+        async with async_session() as new_db:
+            yield new_db
@@ -1,17 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.router import api_router
 from app.core.database import engine , Base
 from app.core.logger  import   setup_logger
+from app import s3_client
+from app.storage.ftp_storage import ftp_pool
+from app.storage.executors import ftp_io, local_io
+from app.storage.local_storage import run_pack_compaction
+from app.storage.pack_store import close_pack_stores
+from app.core.config import settings
 
 logger = setup_logger(__name__)
 
 logger.info("Starting Simple Drive API application")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one keep-alive connection pool for every S3 request of the worker
+    s3_client.open_client()
+    ftp_keepalive = asyncio.create_task(ftp_pool.run_keepalive())
+    pack_compaction = (
+        asyncio.create_task(run_pack_compaction()) if settings.LOCAL_PACK_ENABLED else None
+    )
+    yield
+    ftp_keepalive.cancel()
+    if pack_compaction:
+        pack_compaction.cancel()
+    await ftp_io.run(ftp_pool.close)
+    ftp_io.shutdown()
+    local_io.shutdown()
+    close_pack_stores()
+    await s3_client.close_client()
+
+
 app = FastAPI(
     title="Simple Drive API",
     description="A simple object storage system with multiple backends",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # @app.on_event("startup")
@@ -1,13 +1,17 @@
 import hashlib
 import hmac
 import datetime
-import requests
+import os
+import httpx
+from functools import lru_cache
+from typing import AsyncIterator, BinaryIO
 from urllib.parse import urlencode
 
 from app.core.config import settings
 from app.core.logger import setup_logger
+from app.storage.executors import local_io
+from app.storage.streaming import rechunk
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
@@ -22,8 +26,54 @@ BUCKET = settings.S3_BUCKET
 ENDPOINT = f"s3.{REGION}.amazonaws.com"
 SERVICE = "s3"
 
+# Shared connection pool, opened and closed by the app lifespan
+_client: httpx.AsyncClient | None = None
+
+
+def open_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """Create the shared S3 HTTP client (keep-alive connection pool)."""
+    global _client
+
+    if _client is None:
+        _client = httpx.AsyncClient(
+            transport=transport,
+            limits=httpx.Limits(
+                max_connections=settings.S3_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.S3_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.S3_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.S3_READ_TIMEOUT, connect=settings.S3_CONNECT_TIMEOUT
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared S3 HTTP client and its pooled connections."""
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _iter_file(f: BinaryIO) -> AsyncIterator[bytes]:
+    # spool files may have spilled to disk: read them off the event loop
+    while chunk := await local_io.run(f.read, settings.UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+async def _iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
 
 # AWS Signature Version 4
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+STREAMING_PAYLOAD = "STREAMING-AWS4-HMAC-SHA256-PAYLOAD"
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
 def sign(key, msg):
     return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
 
@@ -38,15 +88,78 @@ def get_signature_key(key, date_stamp, region_name, service_name):
     return sign(k_service, "aws4_request")
 
 
-def s3_request(
+@lru_cache(maxsize=8)
+def cached_signature_key(key, date_stamp, region_name, service_name):
+    """The signing key only changes once a day: derive it once per date."""
+    return get_signature_key(key, date_stamp, region_name, service_name)
+
+
+def chunk_signature(signing_key, amz_date, credential_scope, previous_signature, chunk):
+    """Signature of one aws-chunked frame, chained to the previous one."""
+    string_to_sign = (
+        f"AWS4-HMAC-SHA256-PAYLOAD\n"
+        f"{amz_date}\n"
+        f"{credential_scope}\n"
+        f"{previous_signature}\n"
+        f"{EMPTY_SHA256}\n"
+        f"{hashlib.sha256(chunk).hexdigest()}"
+    )
+    return hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def _frame_size(chunk_size: int) -> int:
+    # <hex size>;chunk-signature=<64 hex>\r\n<data>\r\n
+    return len(f"{chunk_size:x};chunk-signature=") + 64 + 2 + chunk_size + 2
+
+
+def aws_chunked_length(decoded_length: int, chunk_size: int) -> int:
+    """Content-Length of a payload sent as aws-chunked frames of `chunk_size`."""
+    full, last = divmod(decoded_length, chunk_size)
+    length = full * _frame_size(chunk_size) + _frame_size(0)
+    if last:
+        length += _frame_size(last)
+    return length
+
+
+async def _aws_chunked(
+    chunks: AsyncIterator[bytes], signing_key, amz_date, credential_scope, seed_signature
+) -> AsyncIterator[bytes]:
+    """Frame and sign the payload as it streams, ending with the empty chunk."""
+    signature = seed_signature
+    async for chunk in rechunk(chunks, settings.S3_SIGNED_CHUNK_SIZE):
+        signature = chunk_signature(signing_key, amz_date, credential_scope, signature, chunk)
+        yield f"{len(chunk):x};chunk-signature={signature}\r\n".encode() + chunk + b"\r\n"
+
+    signature = chunk_signature(signing_key, amz_date, credential_scope, signature, b"")
+    yield f"0;chunk-signature={signature}\r\n\r\n".encode()
+
+
+async def s3_request(
     method: str,
     object_key: str = "",
-    data: bytes = b"",
+    data: bytes | BinaryIO | AsyncIterator[bytes] = b"",
     params: dict | None = None,
+    payload_hash: str | None = None,
+    headers: dict | None = None,
+    stream: bool = False,
+    content_length: int | None = None,
 ):
+    """
+    Send a SigV4 signed request to S3.
+
+    `data` may also be a file object positioned at the start of the payload,
+    or an async iterator of chunks with its total `content_length`; both are
+    streamed. They are never hashed here: pass their SHA256 hex digest as
+    `payload_hash`, or UNSIGNED_PAYLOAD, or STREAMING_PAYLOAD to sign each
+    chunk as it is sent (aws-chunked encoding).
+    Extra `headers` (e.g. Range) are sent unsigned. With `stream=True` the
+    response body is not read up front and must be consumed or closed
+    (`aiter_bytes()` / `aclose()`).
+    """
+    payload_size = len(data) if isinstance(data, (bytes, bytearray)) else "stream"
     logger.info(
         f"S3 request started | method={method} "
-        f"object_key={object_key} payload_size={len(data)}"
+        f"object_key={object_key} payload_size={payload_size}"
     )
 
     try:
@@ -74,20 +187,44 @@ def s3_request(
         if canonical_query_string:
             url += f"?{canonical_query_string}"
 
-        payload_hash = hashlib.sha256(data).hexdigest()
+        content = data
+        headers = dict(headers or {})
+        if hasattr(data, "read"):
+            # S3 rejects chunked uploads: send the file with its length
+            start = data.tell()
+            content_length = data.seek(0, os.SEEK_END) - start
+            data.seek(start)
+            content = _iter_file(data)
+        elif payload_hash == STREAMING_PAYLOAD and isinstance(data, (bytes, bytearray)):
+            content_length = len(data)
+            content = _iter_bytes(data)
+
+        if payload_hash is None:
+            payload_hash = hashlib.sha256(data).hexdigest()
 
         logger.debug(f"Request URL: {url}")
         logger.debug(f"Canonical URI: {canonical_uri}")
         logger.debug(f"Payload SHA256: {payload_hash}")
         logger.debug(f"AMZ Date: {amz_date}")
 
-        canonical_headers = (
-            f"host:{ENDPOINT}\n"
-            f"x-amz-content-sha256:{payload_hash}\n"
-            f"x-amz-date:{amz_date}\n"
+        amz_headers = {
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+        }
+        if payload_hash == STREAMING_PAYLOAD:
+            amz_headers["x-amz-decoded-content-length"] = str(content_length)
+            headers["Content-Encoding"] = "aws-chunked"
+            content_length = aws_chunked_length(
+                content_length, settings.S3_SIGNED_CHUNK_SIZE
+            )
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+
+        canonical_headers = f"host:{ENDPOINT}\n" + "".join(
+            f"{name}:{value}\n" for name, value in sorted(amz_headers.items())
         )
 
-        signed_headers = "host;x-amz-content-sha256;x-amz-date"
+        signed_headers = ";".join(["host", *sorted(amz_headers)])
 
         canonical_request = (
             f"{method}\n"
@@ -112,14 +249,19 @@ def s3_request(
         logger.debug("String To Sign:")
         logger.debug(string_to_sign)
 
-        signing_key = get_signature_key(SECRET_KEY, date_stamp, REGION, SERVICE)
+        signing_key = cached_signature_key(SECRET_KEY, date_stamp, REGION, SERVICE)
         signature = hmac.new(
             signing_key, string_to_sign.encode(), hashlib.sha256
         ).hexdigest()
 
+        if payload_hash == STREAMING_PAYLOAD:
+            content = _aws_chunked(
+                content, signing_key, amz_date, credential_scope, signature
+            )
+
         headers = {
-            "x-amz-date": amz_date,
-            "x-amz-content-sha256": payload_hash,
+            **headers,
+            **amz_headers,
             "Authorization": (
                 f"AWS4-HMAC-SHA256 "
                 f"Credential={ACCESS_KEY}/{credential_scope}, "
@@ -128,11 +270,14 @@ def s3_request(
             ),
         }
 
-        response = requests.request(method, url, headers=headers, data=data)
+        client = open_client()
+        request = client.build_request(method, url, headers=headers, content=content)
+        response = await client.send(request, stream=stream)
 
         logger.info(f"S3 response status: {response.status_code}")
 
         if response.status_code >= 400:
+            await response.aread()
             logger.error("S3 error response body:")
             logger.error(response.text)
 
@@ -3,6 +3,11 @@ from app.storage.s3_storage import S3Storage
 from app.storage.database_storage import DatabaseStorage
 from app.storage.local_storage import LocalStorage
 from app.storage.ftp_storage import FTPStorage
+from app.storage.cache import CachedStorage, blob_cache
+from app.storage.compression import CompressedStorage
+from app.storage.dedup import DedupStorage, chunker
+from app.storage.disk_cache import DiskCachedStorage, disk_cache
+from app.storage.single_flight import SingleFlightStorage, blob_flights
 from app.core.config import StorageBackend, settings
 
 def get_storage_backend(backend_type: StorageBackend = None) -> StorageBackendInterface:
@@ -20,5 +25,22 @@ def get_storage_backend(backend_type: StorageBackend = None) -> StorageBackendIn
     backend_class = backends.get(backend_type)
     if not backend_class:
         raise ValueError(f"Unsupported storage backend: {backend_type}")
-    
-    return backend_class()
\ No newline at end of file
+
+    backend = backend_class()
+    # remote backends: the host's disk cache, then the worker's memory cache
+    if settings.DISK_CACHE_ENABLED and backend_type in (StorageBackend.S3, StorageBackend.FTP):
+        backend = DiskCachedStorage(backend, disk_cache)
+    # always in place: blobs stored compressed are decoded by their recorded
+    # codec even once their backend's codec is set back to none. Its lookup
+    # is the one the backend makes anyway, served from the locator's cache.
+    # Dedup works on the payload, compression on what is stored
+    backend = CompressedStorage(backend)
+    # only in place while turned on: it costs a metadata lookup per read
+    if settings.DEDUP_ENABLED:
+        backend = DedupStorage(backend, chunker)
+    # memory cache misses for the same blob share one fetch
+    if settings.SINGLE_FLIGHT_ENABLED:
+        backend = SingleFlightStorage(backend, blob_flights)
+    if settings.BLOB_CACHE_ENABLED:
+        backend = CachedStorage(backend, blob_cache)
+    return backend
\ No newline at end of file
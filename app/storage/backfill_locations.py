@@ -0,0 +1,151 @@
+"""
+One-off indexing of S3 and FTP objects written before the locator index.
+
+    python -m app.storage.backfill_locations [--backend s3|ftp] [--dry-run] [--batch-size N]
+
+Lists the backend (STORAGE_BACKEND by default) once and records the
+location of every `<timestamp>__<blob_id>.bin` object in blob_metadata:
+rows written before the index get their storage_path, objects with no
+row get one. Once done, lookups of unknown ids are 404 without listing
+the backend (LEGACY_LOCATION_SCANS=false). Local stores are indexed by
+app.storage.migrate_local_layout instead.
+
+It only adds locations, so it can run with the service up, and again.
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from pathlib import PurePosixPath
+from typing import AsyncIterator, Optional
+
+from app import s3_client
+from app.blob_crud import get_blob_metadata
+from app.blob_models import BlobMetadata
+from app.core.config import StorageBackend, settings
+from app.core.database import AsyncSession, async_session
+from app.core.logger import setup_logger
+from app.storage.executors import ftp_io
+from app.storage.ftp_storage import FTPStorage, ftp_pool
+from app.storage.s3_storage import S3Storage
+
+logger = setup_logger(__name__)
+
+
+def _parse_key(storage_path: str) -> tuple[str, datetime] | None:
+    """Blob id and creation time of `<timestamp>__<id>.bin`."""
+    name = PurePosixPath(storage_path)
+    ts, sep, blob_id = name.stem.rpartition("__")
+    if not sep or name.suffix != ".bin":
+        return None
+    try:
+        uuid.UUID(blob_id)
+        created_at = datetime.strptime(ts, "%Y%m%dT%H%M%S%fZ")
+    except ValueError:
+        return None
+    return blob_id, created_at.replace(tzinfo=timezone.utc)
+
+
+async def _list_keys(backend: StorageBackend) -> AsyncIterator[str]:
+    if backend == StorageBackend.S3:
+        async for key in S3Storage()._list_objects():
+            yield key
+        return
+
+    async with ftp_pool.async_connection() as ftps:
+        names = await ftp_io.run(ftps.nlst)
+    for name in names:
+        yield name
+
+
+async def _stored_size(backend: StorageBackend, storage_path: str) -> Optional[int]:
+    if backend == StorageBackend.S3:
+        return await S3Storage()._stored_size(storage_path)
+
+    async with ftp_pool.async_connection() as ftps:
+        return await ftp_io.run(FTPStorage()._legacy_size, ftps, storage_path)
+
+
+async def backfill(
+    backend: StorageBackend, db: AsyncSession, dry_run: bool = False, batch_size: int = 500
+) -> int:
+    """Index every unindexed blob object of `backend`; returns how many."""
+    indexed = 0
+    pending = 0
+
+    async for storage_path in _list_keys(backend):
+        parsed = _parse_key(storage_path)
+        if not parsed:
+            logger.warning(f"Skipping {storage_path}: not a blob object name")
+            continue
+
+        blob_id, created_at = parsed
+        blob_metadata = await get_blob_metadata(db=db, blob_id=blob_id)
+        if blob_metadata is not None and blob_metadata.storage_path:
+            continue
+        if blob_metadata is not None and blob_metadata.storage_backend != backend:
+            logger.warning(f"Skipping {storage_path}: blob {blob_id} belongs to another backend")
+            continue
+
+        if dry_run:
+            logger.info(f"Would index {storage_path}")
+            indexed += 1
+            continue
+
+        if blob_metadata is not None:
+            blob_metadata.storage_path = storage_path
+        else:
+            size = await _stored_size(backend, storage_path)
+            if size is None:
+                logger.warning(f"Skipping {storage_path}: its size could not be read")
+                continue
+            # no content encoding: read back as LEGACY_BASE64_READS says
+            db.add(
+                BlobMetadata(
+                    id=blob_id,
+                    size=size,
+                    created_at=created_at,
+                    storage_backend=backend,
+                    storage_path=storage_path,
+                )
+            )
+
+        indexed += 1
+        pending += 1
+        if pending >= batch_size:
+            await db.commit()
+            pending = 0
+            logger.info(f"Indexed {indexed} blobs")
+
+    if pending:
+        await db.commit()
+
+    return indexed
+
+
+async def _main(backend: StorageBackend, dry_run: bool, batch_size: int) -> None:
+    try:
+        async with async_session() as db:
+            indexed = await backfill(backend, db, dry_run=dry_run, batch_size=batch_size)
+    finally:
+        await s3_client.close_client()
+        ftp_pool.close()
+    logger.info(f"{'Would index' if dry_run else 'Indexed'} {indexed} {backend.value} blobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backend",
+        type=StorageBackend,
+        choices=[StorageBackend.S3, StorageBackend.FTP],
+        default=settings.STORAGE_BACKEND,
+        help="backend to list (default: STORAGE_BACKEND)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be indexed")
+    parser.add_argument("--batch-size", type=int, default=500, help="blobs per commit")
+    args = parser.parse_args()
+
+    if args.backend not in (StorageBackend.S3, StorageBackend.FTP):
+        parser.error("only s3 and ftp stores are listed; use app.storage.migrate_local_layout for local ones")
+    asyncio.run(_main(args.backend, args.dry_run, args.batch_size))
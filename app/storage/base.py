@@ -1,27 +1,118 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Optional
 from app.core.config import StorageBackend
-from app.blob_schemas import BlobResponse , BlobCreate
+from app.blob_schemas import BlobCreate
+
+
+@dataclass
+class StoredBlob:
+    """Whole raw payload of a stored blob with its metadata"""
+    id: str
+    data: bytes | memoryview       # raw bytes, Base64 is only applied at the JSON edge
+    size: int
+    created_at: Optional[datetime] = None
+    name: Optional[str] = None
+    path: Optional[str] = None
+    storage_backend: Optional[StorageBackend] = None
+    storage_path: Optional[str] = None
+
+
+@dataclass
+class BlobStream:
+    """Raw payload of a stored blob, read lazily in chunks"""
+    id: str
+    size: int                      # size of the whole raw payload in bytes
+    chunks: AsyncIterator[bytes]   # nothing is read until this is iterated
+    created_at: Optional[datetime] = None
+    name: Optional[str] = None
+    start: int = 0                 # first byte yielded by `chunks`
+    end: Optional[int] = None      # last byte yielded (inclusive), None = size - 1
+    file_path: Optional[str] = None  # raw payload as a plain file, servable without `chunks`
+
+    @property
+    def length(self) -> int:
+        """Number of bytes `chunks` yields"""
+        end = self.size - 1 if self.end is None else self.end
+        return end - self.start + 1
+
+
+class RangeNotSatisfiable(Exception):
+    """Requested byte range lies outside the blob"""
+
+    def __init__(self, size: int):
+        super().__init__(f"Range not satisfiable for blob of {size} bytes")
+        self.size = size
+
+
+def resolve_range(start: int, end: Optional[int], size: int) -> tuple[int, int]:
+    """
+    Turn a requested byte range into absolute, inclusive offsets.
+
+    A negative `start` asks for the last `-start` bytes and `end=None` reads
+    up to the end of the blob, as in an HTTP Range header. `end` is clamped
+    to the blob size.
+    """
+    if start < 0:
+        first, last = max(size + start, 0), size - 1
+    else:
+        first = start
+        last = size - 1 if end is None else min(end, size - 1)
+
+    if first > last:
+        raise RangeNotSatisfiable(size)
+
+    return first, last
 
 
 class StorageBackendInterface(ABC):
     """Abstract base class for storage backends"""
     
-    @abstractmethod
-    async def save(self, blob_id: str, data: bytes, filename: str, path: str ,**kwargs) -> BlobCreate:
+    async def save(
+        self, blob_id: str, data: bytes | memoryview, filename: str, path: str, **kwargs
+    ) -> BlobCreate:
         """
         Save data to storage backend
         
         Args:
             blob_id: Unique identifier for the blob
-            data: Binary data to store
+            data: Raw data to store
             
         Returns:
-            Storage path/key where the data is stored
+            BlobCreate without the payload, None on failure
         """
-        pass
+        async def chunks():
+            yield data
+
+        kwargs.setdefault("size", len(data))
+        return await self.save_stream(blob_id, chunks(), filename, path, **kwargs)
     
     @abstractmethod
-    async def retrieve(self, blob_id: str, **kwargs) -> BlobResponse:
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate:
+        """
+        Save data to storage backend from a stream of chunks
+
+        Args:
+            blob_id: Unique identifier for the blob
+            chunks: Async iterator over the raw (not encoded) payload
+            size: (kwarg) payload size when known up front, lets backends
+                stream instead of buffering
+
+        Returns:
+            BlobCreate without the payload, None on failure
+        """
+        pass
+
+    @abstractmethod
+    async def retrieve(self, blob_id: str, **kwargs) -> Optional[StoredBlob]:
         """
         Retrieve data from storage backend
         
@@ -29,10 +120,58 @@ class StorageBackendInterface(ABC):
             blob_id: Unique identifier for the blob
             
         Returns:
-            Binary data if found, None otherwise
+            StoredBlob with the raw payload if found, None otherwise
         """
         pass
     
+    @abstractmethod
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> Optional[BlobStream]:
+        """
+        Retrieve the raw payload from storage backend in chunks
+
+        Args:
+            blob_id: Unique identifier for the blob
+
+        Returns:
+            BlobStream if found, None otherwise
+        """
+        pass
+
+    @abstractmethod
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: Optional[int] = None, **kwargs
+    ) -> Optional[BlobStream]:
+        """
+        Retrieve a byte range of the raw payload, reading only those bytes
+
+        Args:
+            blob_id: Unique identifier for the blob
+            start: First byte, or the suffix length when negative
+            end: Last byte (inclusive), None for the end of the blob
+
+        Returns:
+            BlobStream limited to the range if found, None otherwise
+
+        Raises:
+            RangeNotSatisfiable: the range starts past the end of the blob
+        """
+        pass
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        """
+        Delete a blob and its metadata
+
+        Args:
+            blob_id: Unique identifier for the blob
+
+        Returns:
+            True if the blob existed, False otherwise
+
+        Raises:
+            NotImplementedError: the backend cannot delete blobs
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support deletes")
+
     @abstractmethod
     def get_backend_type(self) -> StorageBackend:
         """Return the backend type"""
@@ -0,0 +1,240 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Optional
+
+from app.blob_schemas import BlobCreate
+from app.core.config import StorageBackend, settings
+from app.storage.base import BlobStream, StorageBackendInterface, StoredBlob, resolve_range
+
+# invalidations remembered for fills in flight; fills older than the ones
+# forgotten are dropped
+_MAX_INVALIDATIONS = 10_000
+
+
+@dataclass
+class _Entry:
+    blob: StoredBlob
+    expires_at: float
+    complete: bool      # False when filled from a stream: no path / storage_path
+
+
+class BlobCache:
+    """
+    In-memory LRU of whole blobs, bounded by their total size.
+
+    Objects larger than `max_object_size` are never kept; entries expire
+    `ttl` seconds after being stored. Used from the event loop only.
+    """
+
+    def __init__(self, max_bytes: int, max_object_size: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        # bumped by every invalidation; a fill that started before its blob
+        # was invalidated is dropped
+        self.generation = 0
+        self._invalidated: OrderedDict[str, int] = OrderedDict()   # blob id -> generation
+        self._forgotten = 0     # generation of the newest invalidation no longer remembered
+
+        # metrics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, blob_id: str, complete: bool = False) -> Optional[StoredBlob]:
+        entry = self._entries.get(blob_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._drop(blob_id)
+            self._expirations += 1
+            entry = None
+
+        if entry is None or (complete and not entry.complete):
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(blob_id)
+        self._hits += 1
+        return entry.blob
+
+    def put(self, blob: StoredBlob, complete: bool = True, generation: Optional[int] = None) -> bool:
+        """Cache a blob; False when it is too large or was invalidated meanwhile."""
+        size = len(blob.data)
+        if size > self.max_object_size or size > self.max_bytes:
+            return False
+        if generation is not None and self._invalidated.get(blob.id, self._forgotten) > generation:
+            return False
+
+        self._drop(blob.id)
+        self._entries[blob.id] = _Entry(blob, time.monotonic() + self.ttl, complete)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._evictions += 1
+        return True
+
+    def __contains__(self, blob_id: str) -> bool:
+        return blob_id in self._entries
+
+    def invalidate(self, blob_id: str) -> None:
+        self.generation += 1
+        self._invalidated[blob_id] = self.generation
+        self._invalidated.move_to_end(blob_id)
+        while len(self._invalidated) > _MAX_INVALIDATIONS:
+            _blob_id, self._forgotten = self._invalidated.popitem(last=False)
+        if self._drop(blob_id):
+            self._invalidations += 1
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._forgotten = self.generation
+        self._invalidated.clear()
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits_total": self._hits,
+            "misses_total": self._misses,
+            "evictions_total": self._evictions,
+            "expirations_total": self._expirations,
+            "invalidations_total": self._invalidations,
+        }
+
+    def _drop(self, blob_id: str) -> bool:
+        entry = self._entries.pop(blob_id, None)
+        if entry is None:
+            return False
+        self._bytes -= len(entry.blob.data)
+        return True
+
+
+class CachedStorage(StorageBackendInterface):
+    """
+    Read-through cache in front of any storage backend.
+
+    `retrieve` fills the cache; full streams of cacheable blobs fill it as
+    they are sent, unless they are files the server sends itself. Ranges and streams of cached blobs are cut from memory.
+    Saves and deletes invalidate the blob first. The cache is per process:
+    other workers only notice a delete once their entry expires.
+    """
+
+    def __init__(self, backend: StorageBackendInterface, cache: BlobCache):
+        self.backend = backend
+        self.cache = cache
+
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
+        # uploads get fresh ids: only one already cached needs invalidating
+        if blob_id in self.cache:
+            self.cache.invalidate(blob_id)
+        return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        self.cache.invalidate(blob_id)
+        return await self.backend.delete(blob_id, **kwargs)
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        stored_blob = self.cache.get(blob_id, complete=True)
+        if stored_blob is not None:
+            return stored_blob
+
+        generation = self.cache.generation
+        stored_blob = await self.backend.retrieve(blob_id, **kwargs)
+        if stored_blob is not None:
+            self.cache.put(stored_blob, generation=generation)
+        return stored_blob
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        stored_blob = self.cache.get(blob_id)
+        if stored_blob is not None:
+            return self._from_memory(stored_blob, 0, stored_blob.size - 1)
+
+        generation = self.cache.generation
+        blob_stream = await self.backend.retrieve_stream(blob_id, **kwargs)
+        # a file the server can send itself is not worth copying into memory
+        if (
+            blob_stream is None
+            or blob_stream.file_path
+            or blob_stream.size > self.cache.max_object_size
+        ):
+            return blob_stream
+
+        # served from memory from now on: no sendfile shortcut needed
+        return replace(
+            blob_stream,
+            chunks=self._fill(blob_stream, generation),
+            file_path=None,
+        )
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        stored_blob = self.cache.get(blob_id)
+        if stored_blob is not None:
+            first, last = resolve_range(start, end, stored_blob.size)
+            return self._from_memory(stored_blob, first, last)
+
+        return await self.backend.retrieve_range(blob_id, start, end, **kwargs)
+
+    def get_backend_type(self) -> StorageBackend:
+        return self.backend.get_backend_type()
+
+    def _from_memory(self, stored_blob: StoredBlob, first: int, last: int) -> BlobStream:
+        async def chunks():
+            view = memoryview(stored_blob.data)
+            for offset in range(first, last + 1, settings.DOWNLOAD_CHUNK_SIZE):
+                yield view[offset:min(offset + settings.DOWNLOAD_CHUNK_SIZE, last + 1)]
+
+        return BlobStream(
+            id=stored_blob.id,
+            size=stored_blob.size,
+            chunks=chunks(),
+            created_at=stored_blob.created_at,
+            name=stored_blob.name,
+            start=first,
+            end=last,
+        )
+
+    async def _fill(self, blob_stream: BlobStream, generation: int) -> AsyncIterator[bytes]:
+        data = bytearray()
+        async for chunk in blob_stream.chunks:
+            data += chunk
+            yield chunk
+
+        if len(data) == blob_stream.size:
+            self.cache.put(
+                StoredBlob(
+                    id=blob_stream.id,
+                    data=bytes(data),
+                    size=blob_stream.size,
+                    created_at=blob_stream.created_at,
+                    name=blob_stream.name,
+                    storage_backend=self.backend.get_backend_type(),
+                ),
+                complete=False,
+                generation=generation,
+            )
+
+
+blob_cache = BlobCache(
+    settings.BLOB_CACHE_MAX_BYTES,
+    settings.BLOB_CACHE_MAX_OBJECT_SIZE,
+    settings.BLOB_CACHE_TTL,
+)
@@ -0,0 +1,126 @@
+import functools
+import random
+from typing import AsyncIterator
+
+from app.storage.executors import local_io
+
+# bytes of history the rolling hash of a position covers
+WINDOW = 64
+# positions hashed per pass; a pass stops early once a cut point is found
+_BLOCK = 128 * 1024
+# hash values are 24 bits wide, each in a 32-bit field (64 of them fit)
+_HASH_BITS = 24
+_FIELD = 4
+
+
+def _gear_tables(seed: int) -> tuple[bytes, bytes, bytes]:
+    """Random 24-bit gear value of every byte, split into three translate tables."""
+    rng = random.Random(seed)
+    gear = [rng.getrandbits(_HASH_BITS) for _ in range(256)]
+    return tuple(bytes((g >> shift) & 0xFF for g in gear) for shift in (0, 8, 16))
+
+
+@functools.lru_cache(maxsize=16)
+def _repeat(field: int, count: int) -> int:
+    """`field` in each of `count` fields of a big integer."""
+    return int.from_bytes(field.to_bytes(_FIELD, "little") * count, "little")
+
+
+class Chunker:
+    """
+    FastCDC-style content-defined chunking.
+
+    A position is a cut point when the rolling gear hash of the WINDOW
+    bytes ending there has its top bits clear. Cut points only depend on
+    nearby content, so an edit only changes the chunks around it and the
+    rest of a new version splits into the same chunks as the old one.
+    As in FastCDC, the first `min_size` bytes of a chunk are skipped, and
+    the mask is stricter before `avg_size` and looser after it
+    (normalized chunking), so chunk sizes cluster around `avg_size`.
+    Chunks never exceed `max_size`.
+
+    The hash is the sum of the gear values of the window, modulo 2**24,
+    rather than FastCDC's shift-and-add. A sum can be computed for a whole
+    block of positions with a few big-integer operations, which runs
+    about five times faster in CPython than hashing byte by byte.
+    """
+
+    def __init__(self, min_size: int, avg_size: int, max_size: int, seed: int = 0x5EED):
+        if not WINDOW <= min_size <= avg_size <= max_size:
+            raise ValueError("chunk sizes must satisfy 64 <= min <= avg <= max")
+        bits = avg_size.bit_length() - 1
+        if bits + 1 > _HASH_BITS:
+            raise ValueError(f"average chunk size above {1 << (_HASH_BITS - 1)} bytes")
+
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self._tables = _gear_tables(seed)
+        # FastCDC normalization level 1: one bit more / less than the average needs
+        self._strict = self._mask(bits + 1)
+        self._loose = self._mask(bits - 1)
+
+    @staticmethod
+    def _mask(bits: int) -> int:
+        return ((1 << bits) - 1) << (_HASH_BITS - bits)
+
+    def _cut_points(self, data: bytes, first: int, stop: int, mask: int) -> int:
+        """First position in [first, stop) whose window hash has no `mask` bit set, or -1."""
+        window = data[first - WINDOW + 1:stop]
+        count = len(window)
+
+        # gear value of every byte in a 32-bit field of one big integer
+        fields = bytearray(count * _FIELD)
+        for i, table in enumerate(self._tables):
+            fields[i::_FIELD] = window.translate(table)
+        sums = int.from_bytes(fields, "little")
+
+        # field i becomes the sum of fields i - WINDOW + 1 .. i (64 * 2**24 < 2**32)
+        span = 1
+        while span < WINDOW:
+            sums += sums << (span * _FIELD * 8)
+            span *= 2
+
+        # a masked field plus 2**24 - 1 reaches bit 24 unless it was zero
+        flagged = (sums & _repeat(mask, count)) + _repeat((1 << _HASH_BITS) - 1, count)
+        flags = flagged.to_bytes(len(fields) + WINDOW * _FIELD, "little")
+        # only fields with the whole window in `window` are real positions
+        index = flags[(WINDOW - 1) * _FIELD + 3:count * _FIELD:_FIELD].find(0)
+        return -1 if index < 0 else first + index
+
+    def cut(self, data: bytes) -> int:
+        """
+        Length of the first chunk of `data`, which holds the rest of the
+        stream or at least `max_size` bytes of it.
+        """
+        end = min(len(data), self.max_size)
+        if end <= self.min_size:
+            return end
+
+        normal = min(self.avg_size, end)
+        for first, stop, mask in (
+            (self.min_size, normal, self._strict),
+            (normal, end, self._loose),
+        ):
+            for block in range(first, stop, _BLOCK):
+                position = self._cut_points(data, block, min(block + _BLOCK, stop), mask)
+                if position >= 0:
+                    return position + 1
+        return end
+
+    async def split(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Re-cut a stream of arbitrary chunks into content-defined ones."""
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= self.max_size:
+                data = bytes(buffer[:self.max_size])
+                size = await local_io.run(self.cut, data)
+                del buffer[:size]
+                yield data[:size]
+
+        while buffer:
+            data = bytes(buffer[:self.max_size])
+            size = await local_io.run(self.cut, data)
+            del buffer[:size]
+            yield data[:size]
@@ -0,0 +1,277 @@
+import math
+import zlib
+from collections import Counter, deque
+from dataclasses import replace
+from typing import AsyncIterator, Optional
+
+from app.blob_schemas import BlobCreate
+from app.core.config import Compression, ContentEncoding, StorageBackend, settings
+from app.core.logger import setup_logger
+from app.storage.base import BlobStream, StorageBackendInterface, StoredBlob, resolve_range
+from app.storage.executors import local_io
+from app.storage.locator import BlobLocation, locator
+from app.storage.streaming import PayloadMeter, slice_chunks
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for the zstd codec
+    zstandard = None
+
+logger = setup_logger(__name__)
+
+# smaller payloads gain nothing from compression
+_MIN_SIZE = 256
+
+
+def _zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd compression needs the zstandard package")
+    return zstandard
+
+
+def compressor(encoding: ContentEncoding, level: Optional[int] = None):
+    """Streaming compressor of a codec: compress() each chunk, then flush()."""
+    if encoding == ContentEncoding.ZLIB:
+        return zlib.compressobj(6 if level is None else level)
+    return _zstd().ZstdCompressor(level=3 if level is None else level).compressobj()
+
+
+class _ZlibDecompressor:
+    """Streaming zlib decompressor: feed() compressed bytes, pull() at most max_length."""
+
+    def __init__(self):
+        self._engine = zlib.decompressobj()
+        self._tail = b""
+
+    def feed(self, data: bytes) -> None:
+        self._tail = data
+
+    def pull(self, max_length: int) -> bytes:
+        if not self._tail:
+            return b""
+        out = self._engine.decompress(self._tail, max_length)
+        self._tail = self._engine.unconsumed_tail
+        return out
+
+
+class _NeedInput(Exception):
+    """Raised by _ZstdDecompressor.read once every fed byte was handed out"""
+
+
+class _ZstdDecompressor:
+    """
+    _ZlibDecompressor for zstd. zstandard's decompressobj has no max_length,
+    so this is a stream reader over the fed bytes, read a bounded slice at a
+    time; its source reports running dry instead of ending the stream.
+    """
+
+    def __init__(self):
+        self._input: deque[bytes] = deque()
+        self._reader = _zstd().ZstdDecompressor().stream_reader(self, read_across_frames=True)
+
+    def read(self, size: int) -> bytes:
+        # the stream reader's source
+        if not self._input:
+            raise _NeedInput()
+        return self._input.popleft()
+
+    def feed(self, data: bytes) -> None:
+        self._input.append(bytes(data))
+
+    def pull(self, max_length: int) -> bytes:
+        while True:
+            try:
+                out = self._reader.read1(max_length)
+            except _NeedInput:
+                return b""
+            # a frame header alone decompresses to nothing
+            if out:
+                return out
+
+
+def decompressor(encoding: ContentEncoding):
+    """Streaming decompressor of a codec: feed() each chunk, then pull() until empty."""
+    if encoding == ContentEncoding.ZLIB:
+        return _ZlibDecompressor()
+    return _ZstdDecompressor()
+
+
+def entropy(sample: bytes) -> float:
+    """Shannon entropy of a sample, in bits per byte (8 for random data)."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(n / total * math.log2(n / total) for n in Counter(sample).values())
+
+
+def codec_for(backend: StorageBackend) -> Compression:
+    return {
+        StorageBackend.LOCAL: settings.LOCAL_COMPRESSION,
+        StorageBackend.S3: settings.S3_COMPRESSION,
+        StorageBackend.FTP: settings.FTP_COMPRESSION,
+        StorageBackend.DATABASE: settings.DB_COMPRESSION,
+    }[backend]
+
+
+async def compress_chunks(
+    chunks: AsyncIterator[bytes], encoding: ContentEncoding, level: Optional[int]
+) -> AsyncIterator[bytes]:
+    engine = compressor(encoding, level)
+    async for chunk in chunks:
+        # zlib and zstd release the GIL while they work
+        out = await local_io.run(engine.compress, chunk)
+        if out:
+            yield out
+    yield await local_io.run(engine.flush)
+
+
+async def decompress_chunks(
+    chunks: AsyncIterator[bytes], encoding: ContentEncoding
+) -> AsyncIterator[bytes]:
+    engine = decompressor(encoding)
+    try:
+        async for chunk in chunks:
+            engine.feed(chunk)
+            # a few compressed bytes can expand to megabytes: at most one
+            # download chunk is decompressed per step
+            while out := await local_io.run(engine.pull, settings.DOWNLOAD_CHUNK_SIZE):
+                yield out
+    finally:
+        # a consumer stopping early (a range read) releases the backend stream
+        await chunks.aclose()
+
+
+class CompressedStorage(StorageBackendInterface):
+    """
+    Compression at rest in front of a storage backend.
+
+    Uploads to a backend with a codec configured (LOCAL_COMPRESSION, ...)
+    are compressed as they stream, unless a sample from their head looks
+    compressed already. The backend stores and indexes the compressed
+    object like any other; its codec and uncompressed size are then
+    recorded in blob_metadata. Reads decompress as they stream, so a
+    range read decompresses from the start of the blob up to its end.
+    Blobs are read back with the codec recorded for them, whatever the
+    backend's codec is now, so the factory keeps this wrapper in place even
+    with compression turned off.
+    """
+
+    def __init__(self, backend: StorageBackendInterface):
+        self.backend = backend
+
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
+        codec = codec_for(self.get_backend_type())
+        if codec == Compression.NONE:
+            return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+
+        # sample the head of the upload
+        chunks = aiter(chunks)
+        head = bytearray()
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= settings.COMPRESSION_SAMPLE_SIZE:
+                break
+        sample = bytes(head[:settings.COMPRESSION_SAMPLE_SIZE])
+        chunks = self._prepend(bytes(head), chunks)
+
+        if len(head) < _MIN_SIZE or (
+            await local_io.run(entropy, sample) > settings.COMPRESSION_MAX_ENTROPY
+        ):
+            return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+
+        encoding = ContentEncoding(codec.value)
+        meter = PayloadMeter()
+        # the compressed size is only known once written
+        kwargs.pop("size", None)
+        saved = await self.backend.save_stream(
+            blob_id,
+            compress_chunks(meter.track(chunks), encoding, settings.COMPRESSION_LEVEL),
+            filename,
+            path,
+            **kwargs,
+        )
+        if not saved:
+            return None
+
+        if not await locator.mark_compressed(
+            blob_id,
+            encoding,
+            meter.size,
+            db=kwargs.get("db"),
+            batch=kwargs.get("metadata_batch"),
+        ):
+            logger.warning(f"Failed to record compression of blob_id: {blob_id}")
+            await self.backend.delete(blob_id, **kwargs)
+            return None
+        return saved
+
+    @staticmethod
+    async def _prepend(head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        if head:
+            yield head
+        async for chunk in chunks:
+            yield chunk
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        return await self.backend.delete(blob_id, **kwargs)
+
+    async def _compressed_location(self, blob_id: str, **kwargs) -> Optional[BlobLocation]:
+        location = await locator.lookup(
+            blob_id,
+            self.get_backend_type(),
+            db=kwargs.get("db"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if location is None or not location.compressed:
+            return None
+        return location
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        location = await self._compressed_location(blob_id, **kwargs)
+        stored_blob = await self.backend.retrieve(blob_id, **kwargs)
+        if location is None or stored_blob is None:
+            return stored_blob
+
+        chunks = decompress_chunks(self._once(stored_blob.data), location.content_encoding)
+        data = b"".join([chunk async for chunk in chunks])
+        return replace(stored_blob, data=data, size=location.uncompressed_size)
+
+    @staticmethod
+    async def _once(data: bytes) -> AsyncIterator[bytes]:
+        yield data
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self.retrieve_range(blob_id, 0, None, **kwargs)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        location = await self._compressed_location(blob_id, **kwargs)
+        if location is None:
+            if start == 0 and end is None:
+                return await self.backend.retrieve_stream(blob_id, **kwargs)
+            return await self.backend.retrieve_range(blob_id, start, end, **kwargs)
+
+        size = location.uncompressed_size
+        first, last = resolve_range(start, end, size)
+        blob_stream = await self.backend.retrieve_stream(blob_id, **kwargs)
+        if blob_stream is None:
+            return None
+
+        chunks = decompress_chunks(blob_stream.chunks, location.content_encoding)
+        if (first, last) != (0, size - 1):
+            chunks = slice_chunks(chunks, first, last - first + 1)
+        # the stored file is compressed: no sendfile shortcut
+        return replace(
+            blob_stream, size=size, chunks=chunks, start=first, end=last, file_path=None
+        )
+
+    def get_backend_type(self) -> StorageBackend:
+        return self.backend.get_backend_type()
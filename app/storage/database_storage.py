@@ -1,90 +1,159 @@
-from app.storage.base import StorageBackendInterface
-from app.core.config import StorageBackend, settings
-from app.core.database import async_session
-from app.blob_crud import  create_blob_data , create_blob_metadata  , get_blob_data , get_blob_metadata
-from app.blob_models  import BlobMetadata
-from app.blob_schemas import BlobResponse , BlobCreate
+from app.storage.base import StorageBackendInterface, BlobStream, StoredBlob, resolve_range
+from app.core.config import ContentEncoding, StorageBackend, settings
+from app.core.database import async_session, use_session
+from app.blob_crud import  create_blob_with_metadata , get_blob_with_metadata , get_blob_data_info , get_blob_data_slice
+from app.blob_models  import BlobData, BlobMetadata
+from app.blob_schemas import BlobCreate
 from app.core.logger import   setup_logger
+from app.storage.locator import locator
+from typing import AsyncIterator
+from datetime import datetime, timezone
 
 logger =  setup_logger(__name__)
 
 class DatabaseStorage(StorageBackendInterface):
     
-    async def save(self, blob_id: str, data: bytes, filename: str, path: str, **kwargs ) -> BlobCreate | None:
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
 
-        
-        logger.debug(f"DatabaseStorage save started for blob_id: {blob_id}")
+        logger.debug(f"DatabaseStorage save_stream started for blob_id: {blob_id}")
 
-        # 2️⃣ Build BlobCreate 
-        blob = BlobCreate(
+        # BYTEA is bound as a single parameter, so the raw payload is collected
+        # once here (asyncpg takes the bytearray as is); no Base64 copy is made.
+        data = bytearray()
+        async for chunk in chunks:
+            data += chunk
+
+        blob_metadata = BlobMetadata(
             id=blob_id,
-            data=data,
+            size=len(data),
+            created_at=datetime.now(timezone.utc),
+            name=filename,
+            path=path,
+            storage_backend=StorageBackend.DATABASE,
+            storage_path=f"{BlobData.__tablename__}/{blob_id}",
+            content_encoding=ContentEncoding.IDENTITY,
+            shared_content=kwargs.get("shared_content", False),
         )
 
-        logger.debug(f"Blob Created for blob_id: {blob_id}")
-
-        
-        async with async_session() as db:
-
-            # 4️⃣ USE create_blob_data (THIS IS WHAT YOU WANTED)
-            blob_data_response = await create_blob_data(db=db, blob=blob)
-            logger.debug(f"Blob Created for blob_id: {blob_id}")
-
-            if not blob_data_response:
-                logger.warning(f"Error Create Metadata for  blob_id: {blob_id}")
+        batch = kwargs.get("metadata_batch")
+        if batch is not None:
+            # inserted with the rest of the batch
+            blob_metadata.blob_data = BlobData(id=blob_id, data=data)
+            batch.add(blob_metadata, payload_size=len(data))
+            # payloads wait in memory until inserted: bound how many
+            if batch.full and not await batch.flush():
                 return None
+            return BlobCreate(id=blob_id)
 
-            # 5️⃣ Store metadata in SAME session
-            blob_metadata = BlobMetadata(
-                id=blob_id,
-                size=len(data),
-                name=filename,
-                path=path,
-                storage_backend=settings.STORAGE_BACKEND,
-                storage_path=settings.LOCAL_STORAGE_PATH,
+        # reuse the request's session when the caller passes one
+        async with use_session(kwargs.get("db")) as db:
+            blob_metadata = await create_blob_with_metadata(
+                db=db, blob_metadata=blob_metadata, data=data
             )
 
-            blob_metadata = await create_blob_metadata(db=db, blob_metadata=blob_metadata)
-            logger.debug(f"Blob metadata created for blob_id: {blob_id}")
-            
-            if not blob_metadata:
-                logger.warning(f"Error create Blob Metadata for blob_id: {blob_id}")
-                return None
+        if not blob_metadata:
+            logger.warning(f"Error create Blob for blob_id: {blob_id}")
+            return None
 
-        # 6️⃣ Return API response
         logger.info(f"Successfully create Blob for blob_id : {blob_id}")
-        return BlobCreate(
-            id=blob_id,
-            data=data,
-        )
+        return BlobCreate(id=blob_id)
 
-    
-    async def retrieve(self, blob_id: str, **kwargs) -> BlobResponse | None:
-        async with async_session() as db:
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        async with use_session(kwargs.get("db")) as db:
             
             logger.debug(f"DatabaseStorage.retrieve started blob_id:{blob_id}")
 
-            blob_data = await get_blob_data(db=db, blob_id=blob_id)
-            if not blob_data:
-                logger.warning(f"Blob data not found blob_id:{blob_id}")
-                return None
-
-            blob_metadata = await get_blob_metadata(db=db, blob_id=blob_id)
+            # payload and metadata in a single round trip
+            blob_metadata = await get_blob_with_metadata(
+                db=db, blob_id=blob_id, shared_content=kwargs.get("shared_content", False)
+            )
             if not blob_metadata:
-                logger.warning( "Blob metadata not found blob_id {blob_id}")
+                logger.warning(f"Blob not found blob_id:{blob_id}")
                 return None
 
+            data = blob_metadata.blob_data.data
+
             logger.info(f"Blob successfully retrieved from database")
-            return BlobResponse(
-                id=blob_data.id,
-                data=blob_data.data,           # Base64
-                size=blob_metadata.size,
-                created_at=str(blob_metadata.created_at),
-                # name=blob_metadata.name,
-                # path=blob_metadata.path,
-                # storage_backend=blob_metadata.storage_backend,
-                # storage_path=blob_metadata.storage_path,
+            return StoredBlob(
+                id=blob_metadata.id,
+                data=data,
+                size=len(data),
+                created_at=blob_metadata.created_at,
+                name=blob_metadata.name,
+                path=blob_metadata.path,
+                storage_backend=blob_metadata.storage_backend,
+                storage_path=blob_metadata.storage_path,
             )
     
+    async def _read_chunks(self, blob_id: str, start: int, stop: int) -> AsyncIterator[bytes]:
+        chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+        async with async_session() as db:
+            for offset in range(start, stop, chunk_size):
+                chunk = await get_blob_data_slice(
+                    db=db,
+                    blob_id=blob_id,
+                    offset=offset,
+                    length=min(chunk_size, stop - offset),
+                )
+                if chunk is None:
+                    raise RuntimeError(f"Blob data vanished while streaming blob_id:{blob_id}")
+                yield chunk
+
+    async def _stream(
+        self,
+        blob_id: str,
+        byte_range: tuple[int, int | None] | None = None,
+        shared_content: bool = False,
+    ) -> BlobStream | None:
+        async with async_session() as db:
+
+            logger.debug(f"DatabaseStorage stream started blob_id:{blob_id}")
+
+            info = await get_blob_data_info(
+                db=db, blob_id=blob_id, shared_content=shared_content
+            )
+            if not info:
+                logger.warning(f"Blob data not found blob_id:{blob_id}")
+                return None
+
+        if byte_range:
+            first, last = resolve_range(*byte_range, info.size)
+        else:
+            first, last = 0, info.size - 1
+
+        return BlobStream(
+            id=blob_id,
+            size=info.size,
+            # substring() on the BYTEA column: only the range leaves the DB
+            chunks=self._read_chunks(blob_id, first, last + 1),
+            created_at=info.created_at,
+            name=info.name,
+            start=first,
+            end=last,
+        )
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self._stream(blob_id, shared_content=kwargs.get("shared_content", False))
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        return await self._stream(
+            blob_id, (start, end), shared_content=kwargs.get("shared_content", False)
+        )
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        # blob_data rows go with their metadata (ON DELETE CASCADE)
+        return await locator.discard(
+            blob_id, db=kwargs.get("db"), shared_content=kwargs.get("shared_content", False)
+        )
+
     def get_backend_type(self) -> StorageBackend:
         return StorageBackend.DATABASE
\ No newline at end of file
@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import tempfile
+import uuid
+from collections import deque
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable
+
+from app.blob_crud import (
+    add_content_reference,
+    create_chunked_blob,
+    get_blob_chunks,
+    lock_content,
+    reference_content,
+    release_blob_chunks,
+    release_content,
+    release_content_reference,
+)
+from app.blob_models import BlobChunk, BlobContent, BlobMetadata
+from app.blob_schemas import BlobCreate
+from app.core.config import StorageBackend, settings
+from app.core.database import AsyncSession, use_session
+from app.core.logger import setup_logger
+from app.storage.base import BlobStream, StorageBackendInterface, StoredBlob, resolve_range
+from app.storage.chunking import Chunker
+from app.storage.executors import local_io
+from app.storage.locator import BlobLocation, locator
+
+logger = setup_logger(__name__)
+
+
+def content_id_for(digest: str) -> str:
+    """
+    Id the shared content of a sha256 digest is stored under in its backend.
+    Its row is flagged shared_content, so it is only reachable from here.
+    """
+    return str(uuid.UUID(digest[:32]))
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def _once(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+class DedupStorage(StorageBackendInterface):
+    """
+    Content-addressed deduplication in front of any storage backend.
+
+    With DEDUP_ENABLED, uploads are hashed (sha256) while they are spooled,
+    and each distinct content is written to the backend once, as an
+    ordinary blob whose id is derived from its digest (content_id_for),
+    but flagged as shared content: the public routes neither serve nor
+    delete it by that id.
+    Every uploaded blob only gets a blob_metadata row referencing a
+    refcounted blob_content row; the content is deleted with its last
+    reference. A duplicate upload costs no backend write at all.
+
+    With DEDUP_CHUNKING as well, uploads are split into content-defined
+    chunks (see Chunker) that are deduplicated one by one, and the blob
+    keeps their list in blob_chunk. Successive versions of a large file
+    then only store the chunks around their edits.
+
+    Reads of deduplicated blobs are served from their content; other blobs
+    pass straight through. The factory only puts this wrapper in place
+    while DEDUP_ENABLED is on, so that reads cost no metadata lookup
+    otherwise.
+    """
+
+    def __init__(self, backend: StorageBackendInterface, chunker: Chunker):
+        self.backend = backend
+        self.chunker = chunker
+
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
+        if not settings.DEDUP_ENABLED:
+            return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+        if settings.DEDUP_CHUNKING:
+            return await self._save_chunked(blob_id, chunks, filename, path)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=settings.DEDUP_SPOOL_MEMORY)
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            async for chunk in chunks:
+                # hashing and a spool spilled to disk both block
+                await local_io.run(self._absorb, spool, hasher, chunk)
+                size += len(chunk)
+            digest = hasher.hexdigest()
+
+            return await self._save_reference(blob_id, digest, size, spool, filename, path)
+        finally:
+            await local_io.run(spool.close)
+
+    @staticmethod
+    def _absorb(spool, hasher, chunk: bytes) -> None:
+        hasher.update(chunk)
+        spool.write(chunk)
+
+    @staticmethod
+    async def _replay(spool) -> AsyncIterator[bytes]:
+        await local_io.run(spool.seek, 0)
+        while chunk := await local_io.run(spool.read, settings.UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    async def _store_content(
+        self,
+        session: AsyncSession,
+        digest: str,
+        size: int,
+        chunks: Callable[[], AsyncIterator[bytes]],
+    ) -> tuple[bool, BlobContent | None]:
+        """
+        Lock a digest in `session` and write its content to the backend
+        unless it is there already. Returns whether the content is stored,
+        and its blob_content row (None until first referenced).
+        """
+        content = await lock_content(session, digest)
+        content_id = content_id_for(digest)
+        # also written, but not counted, when a reference failed to commit
+        if content is None and not await locator.lookup(
+            content_id, self.get_backend_type(), shared_content=True
+        ):
+            saved = await self.backend.save_stream(
+                content_id, chunks(), None, None, size=size, shared_content=True
+            )
+            if not saved:
+                return False, None
+            logger.debug(f"Stored content {digest} as {content_id}")
+        return True, content
+
+    async def _save_reference(
+        self, blob_id: str, digest: str, size: int, spool, filename: str, path: str
+    ) -> BlobCreate | None:
+        backend_type = self.get_backend_type()
+        created_at = datetime.now(timezone.utc)
+
+        # a session of our own: the digest stays locked until it commits,
+        # and the backend commits its own rows meanwhile
+        async with use_session() as session:
+            try:
+                stored, content = await self._store_content(
+                    session, digest, size, lambda: self._replay(spool)
+                )
+                if not stored:
+                    await session.rollback()
+                    return None
+
+                await add_content_reference(
+                    session,
+                    content,
+                    digest,
+                    size,
+                    BlobMetadata(
+                        id=blob_id,
+                        size=size,
+                        created_at=created_at,
+                        storage_backend=backend_type,
+                        name=filename,
+                        path=path,
+                    ),
+                )
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Error saving deduplicated blob {blob_id}: {e}")
+                return None
+
+        locator.remember(
+            blob_id,
+            BlobLocation(
+                backend=backend_type,
+                storage_path=None,
+                size=size,
+                created_at=created_at,
+                name=filename,
+                path=path,
+                content_digest=digest,
+            ),
+        )
+        return BlobCreate(id=blob_id)
+
+    async def _save_chunked(
+        self, blob_id: str, chunks: AsyncIterator[bytes], filename: str, path: str
+    ) -> BlobCreate | None:
+        manifest: list[BlobChunk] = []
+        size = 0
+        try:
+            async for data in self.chunker.split(chunks):
+                digest = await local_io.run(_sha256, data)
+                # one short transaction per chunk: an upload never holds
+                # more than one digest lock, so uploads cannot deadlock
+                async with use_session() as session:
+                    stored, content = await self._store_content(
+                        session, digest, len(data), lambda: _once(data)
+                    )
+                    if not stored:
+                        await session.rollback()
+                        await self._release(manifest)
+                        return None
+                    await reference_content(session, content, digest, len(data))
+                    await session.commit()
+
+                manifest.append(
+                    BlobChunk(
+                        blob_id=blob_id,
+                        position=len(manifest),
+                        digest=digest,
+                        offset=size,
+                        size=len(data),
+                    )
+                )
+                size += len(data)
+
+            blob_metadata = BlobMetadata(
+                id=blob_id,
+                size=size,
+                created_at=datetime.now(timezone.utc),
+                storage_backend=self.get_backend_type(),
+                name=filename,
+                path=path,
+            )
+            async with use_session() as session:
+                blob_metadata = await create_chunked_blob(session, blob_metadata, manifest)
+        except BaseException:
+            await self._release(manifest)
+            raise
+
+        if not blob_metadata:
+            await self._release(manifest)
+            return None
+
+        locator.remember(blob_id, BlobLocation.from_metadata(blob_metadata))
+        logger.debug(f"Stored blob {blob_id} as {len(manifest)} chunks")
+        return BlobCreate(id=blob_id)
+
+    async def _release(self, manifest: list[BlobChunk]) -> None:
+        """Give back the chunk references of an upload that did not complete."""
+        if not manifest:
+            return
+        async with use_session() as session:
+            released = [
+                (digest, await release_content(session, digest))
+                for digest in sorted(chunk.digest for chunk in manifest)
+            ]
+            await self._delete_unreferenced(released)
+            await session.commit()
+
+    async def _delete_unreferenced(self, released: list[tuple[str, int]]) -> None:
+        # called under the digest locks: no upload can start referencing
+        # the content while it goes
+        for digest in sorted({digest for digest, remaining in released if remaining == 0}):
+            await self.backend.delete(content_id_for(digest), shared_content=True)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        reference = await self._reference(blob_id, **kwargs)
+        if reference is None:
+            return await self.backend.delete(blob_id, **kwargs)
+
+        locator.forget(blob_id)
+        async with use_session() as session:
+            try:
+                if reference.chunk_count is not None:
+                    released = await release_blob_chunks(session, blob_id)
+                else:
+                    released = await release_content_reference(session, blob_id)
+                    if released is not None:
+                        released = [released]
+                if released is None:
+                    await session.rollback()
+                    return False
+
+                await self._delete_unreferenced(released)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        return True
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        reference = await self._reference(blob_id, **kwargs)
+        if reference is None:
+            return await self.backend.retrieve(blob_id, **kwargs)
+
+        if reference.chunk_count is not None:
+            blob_stream = await self._chunked_stream(blob_id, reference, 0, None, **kwargs)
+            data = b"".join([chunk async for chunk in blob_stream.chunks])
+            return StoredBlob(
+                id=blob_id,
+                data=data,
+                size=reference.size,
+                created_at=reference.created_at,
+                name=reference.name,
+                path=reference.path,
+                storage_backend=reference.backend,
+            )
+
+        stored_blob = await self.backend.retrieve(
+            content_id_for(reference.content_digest), **kwargs, shared_content=True
+        )
+        if stored_blob is None:
+            return None
+        return replace(
+            stored_blob,
+            id=blob_id,
+            created_at=reference.created_at,
+            name=reference.name,
+            path=reference.path,
+        )
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        reference = await self._reference(blob_id, **kwargs)
+        if reference is None:
+            return await self.backend.retrieve_stream(blob_id, **kwargs)
+        if reference.chunk_count is not None:
+            return await self._chunked_stream(blob_id, reference, 0, None, **kwargs)
+
+        blob_stream = await self.backend.retrieve_stream(
+            content_id_for(reference.content_digest), **kwargs, shared_content=True
+        )
+        return self._as_reference(blob_id, reference, blob_stream)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        reference = await self._reference(blob_id, **kwargs)
+        if reference is None:
+            return await self.backend.retrieve_range(blob_id, start, end, **kwargs)
+        if reference.chunk_count is not None:
+            return await self._chunked_stream(blob_id, reference, start, end, **kwargs)
+
+        blob_stream = await self.backend.retrieve_range(
+            content_id_for(reference.content_digest), start, end, **kwargs, shared_content=True
+        )
+        return self._as_reference(blob_id, reference, blob_stream)
+
+    def get_backend_type(self) -> StorageBackend:
+        return self.backend.get_backend_type()
+
+    async def _reference(self, blob_id: str, **kwargs) -> BlobLocation | None:
+        return await locator.lookup_reference(
+            blob_id, self.get_backend_type(), db=kwargs.get("db")
+        )
+
+    @staticmethod
+    def _as_reference(
+        blob_id: str, reference: BlobLocation, blob_stream: BlobStream | None
+    ) -> BlobStream | None:
+        if blob_stream is None:
+            return None
+        return replace(
+            blob_stream, id=blob_id, created_at=reference.created_at, name=reference.name
+        )
+
+    async def _chunked_stream(
+        self, blob_id: str, reference: BlobLocation, start: int, end: int | None, **kwargs
+    ) -> BlobStream:
+        first, last = resolve_range(start, end, reference.size)
+        async with use_session(kwargs.get("db")) as session:
+            manifest = await get_blob_chunks(session, blob_id)
+        wanted = [c for c in manifest if c.offset <= last and c.offset + c.size > first]
+
+        return BlobStream(
+            id=blob_id,
+            size=reference.size,
+            chunks=self._read_chunks(wanted, first, last),
+            created_at=reference.created_at,
+            name=reference.name,
+            start=first,
+            end=last,
+        )
+
+    async def _fetch_chunk(self, chunk: BlobChunk) -> bytes | memoryview:
+        stored_blob = await self.backend.retrieve(content_id_for(chunk.digest), shared_content=True)
+        if stored_blob is None:
+            raise RuntimeError(f"Chunk {chunk.digest} of blob {chunk.blob_id} is missing")
+        return stored_blob.data
+
+    async def _read_chunks(
+        self, manifest: list[BlobChunk], first: int, last: int
+    ) -> AsyncIterator[bytes]:
+        # the next DEDUP_CHUNK_READ_AHEAD chunks are fetched while one is sent
+        pending = deque()
+        upcoming = iter(manifest)
+        try:
+            for chunk in upcoming:
+                pending.append((chunk, asyncio.ensure_future(self._fetch_chunk(chunk))))
+                if len(pending) > settings.DEDUP_CHUNK_READ_AHEAD:
+                    break
+
+            while pending:
+                chunk, fetch = pending.popleft()
+                data = await fetch
+                following = next(upcoming, None)
+                if following is not None:
+                    pending.append((following, asyncio.ensure_future(self._fetch_chunk(following))))
+
+                lo = max(first - chunk.offset, 0)
+                hi = min(last + 1 - chunk.offset, chunk.size)
+                yield memoryview(data)[lo:hi]
+        finally:
+            for _chunk, fetch in pending:
+                fetch.cancel()
+
+
+chunker = Chunker(
+    settings.DEDUP_CHUNK_MIN_SIZE,
+    settings.DEDUP_CHUNK_AVG_SIZE,
+    settings.DEDUP_CHUNK_MAX_SIZE,
+)
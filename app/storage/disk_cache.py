@@ -0,0 +1,405 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+from dataclasses import replace
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from app.blob_schemas import BlobCreate
+from app.core.config import StorageBackend, settings
+from app.core.logger import setup_logger
+from app.storage.base import BlobStream, StorageBackendInterface, StoredBlob, resolve_range
+from app.storage.executors import local_io
+from app.storage.local_storage import read_file_chunks, sharded_path
+from app.storage.locator import BlobLocation, locator
+
+logger = setup_logger(__name__)
+
+# fill markers are claimed under this many striped lock files, so they never pile up
+_LOCK_STRIPES = 256
+
+
+class DiskCache:
+    """
+    Cache directory of whole blobs shared by every worker on the host.
+
+    Files live at their sharded path under `directory` and only appear
+    there complete (temp file + rename). A fill holds an flock on a
+    per-blob marker file, so when several workers miss the same blob one
+    of them fetches it and the others wait for its file. Markers are only
+    claimed and removed under a short striped lock; the fetch itself runs
+    outside it, so fills of other blobs never queue behind a slow remote.
+    A streamed read that misses fills the file as it goes, so its client
+    gets the first bytes without waiting for the whole blob.
+    Reads bump the access time, and eviction
+    removes the least recently read files once the directory outgrows
+    `max_bytes`; each worker checks after adding a twentieth of it.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, max_object_size: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self._added = 0     # bytes this worker filled since its last eviction pass
+
+        # metrics (this worker)
+        self._hits = 0
+        self._misses = 0
+        self._fills = 0
+        self._lock_waits = 0
+        self._evictions = 0
+
+    def path_for(self, blob_id: str) -> Path:
+        return sharded_path(self.directory, blob_id)
+
+    # ---------- blocking helpers (local I/O threads) ----------
+
+    def _lookup(self, blob_id: str, size: int) -> Optional[Path]:
+        """Path of a complete cached copy, with its access time bumped."""
+        file_path = self.path_for(blob_id)
+        try:
+            stat = file_path.stat()
+            if stat.st_size != size:
+                # left over from an older blob with the same id
+                file_path.unlink(missing_ok=True)
+                return None
+            # atime is not updated on noatime/relatime mounts: set it ourselves
+            os.utime(file_path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return file_path
+
+    def _lock_path(self, blob_id: str) -> Path:
+        stripe = int(hashlib.md5(blob_id.encode()).hexdigest()[:4], 16) % _LOCK_STRIPES
+        return self.directory / ".locks" / f"{stripe:03d}.lock"
+
+    def _marker_path(self, blob_id: str) -> Path:
+        file_path = self.path_for(blob_id)
+        return file_path.with_name(f".{file_path.name}.fill")
+
+    def _stripe_lock(self, blob_id: str) -> int:
+        """Descriptor holding the blob's stripe lock; closing it releases it."""
+        lock_path = self._lock_path(blob_id)
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        # only held around marker bookkeeping, never across a fetch
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _claim(self, blob_id: str, size: int) -> tuple[Optional[Path], Optional[int]]:
+        """
+        (path, None) if the blob is cached, (None, marker fd) if this worker
+        now fills it, (None, None) while another worker is filling it.
+        """
+        stripe_fd = self._stripe_lock(blob_id)
+        try:
+            file_path = self._lookup(blob_id, size)
+            if file_path:
+                return file_path, None
+
+            marker_path = self._marker_path(blob_id)
+            marker_path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(marker_path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                # a marker left by a worker that died is unlocked: take it over
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None, None
+            return None, fd
+        finally:
+            os.close(stripe_fd)
+
+    def _release(self, blob_id: str, fd: int) -> None:
+        """Drop a fill marker claimed by `_claim`."""
+        stripe_fd = self._stripe_lock(blob_id)
+        try:
+            # under the stripe lock, so no one is opening the marker meanwhile
+            self._marker_path(blob_id).unlink(missing_ok=True)
+            os.close(fd)
+        finally:
+            os.close(stripe_fd)
+
+    @staticmethod
+    def _open_for_write(file_path: Path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        return open(file_path, "wb")
+
+    def evict(self) -> int:
+        """Remove least recently read files until under budget; returns how many."""
+        self._added = 0
+        files = []
+        total = 0
+        for file_path in self.directory.glob("*/*/*"):
+            if file_path.name.startswith("."):
+                continue
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, stat.st_size, file_path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        evicted = 0
+        # make room for a while: down to 90% of the budget
+        target = self.max_bytes * 0.9
+        for _atime, size, file_path in sorted(files):
+            if total <= target:
+                break
+            # readers that already opened it keep their descriptor
+            file_path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+
+        self._evictions += evicted
+        logger.info(f"Evicted {evicted} blobs from the disk cache")
+        return evicted
+
+    # ---------- cache ----------
+
+    async def get(self, blob_id: str, size: int) -> Optional[Path]:
+        file_path = await local_io.run(self._lookup, blob_id, size)
+        if file_path:
+            self._hits += 1
+        else:
+            self._misses += 1
+        return file_path
+
+    async def _claim_or_wait(self, blob_id: str, size: int) -> tuple[Optional[Path], Optional[int]]:
+        """(path, None) once the blob is cached, or (None, marker fd) to fill it."""
+        # poll rather than block: a waiting fill must not hold a thread
+        while True:
+            file_path, fd = await local_io.run(self._claim, blob_id, size)
+            if file_path or fd is not None:
+                return file_path, fd
+            self._lock_waits += 1
+            await asyncio.sleep(0.05)
+
+    async def get_or_fill(
+        self,
+        blob_id: str,
+        size: int,
+        fetch: Callable[[], Awaitable[Optional[BlobStream]]],
+    ) -> Optional[Path]:
+        """
+        Cached path of a blob, calling `await fetch()` (a BlobStream or None)
+        to fill it on a miss. Only one worker of the host fetches at a time.
+        """
+        file_path = await self.get(blob_id, size)
+        if file_path:
+            return file_path
+
+        file_path, fd = await self._claim_or_wait(blob_id, size)
+        if file_path:
+            # filled by another worker while we waited
+            return file_path
+
+        try:
+            blob_stream = await fetch()
+            if blob_stream is None:
+                return None
+            async for _chunk in self._write_through(blob_id, blob_stream.chunks):
+                pass
+        finally:
+            await local_io.run(self._release, blob_id, fd)
+
+        await self._filled(size)
+        return self.path_for(blob_id)
+
+    async def get_or_tee(
+        self,
+        blob_id: str,
+        size: int,
+        fetch: Callable[[], Awaitable[Optional[BlobStream]]],
+    ) -> tuple[Optional[Path], Optional[BlobStream]]:
+        """
+        Like `get_or_fill`, but the worker that fetches a missing blob gets
+        (None, the fetched stream) at once: its chunks fill the cache as
+        they are read. Other workers still wait for the file.
+        """
+        file_path = await self.get(blob_id, size)
+        if file_path:
+            return file_path, None
+
+        file_path, fd = await self._claim_or_wait(blob_id, size)
+        if file_path:
+            return file_path, None
+
+        try:
+            blob_stream = await fetch()
+        except BaseException:
+            await local_io.run(self._release, blob_id, fd)
+            raise
+        if blob_stream is None:
+            await local_io.run(self._release, blob_id, fd)
+            return None, None
+        return None, replace(blob_stream, chunks=self._tee(blob_id, size, fd, blob_stream.chunks))
+
+    async def _tee(
+        self, blob_id: str, size: int, fd: int, chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._write_through(blob_id, chunks):
+                yield chunk
+        finally:
+            # also when the client goes away: the marker must not outlive us
+            await local_io.run(self._release, blob_id, fd)
+        await self._filled(size)
+
+    async def _filled(self, size: int) -> None:
+        self._fills += 1
+        self._added += size
+        if self._added >= self.max_bytes // 20:
+            await local_io.run(self.evict)
+
+    async def _write_through(self, blob_id: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Yields `chunks` while writing them; the file appears once all are read."""
+        file_path = self.path_for(blob_id)
+        tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            f = await local_io.run(self._open_for_write, tmp_path)
+            try:
+                async for chunk in chunks:
+                    await local_io.run(f.write, chunk)
+                    yield chunk
+            finally:
+                await local_io.run(f.close)
+            await local_io.run(os.replace, tmp_path, file_path)
+        except BaseException:
+            # failed or abandoned half way: no partial file is ever cached
+            await local_io.run(tmp_path.unlink, missing_ok=True)
+            raise
+
+    async def remove(self, blob_id: str) -> None:
+        await local_io.run(self.path_for(blob_id).unlink, missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_bytes": self.max_bytes,
+            "hits_total": self._hits,
+            "misses_total": self._misses,
+            "fills_total": self._fills,
+            "lock_waits_total": self._lock_waits,
+            "evictions_total": self._evictions,
+        }
+
+
+class DiskCachedStorage(StorageBackendInterface):
+    """
+    Remote backend (S3, FTP) behind the host's DiskCache.
+
+    Blobs indexed in blob_metadata and no larger than the object size cap
+    are fetched into the cache on first read and served from it as plain
+    files (so sendfile applies). A first streamed read is served from the
+    remote while it fills the cache. Anything else goes to the backend.
+    """
+
+    def __init__(self, backend: StorageBackendInterface, cache: DiskCache):
+        self.backend = backend
+        self.cache = cache
+
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
+        await self.cache.remove(blob_id)
+        return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        await self.cache.remove(blob_id)
+        return await self.backend.delete(blob_id, **kwargs)
+
+    async def _cacheable(self, blob_id: str, **kwargs) -> Optional[BlobLocation]:
+        location = await locator.lookup(
+            blob_id,
+            self.get_backend_type(),
+            db=kwargs.get("db"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if not location or location.size > self.cache.max_object_size:
+            return None
+        return location
+
+    async def _cached(self, blob_id: str, **kwargs) -> tuple[Optional[BlobLocation], Optional[Path]]:
+        location = await self._cacheable(blob_id, **kwargs)
+        if not location:
+            return None, None
+
+        file_path = await self.cache.get_or_fill(
+            blob_id, location.size, lambda: self.backend.retrieve_stream(blob_id, **kwargs)
+        )
+        return location, file_path
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        location, file_path = await self._cached(blob_id, **kwargs)
+        if not file_path:
+            return await self.backend.retrieve(blob_id, **kwargs)
+
+        data = await local_io.run(file_path.read_bytes)
+        return StoredBlob(
+            id=blob_id,
+            data=data,
+            size=location.size,
+            created_at=location.created_at,
+            name=location.name,
+            path=location.path,
+            storage_backend=location.backend,
+            storage_path=location.storage_path,
+        )
+
+    def _from_file(
+        self, blob_id: str, location: BlobLocation, file_path: Path, first: int, last: int
+    ) -> BlobStream:
+        return BlobStream(
+            id=blob_id,
+            size=location.size,
+            chunks=read_file_chunks(file_path, first, last + 1),
+            created_at=location.created_at,
+            name=location.name,
+            start=first,
+            end=last,
+            file_path=str(file_path),
+        )
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        location = await self._cacheable(blob_id, **kwargs)
+        if not location:
+            return await self.backend.retrieve_stream(blob_id, **kwargs)
+
+        file_path, blob_stream = await self.cache.get_or_tee(
+            blob_id, location.size, lambda: self.backend.retrieve_stream(blob_id, **kwargs)
+        )
+        if not file_path:
+            # this worker fills it: the first bytes go out as they arrive
+            return blob_stream
+        return self._from_file(blob_id, location, file_path, 0, location.size - 1)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        location, file_path = await self._cached(blob_id, **kwargs)
+        if not file_path:
+            return await self.backend.retrieve_range(blob_id, start, end, **kwargs)
+
+        first, last = resolve_range(start, end, location.size)
+        return self._from_file(blob_id, location, file_path, first, last)
+
+    def get_backend_type(self) -> StorageBackend:
+        return self.backend.get_backend_type()
+
+
+disk_cache = DiskCache(
+    Path(settings.DISK_CACHE_PATH),
+    settings.DISK_CACHE_MAX_BYTES,
+    settings.DISK_CACHE_MAX_OBJECT_SIZE,
+)
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class BlockingIO:
+    """
+    Dedicated worker threads for one backend's blocking I/O.
+
+    Each backend gets its own pool, so a slow disk or FTP server only
+    delays requests to that backend; the pool size is its concurrency
+    limit, calls beyond it queue up here instead of on the event loop.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Run `func` on this backend's threads and await its result."""
+        with self._lock:
+            self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+        return {
+            "max_workers": self.max_workers,
+            "pending": pending,                             # running + queued
+            "queued": max(pending - self.max_workers, 0),
+        }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+local_io = BlockingIO("local-io", settings.LOCAL_IO_THREADS)
+ftp_io = BlockingIO("ftp-io", settings.FTP_IO_THREADS)
@@ -0,0 +1,298 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from ftplib import FTP_TLS
+from typing import Callable, Optional
+
+from app.core.logger import setup_logger
+from app.storage.executors import BlockingIO
+
+logger = setup_logger(__name__)
+
+
+class FTPPoolTimeout(Exception):
+    """No pooled FTP session became free in time"""
+
+
+class FTPConnectionPool:
+    """
+    Bounded pool of logged-in FTPS sessions, shared by every request.
+
+    The TLS handshake and login cost more than most transfers, so sessions
+    are kept open between requests. A session idle for longer than
+    `check_after` seconds is probed with NOOP on checkout and replaced when
+    the server has dropped it; `keepalive()` NOOPs idle sessions so the
+    server does not time them out. Thread safe: ftplib is blocking and runs
+    in worker threads. Coroutines wait for a free session on the event loop
+    and only connect, probe and keep alive on `io`, the backend's own
+    threads, so a stalled server never ties up threads shared with other code.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], FTP_TLS],
+        max_size: int,
+        timeout: float,
+        check_after: float,
+        keepalive_interval: float,
+        io: BlockingIO,
+    ):
+        self._connect = connect
+        self.io = io
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.keepalive_interval = keepalive_interval
+
+        self._idle: deque[tuple[FTP_TLS, float]] = deque()  # (session, last used)
+        self._size = 0                                       # idle + checked out
+        self._closed = False
+        self._available = threading.Condition()
+        # coroutines waiting in async_acquire(); popped once woken
+        self._async_waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+        # metrics
+        self._waiting = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+
+    # ---------- checkout ----------
+
+    def acquire(self) -> FTP_TLS:
+        """Check out a healthy session, connecting a new one if needed."""
+        deadline = time.monotonic() + self.timeout
+
+        with self._available:
+            while True:
+                reserved = self._reserve()
+                if reserved is not None:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise FTPPoolTimeout(f"No FTP session free after {self.timeout}s")
+
+                self._waiting += 1
+                self._waits += 1
+                started = time.monotonic()
+                try:
+                    self._available.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._wait_seconds += time.monotonic() - started
+
+        return self._prepare(*reserved)
+
+    async def async_acquire(self) -> FTP_TLS:
+        """acquire() for coroutines: the wait is on the loop, the network on `io`."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._available:
+                reserved = self._reserve()
+                if reserved is not None:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise FTPPoolTimeout(f"No FTP session free after {self.timeout}s")
+
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+                self._waiting += 1
+                self._waits += 1
+
+            started = time.monotonic()
+            try:
+                await asyncio.wait((waiter,), timeout=remaining)
+            except BaseException:
+                with self._available:
+                    self._forget(loop, waiter)
+                raise
+            finally:
+                with self._available:
+                    self._waiting -= 1
+                    self._wait_seconds += time.monotonic() - started
+                    # timed out: no longer waiting
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+        checkout = asyncio.ensure_future(self.io.run(self._prepare, *reserved))
+        try:
+            return await asyncio.shield(checkout)
+        except asyncio.CancelledError:
+            # the checkout carries on in its thread: its session comes back once it is done
+            checkout.add_done_callback(self._release_abandoned)
+            raise
+
+    def _reserve(self) -> Optional[tuple[Optional[FTP_TLS], float]]:
+        """
+        Under the lock: an idle (session, last used), (None, 0) for a slot to
+        connect, or None when every session is checked out.
+        """
+        if self._closed:
+            raise RuntimeError("FTP connection pool is closed")
+        if self._idle:
+            # most recently used first: the most likely to be alive
+            return self._idle.pop()
+        if self._size < self.max_size:
+            self._size += 1
+            return None, 0.0
+        return None
+
+    def _prepare(self, ftps: Optional[FTP_TLS], last_used: float) -> FTP_TLS:
+        """Make a reserved slot a usable session; network round trips, outside the lock."""
+        if ftps is not None:
+            if time.monotonic() - last_used < self.check_after or self._is_alive(ftps):
+                self._reused += 1
+                return ftps
+            logger.info("Pooled FTP session went stale, reconnecting")
+            self._close_quietly(ftps)
+            self._discarded += 1
+
+        try:
+            ftps = self._connect()
+        except BaseException:
+            # give the reserved slot back
+            with self._available:
+                self._size -= 1
+                self._notify()
+            raise
+
+        self._created += 1
+        return ftps
+
+    def release(self, ftps: FTP_TLS, reusable: bool = True) -> None:
+        """Return a session; broken ones (state unknown) are closed instead."""
+        with self._available:
+            if reusable and not self._closed:
+                self._idle.append((ftps, time.monotonic()))
+                self._notify()
+                return
+            self._size -= 1
+            self._notify()
+
+        if not reusable:
+            self._discarded += 1
+        self._close_quietly(ftps)
+
+    @contextmanager
+    def connection(self):
+        ftps = self.acquire()
+        try:
+            yield ftps
+        except BaseException:
+            self.release(ftps, reusable=False)
+            raise
+        self.release(ftps)
+
+    @asynccontextmanager
+    async def async_connection(self):
+        """connection() for coroutines: waiting for a free session never blocks the loop."""
+        ftps = await self.async_acquire()
+        try:
+            yield ftps
+        except BaseException:
+            self.release(ftps, reusable=False)
+            raise
+        self.release(ftps)
+
+    def _release_abandoned(self, checkout: asyncio.Future) -> None:
+        if not checkout.cancelled() and checkout.exception() is None:
+            self.release(checkout.result())
+
+    # ---------- maintenance ----------
+
+    def keepalive(self) -> None:
+        """NOOP sessions idle for a keepalive interval, dropping dead ones."""
+        now = time.monotonic()
+        with self._available:
+            due = [(f, t) for f, t in self._idle if now - t >= self.keepalive_interval]
+            for entry in due:
+                self._idle.remove(entry)
+
+        for ftps, _last_used in due:
+            self.release(ftps, reusable=self._is_alive(ftps))
+
+    async def run_keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.io.run(self.keepalive)
+
+    def close(self) -> None:
+        """Shutdown hook: quit idle sessions, close the rest on release."""
+        with self._available:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._available.notify_all()
+            while self._async_waiters:
+                self._notify()
+
+        for ftps, _last_used in idle:
+            try:
+                ftps.quit()
+            except Exception:
+                self._close_quietly(ftps)
+
+    def stats(self) -> dict:
+        with self._available:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "waits_total": self._waits,
+                "wait_seconds_total": round(self._wait_seconds, 6),
+                "timeouts_total": self._timeouts,
+                "created_total": self._created,
+                "reused_total": self._reused,
+                "discarded_total": self._discarded,
+            }
+
+    # ---------- helpers ----------
+
+    def _notify(self) -> None:
+        """Under the lock: wake a waiter, thread or coroutine, for a freed slot."""
+        self._available.notify()
+        if self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _forget(self, loop: asyncio.AbstractEventLoop, waiter: asyncio.Future) -> None:
+        """Under the lock: a coroutine gave up waiting; pass on a wake-up it got."""
+        if (loop, waiter) in self._async_waiters:
+            self._async_waiters.remove((loop, waiter))
+        else:
+            self._notify()
+
+    @staticmethod
+    def _wake(waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    @staticmethod
+    def _is_alive(ftps: FTP_TLS) -> bool:
+        try:
+            ftps.voidcmd("NOOP")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(ftps: FTP_TLS) -> None:
+        try:
+            ftps.close()
+        except Exception:
+            pass
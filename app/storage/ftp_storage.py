@@ -1,13 +1,29 @@
-from ftplib import FTP_TLS
+from ftplib import FTP_TLS, error_proto
 from io import BytesIO
 from datetime import datetime, timezone
+from typing import AsyncIterator
+import base64
+import ssl
 
-from app.storage.base import StorageBackendInterface
+from app.storage.base import StorageBackendInterface, BlobStream, StoredBlob, resolve_range
+from app.storage.locator import BlobLocation, locator
+from app.storage.ftp_pool import FTPConnectionPool
+from app.storage.executors import ftp_io
 from app.core.config import StorageBackend
-from app.blob_schemas import BlobResponse
+from app.storage.streaming import (
+    PayloadMeter,
+    b64_decoded_size,
+    decode_stored,
+    stored_span,
+)
+from app.blob_schemas import BlobCreate
 from app.core.config import settings
 
 
+class _AbortFailed(Exception):
+    """Raised when a ranged download got its bytes but its transfer could not be aborted"""
+
+
 class FTPStorage(StorageBackendInterface):
 
     def __init__(self):
@@ -37,6 +53,23 @@ class FTPStorage(StorageBackendInterface):
 
         return ftps
 
+    @staticmethod
+    def _abort_transfer(ftps: FTP_TLS) -> None:
+        """
+        ABOR a RETR whose data connection was closed early, then NOOP: the
+        transfer's 426/226 and ABOR's 225/226 replies, in whichever order
+        and number the server sends them, are read up to NOOP's 200, which
+        leaves the control channel in step for the next command.
+        """
+        ftps.putcmd("ABOR")
+        ftps.putcmd("NOOP")
+        while True:
+            resp = ftps.getmultiline()
+            if resp[:3] == "200":
+                return
+            if resp[:3] not in {"225", "226", "426", "451"}:
+                raise error_proto(resp)
+
     def _object_key(self, blob_id: str) -> str:
         ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
         safe_id = blob_id.replace("/", "_")
@@ -60,59 +93,240 @@ class FTPStorage(StorageBackendInterface):
 
     # ---------- interface methods ----------
 
-    async def save(
+    async def save_stream(
         self,
         blob_id: str,
-        data: bytes,
+        chunks: AsyncIterator[bytes],
         filename: str,
         path: str,
         **kwargs,
-    ) -> BlobResponse | None:
+    ) -> BlobCreate | None:
 
-        ftps = self._connect()
         object_key = self._object_key(blob_id)
+        meter = PayloadMeter()
 
-        with BytesIO(data) as buffer:
-            buffer.seek(0)
-            ftps.storbinary(f"STOR {object_key}", buffer)
+        async with ftp_pool.async_connection() as ftps:
+            # Same as storbinary(), but fed from the upload stream; every
+            # blocking ftplib call runs on the FTP I/O threads
+            await ftp_io.run(ftps.voidcmd, "TYPE I")
+            conn = await ftp_io.run(ftps.transfercmd, f"STOR {object_key}")
+            with conn:
+                async for chunk in meter.track(chunks):
+                    await ftp_io.run(conn.sendall, chunk)
+                if isinstance(conn, ssl.SSLSocket):
+                    await ftp_io.run(conn.unwrap)
+            await ftp_io.run(ftps.voidresp)
 
-        ftps.quit()
+            location = await locator.record(
+                blob_id,
+                StorageBackend.FTP,
+                storage_path=object_key,
+                size=meter.size,
+                name=filename,
+                path=path,
+                db=kwargs.get("db"),
+                batch=kwargs.get("metadata_batch"),
+                shared_content=kwargs.get("shared_content", False),
+            )
+            if not location:
+                await ftp_io.run(ftps.delete, object_key)
+                return None
 
-        return BlobResponse(
-            id=blob_id,
-            data=data,
-            size=len(data),
-            created_at=self._extract_created_at(object_key),
-            name=filename,
-            path=path,
-            storage_backend=StorageBackend.FTP,
-            storage_path=object_key,
-        )
-
-    async def retrieve(self, blob_id: str, **kwargs) -> BlobResponse | None:
-        ftps = self._connect()
+        return BlobCreate(id=blob_id)
 
+    def _scan_legacy(self, ftps: FTP_TLS, blob_id: str) -> tuple[str, int] | None:
+        """Key and raw size of a blob written before the locator index."""
         storage_path = self._find_key(ftps, blob_id)
         if not storage_path:
-            ftps.quit()
+            return None
+        return storage_path, self._legacy_size(ftps, storage_path)
+
+    def _legacy_size(self, ftps: FTP_TLS, storage_path: str) -> int:
+        """Raw size of an object with no recorded content encoding."""
+        ftps.voidcmd("TYPE I")
+        size = ftps.size(storage_path)
+
+        # the last bytes carry the Base64 padding of legacy objects
+        if settings.LEGACY_BASE64_READS:
+            tail = BytesIO()
+            if size:
+                ftps.retrbinary(
+                    f"RETR {storage_path}", tail.write, rest=max(size - 2, 0)
+                )
+            size = b64_decoded_size(size, tail.getvalue())
+
+        return size
+
+    async def _locate(self, blob_id: str, **kwargs) -> BlobLocation | None:
+        location = await locator.lookup(
+            blob_id,
+            StorageBackend.FTP,
+            db=kwargs.get("db"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if location:
+            return location
+
+        # blobs written before the locator index existed: list the directory once
+        if not settings.LEGACY_LOCATION_SCANS:
+            return None
+        async with ftp_pool.async_connection() as ftps:
+            found = await ftp_io.run(self._scan_legacy, ftps, blob_id)
+        if not found:
+            return None
+
+        storage_path, size = found
+
+        # indexed as something else, e.g. shared content: not this blob
+        if await locator.indexed(blob_id, db=kwargs.get("db")):
+            return None
+
+        location = BlobLocation(
+            backend=StorageBackend.FTP,
+            storage_path=storage_path,
+            size=size,
+            created_at=self._extract_created_at(storage_path),
+        )
+        locator.remember(blob_id, location)
+        return location
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
             return None
 
         buffer = BytesIO()
-        ftps.retrbinary(f"RETR {storage_path}", buffer.write)
-        ftps.quit()
+        async with ftp_pool.async_connection() as ftps:
+            await ftp_io.run(ftps.retrbinary, f"RETR {location.storage_path}", buffer.write)
 
-        data = buffer.getvalue()
+        if location.base64_at_rest:
+            data = base64.b64decode(buffer.getbuffer())
+        else:
+            # hand out the buffer itself rather than a copy of it
+            data = buffer.getbuffer()
 
-        return BlobResponse(
+        return StoredBlob(
             id=blob_id,
             data=data,
-            size=len(data),
-            created_at=self._extract_created_at(storage_path),
-            name="unknown",
-            path=storage_path,
+            size=location.size,
+            created_at=location.created_at,
+            name=location.name,
+            path=location.path,
             storage_backend=StorageBackend.FTP,
-            storage_path=storage_path,
+            storage_path=location.storage_path,
+        )
+
+    async def _download(
+        self,
+        storage_path: str,
+        rest: int | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[bytes]:
+        """RETR `limit` bytes (all when None) from offset `rest`, chunk by chunk."""
+        remaining = limit
+        try:
+            # the wait for a session is on the loop, and each recv is its own
+            # ftp_io call: no worker thread waits for a session or a slow client
+            async with ftp_pool.async_connection() as ftps:
+                await ftp_io.run(ftps.voidcmd, "TYPE I")
+                conn = await ftp_io.run(ftps.transfercmd, f"RETR {storage_path}", rest)
+                with conn:
+                    while remaining is None or remaining > 0:
+                        size = settings.DOWNLOAD_CHUNK_SIZE
+                        if remaining is not None:
+                            size = min(size, remaining)
+                        chunk = await ftp_io.run(conn.recv, size)
+                        if not chunk:
+                            break
+                        if remaining is not None:
+                            remaining -= len(chunk)
+                        yield chunk
+                    cut_short = remaining == 0
+                    if not cut_short and isinstance(conn, ssl.SSLSocket):
+                        await ftp_io.run(conn.unwrap)
+
+                if not cut_short:
+                    await ftp_io.run(ftps.voidresp)
+                    return
+                # the data connection is closed: abort the rest of the file so
+                # the session goes back to the pool
+                try:
+                    await ftp_io.run(self._abort_transfer, ftps)
+                except Exception as e:
+                    # the pool discards sessions that raised
+                    raise _AbortFailed() from e
+        except _AbortFailed:
+            # every byte asked for was sent: only the session is lost
+            return
+
+    async def _stream(
+        self,
+        blob_id: str,
+        byte_range: tuple[int, int | None] | None = None,
+        **kwargs,
+    ) -> BlobStream | None:
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return None
+
+        storage_path = location.storage_path
+        size = location.size
+
+        if byte_range:
+            first, last = resolve_range(*byte_range, size)
+            # REST to the stored bytes holding the requested range
+            start, stop, skip = stored_span(first, last, location.base64_at_rest)
+            rest, limit = start, stop - start
+        else:
+            first, last, skip = 0, size - 1, 0
+            rest, limit = None, None
+
+        # nothing is transferred until the response consumes the chunks
+        chunks = self._download(storage_path, rest, limit)
+
+        return BlobStream(
+            id=blob_id,
+            size=size,
+            chunks=decode_stored(chunks, location.base64_at_rest, skip, last - first + 1),
+            created_at=location.created_at,
+            name=location.name,
+            start=first,
+            end=last,
+        )
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self._stream(blob_id, **kwargs)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        return await self._stream(blob_id, (start, end), **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return False
+
+        # the row goes first: a failure after it leaves garbage, not a
+        # row pointing at nothing
+        await locator.discard(
+            blob_id, db=kwargs.get("db"), shared_content=kwargs.get("shared_content", False)
         )
 
+        async with ftp_pool.async_connection() as ftps:
+            await ftp_io.run(ftps.delete, location.storage_path)
+        return True
+
     def get_backend_type(self) -> StorageBackend:
         return StorageBackend.FTP
+
+
+# logged-in sessions shared by every FTPStorage instance
+ftp_pool = FTPConnectionPool(
+    connect=lambda: FTPStorage()._connect(),
+    max_size=settings.FTP_POOL_SIZE,
+    timeout=settings.FTP_POOL_TIMEOUT,
+    check_after=settings.FTP_POOL_CHECK_AFTER,
+    keepalive_interval=settings.FTP_POOL_KEEPALIVE_INTERVAL,
+    io=ftp_io,
+)
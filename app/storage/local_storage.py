@@ -1,11 +1,65 @@
 from pathlib import Path
 from datetime import datetime
-from app.storage.base import StorageBackendInterface
+from typing import AsyncIterator
+import asyncio
+import base64
+import hashlib
+import os
+import uuid
+from app.storage.base import StorageBackendInterface, BlobStream, StoredBlob, resolve_range
+from app.storage.locator import BlobLocation, locator
+from app.storage.executors import local_io
+from app.storage.group_commit import local_commit
+from app.storage.pack_store import PACK_PREFIX, PackStore, open_pack_store
+from app.storage.streaming import (
+    PayloadMeter,
+    b64_decoded_size,
+    decode_stored,
+    stored_span,
+)
 from app.core.config import settings, StorageBackend
-from app.blob_schemas import BlobResponse ,  BlobCreate
+from app.blob_schemas import BlobCreate
+from app.core.logger import setup_logger
 from datetime import datetime, timezone
 from pathlib import Path
 
+logger = setup_logger(__name__)
+
+
+def sharded_path(root: Path, blob_id: str) -> Path:
+    """
+    Deterministic location of a blob: two levels of hex prefixes of the MD5
+    of its id (`<root>/b6/e1/<blob_id>`), so no directory grows large and a
+    lookup never has to list one.
+    """
+    safe_id = blob_id.replace("/", "_")
+    digest = hashlib.md5(safe_id.encode()).hexdigest()
+    return root / digest[:2] / digest[2:4] / safe_id
+
+
+def _read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+async def read_file_chunks(file_path: Path, start: int, stop: int) -> AsyncIterator[bytes]:
+    """Bytes [start, stop) of a file in DOWNLOAD_CHUNK_SIZE chunks."""
+    # every disk access runs on the local I/O threads, never on the loop
+    f = await local_io.run(open, file_path, "rb")
+    try:
+        offset = start
+        while offset < stop:
+            chunk = await local_io.run(
+                _read_at, f, offset, min(settings.DOWNLOAD_CHUNK_SIZE, stop - offset)
+            )
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        await local_io.run(f.close)
+
+
 class LocalStorage(StorageBackendInterface):
 
     def __init__(self):
@@ -13,74 +67,350 @@ class LocalStorage(StorageBackendInterface):
         self.root.mkdir(parents=True, exist_ok=True)
 
     def _path_for(self, blob_id: str) -> Path:
-        created_at = datetime.now(timezone.utc)
-        ts = created_at.strftime("%Y%m%dT%H%M%S%fZ")
-        safe_id = blob_id.replace("/", "_")
+        return sharded_path(self.root, blob_id)
 
-        filename = f"{ts}__{safe_id}.bin"
-        return self.root / filename
+    async def _pack_store(self) -> PackStore:
+        return await local_io.run(
+            open_pack_store, self.root / "packs", settings.LOCAL_PACK_SEGMENT_SIZE
+        )
     
     def _parse_created_at_from_path(self, path: Path) -> datetime:
         # Extract "<timestamp>" from "<timestamp>__<blob_id>.bin"
         ts = path.name.split("__", 1)[0]
         return datetime.strptime(ts, "%Y%m%dT%H%M%S%fZ").replace(tzinfo=timezone.utc)
 
+    def _find_path(self, blob_id: str) -> Path | None:
+        """Legacy flat layout: `<timestamp>__<blob_id>.bin` in the root"""
+        safe_id = blob_id.replace("/", "_")
+
+        matches = list(self.root.glob(f"*__{safe_id}.bin"))
+        if not matches:
+            return None
+
+        return matches[0]
+
+    def _unindexed_info(self, file_path: Path) -> tuple[int, datetime]:
+        """Raw size and mtime of a file with no blob_metadata row."""
+        stat = file_path.stat()
+        size = stat.st_size
+        if settings.LEGACY_BASE64_READS:
+            with open(file_path, "rb") as f:
+                # padding in the last bytes gives the exact raw size
+                f.seek(max(size - 2, 0))
+                size = b64_decoded_size(size, f.read())
+        return size, datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+    @staticmethod
+    def _open_for_write(file_path: Path):
+        """Open `file_path` for writing, with the parents of any new shard directory."""
+        # a new directory only persists once its parent is synced
+        new_dirs = [d.parent for d in (file_path.parent, file_path.parent.parent) if not d.exists()]
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        return open(file_path, "wb"), new_dirs
+
+    @staticmethod
+    def _fsync(f) -> None:
+        f.flush()
+        os.fsync(f.fileno())
+
+    async def _locate(self, blob_id: str, **kwargs) -> BlobLocation | None:
+        location = await locator.lookup(
+            blob_id,
+            StorageBackend.LOCAL,
+            db=kwargs.get("db"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if location:
+            return location
+
+        # not indexed: its sharded path, or a scan of the legacy flat layout
+        file_path = self._path_for(blob_id)
+        try:
+            size, created_at = await local_io.run(self._unindexed_info, file_path)
+        except OSError:
+            if not settings.LEGACY_LOCATION_SCANS:
+                return None
+            file_path = await local_io.run(self._find_path, blob_id)
+            if not file_path:
+                return None
+            try:
+                size, _mtime = await local_io.run(self._unindexed_info, file_path)
+            except OSError:
+                return None
+            created_at = self._parse_created_at_from_path(file_path)
+
+        # indexed as something else, e.g. shared content: not this blob
+        if await locator.indexed(blob_id, db=kwargs.get("db")):
+            return None
+
+        location = BlobLocation(
+            backend=StorageBackend.LOCAL,
+            storage_path=file_path.relative_to(self.root).as_posix(),
+            size=size,
+            created_at=created_at,
+        )
+        locator.remember(blob_id, location)
+        return location
+
+    async def _read_packed(self, blob_id: str, start: int, stop: int) -> AsyncIterator[bytes]:
+        store = await self._pack_store()
+        chunk = await local_io.run(store.read, blob_id, start, stop)
+        if chunk is None:
+            raise RuntimeError(f"Packed blob vanished while streaming blob_id:{blob_id}")
+        yield chunk
 
-    async def save(
+    async def save_stream(
         self,
         blob_id: str,
-        data: bytes,
+        chunks: AsyncIterator[bytes],
         filename: str,
         path: str,
         **kwargs,
-    ) ->  BlobCreate | None:
+    ) -> BlobCreate | None:
 
-        file_path = self._path_for(blob_id)
-        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if settings.LOCAL_PACK_ENABLED:
+            max_packed = settings.LOCAL_PACK_MAX_BLOB_SIZE
+            size = kwargs.get("size")
+            if size is None or size <= max_packed:
+                # buffer up to the pack limit: small blobs go to a pack file
+                chunks = aiter(chunks)
+                head = bytearray()
+                async for chunk in chunks:
+                    head += chunk
+                    if len(head) > max_packed:
+                        break
+                else:
+                    return await self._save_packed(blob_id, bytes(head), filename, path, **kwargs)
+
+                chunks = self._prepend(bytes(head), chunks)
+
+        return await self._save_file(blob_id, chunks, filename, path, **kwargs)
 
+    @staticmethod
+    async def _prepend(head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in chunks:
+            yield chunk
+
+    async def _save_packed(
+        self, blob_id: str, data: bytes, filename: str, path: str, **kwargs
+    ) -> BlobCreate | None:
+        store = await self._pack_store()
         try:
-            with open(file_path, "wb") as f:
-                f.write(data)
+            await local_io.run(store.put, blob_id, data)
+            if settings.LOCAL_FSYNC:
+                # one segment + index fsync for every put of the window
+                await local_commit.sync(store.sync)
         except OSError:
+            await local_io.run(store.delete, blob_id)
             return None
 
-        # stat = file_path.stat()
-
-        return BlobCreate(
-            id=blob_id,
-            data=data,
+        location = await locator.record(
+            blob_id,
+            StorageBackend.LOCAL,
+            storage_path=f"{PACK_PREFIX}{blob_id}",
+            size=len(data),
+            name=filename,
+            path=path,
+            db=kwargs.get("db"),
+            batch=kwargs.get("metadata_batch"),
+            shared_content=kwargs.get("shared_content", False),
         )
+        if not location:
+            await local_io.run(store.delete, blob_id)
+            return None
 
-    async def retrieve(self, blob_id: str, **kwargs) -> BlobResponse | None:
+        return BlobCreate(id=blob_id)
 
-        safe_id = blob_id.replace("/", "_")
+    async def _write_file(self, file_path: Path, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Write a blob atomically and return its size: the payload goes to a
+        temp file next to `file_path` that is renamed over it once complete,
+        so a crash leaves the whole blob or nothing, never a torn file. With
+        LOCAL_FSYNC it only returns once the blob is durable.
+        """
+        tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        meter = PayloadMeter()
 
-        matches = list(self.root.glob(f"*__{safe_id}.bin"))
-        if not matches:
-            return None
+        try:
+            f, new_dirs = await local_io.run(self._open_for_write, tmp_path)
+            try:
+                async for chunk in meter.track(chunks):
+                    await local_io.run(f.write, chunk)
+                if settings.LOCAL_FSYNC:
+                    await local_io.run(self._fsync, f)
+            finally:
+                await local_io.run(f.close)
+            await local_io.run(os.replace, tmp_path, file_path)
+        except Exception:
+            # upload aborted half way: don't leave a truncated blob behind
+            await local_io.run(tmp_path.unlink, missing_ok=True)
+            raise
+
+        if settings.LOCAL_FSYNC:
+            try:
+                # the rename shares a directory fsync with concurrent saves
+                await local_commit.sync(file_path.parent, *new_dirs)
+            except Exception:
+                await local_io.run(file_path.unlink, missing_ok=True)
+                raise
+
+        return meter.size
+
+    async def _save_file(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
 
-        file_path = matches[0]
-        
+        file_path = self._path_for(blob_id)
         try:
-            with open(file_path, "rb") as f:
-                data = f.read()
+            size = await self._write_file(file_path, chunks)
         except OSError:
             return None
 
-        stat = file_path.stat()
+        location = await locator.record(
+            blob_id,
+            StorageBackend.LOCAL,
+            storage_path=file_path.relative_to(self.root).as_posix(),
+            size=size,
+            name=filename,
+            path=path,
+            db=kwargs.get("db"),
+            batch=kwargs.get("metadata_batch"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if not location:
+            await local_io.run(file_path.unlink, missing_ok=True)
+            return None
 
-        created_at = self._parse_created_at_from_path(file_path)
-        
-        return BlobResponse(
+        return BlobCreate(id=blob_id)
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return None
+
+        if location.storage_path.startswith(PACK_PREFIX):
+            store = await self._pack_store()
+            data = await local_io.run(store.read, blob_id)
+            if data is None:
+                return None
+        else:
+            try:
+                data = await local_io.run((self.root / location.storage_path).read_bytes)
+            except OSError:
+                return None
+
+        if location.base64_at_rest:
+            data = base64.b64decode(data)
+
+        return StoredBlob(
             id=blob_id,
             data=data,
-            size=stat.st_size,
-            created_at=created_at,
-            # name="Null",         # Optional 
-            # path=str(file_path),   # Optional       
-            # storage_backend=StorageBackend.LOCAL,
-            # storage_path=str(file_path), Optional
+            size=location.size,
+            created_at=location.created_at,
+            name=location.name,
+            path=location.path,
+            storage_backend=StorageBackend.LOCAL,
+            storage_path=location.storage_path,
+        )
+
+    async def _stream(
+        self,
+        blob_id: str,
+        byte_range: tuple[int, int | None] | None = None,
+        **kwargs,
+    ) -> BlobStream | None:
+
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return None
+
+        size = location.size
+        first, last = resolve_range(*byte_range, size) if byte_range else (0, size - 1)
+
+        if location.storage_path.startswith(PACK_PREFIX):
+            return BlobStream(
+                id=blob_id,
+                size=size,
+                # one pread of the range from its segment
+                chunks=self._read_packed(blob_id, first, last + 1),
+                created_at=location.created_at,
+                name=location.name,
+                start=first,
+                end=last,
+            )
+
+        # seek straight to the stored bytes holding the requested range
+        start, stop, skip = stored_span(first, last, location.base64_at_rest)
+        file_path = self.root / location.storage_path
+        chunks = read_file_chunks(file_path, start, stop)
+
+        return BlobStream(
+            id=blob_id,
+            size=size,
+            chunks=decode_stored(chunks, location.base64_at_rest, skip, last - first + 1),
+            created_at=location.created_at,
+            name=location.name,
+            start=first,
+            end=last,
+            # raw files can be sent by the kernel instead of through Python
+            file_path=None if location.base64_at_rest else str(file_path),
         )
 
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self._stream(blob_id, **kwargs)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        return await self._stream(blob_id, (start, end), **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return False
+
+        # the row goes first: a failure after it leaves garbage, not a
+        # row pointing at nothing
+        await locator.discard(
+            blob_id, db=kwargs.get("db"), shared_content=kwargs.get("shared_content", False)
+        )
+
+        if location.storage_path.startswith(PACK_PREFIX):
+            store = await self._pack_store()
+            await local_io.run(store.delete, blob_id)
+        else:
+            await local_io.run((self.root / location.storage_path).unlink, missing_ok=True)
+
+        return True
+
+    async def compact_packs(self) -> int:
+        """Reclaim the space of deleted packed blobs; returns bytes freed."""
+        store = await self._pack_store()
+        return await local_io.run(store.compact, settings.LOCAL_PACK_COMPACT_RATIO)
+
+    async def pack_stats(self) -> dict:
+        store = await self._pack_store()
+        return await local_io.run(store.stats)
+
     def get_backend_type(self) -> StorageBackend:
         return StorageBackend.LOCAL
+
+
+async def run_pack_compaction() -> None:
+    """Background task: compact the pack files every LOCAL_PACK_COMPACT_INTERVAL."""
+    while True:
+        await asyncio.sleep(settings.LOCAL_PACK_COMPACT_INTERVAL)
+        try:
+            reclaimed = await LocalStorage().compact_packs()
+        except Exception as e:
+            logger.error(f"Pack compaction failed: {e}")
+            continue
+        if reclaimed:
+            logger.info(f"Pack compaction reclaimed {reclaimed} bytes")
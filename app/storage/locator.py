@@ -0,0 +1,321 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.blob_crud import (
+    create_blob_metadata,
+    create_blob_metadata_many,
+    delete_blob_metadata,
+    get_blob_metadata,
+    update_blob_encoding,
+)
+from app.blob_models import BlobMetadata
+from app.core.config import ContentEncoding, StorageBackend, settings
+from app.core.database import AsyncSession, use_session
+from app.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass(frozen=True)
+class BlobLocation:
+    """Where a blob lives in its backend, as recorded in blob_metadata"""
+    backend: StorageBackend
+    storage_path: Optional[str]    # None for deduplicated blobs
+    size: int                      # raw payload size in bytes (stored size if compressed)
+    created_at: Optional[datetime] = None
+    name: Optional[str] = None
+    path: Optional[str] = None
+    content_encoding: Optional[ContentEncoding] = None  # None for legacy objects
+    content_digest: Optional[str] = None   # deduplicated: stored as this shared content
+    chunk_count: Optional[int] = None      # chunked: made of this many blob_chunk rows
+    uncompressed_size: Optional[int] = None  # compressed: payload size before compression
+    shared_content: bool = False           # content object of deduplicated blobs
+
+    @property
+    def compressed(self) -> bool:
+        """Whether the stored object has to be decompressed when read"""
+        return self.content_encoding in (ContentEncoding.ZLIB, ContentEncoding.ZSTD)
+
+    @property
+    def deduplicated(self) -> bool:
+        """Whether the blob is stored as shared content rather than under its own id"""
+        return self.content_digest is not None or self.chunk_count is not None
+
+    @property
+    def base64_at_rest(self) -> bool:
+        """Whether the stored object has to be Base64 decoded when read"""
+        if self.content_encoding is None:
+            return settings.LEGACY_BASE64_READS
+        return self.content_encoding == ContentEncoding.BASE64
+
+    @classmethod
+    def from_metadata(cls, blob_metadata: BlobMetadata) -> "BlobLocation":
+        return cls(
+            backend=blob_metadata.storage_backend,
+            storage_path=blob_metadata.storage_path,
+            size=blob_metadata.size,
+            created_at=blob_metadata.created_at,
+            name=blob_metadata.name,
+            path=blob_metadata.path,
+            content_encoding=blob_metadata.content_encoding,
+            content_digest=blob_metadata.content_digest,
+            chunk_count=blob_metadata.chunk_count,
+            uncompressed_size=blob_metadata.uncompressed_size,
+            shared_content=bool(blob_metadata.shared_content),
+        )
+
+
+class MetadataBatch:
+    """
+    blob_metadata rows of a batch of uploads, inserted together by flush()
+    instead of one transaction per blob. Pass it to save_stream as
+    `metadata_batch`; backends hand it their row instead of inserting it.
+
+    Rows may carry their payload (database backend): once `max_pending_bytes`
+    of it is pending, the backend flushes early, so a batch holds a bounded
+    amount of payload whatever its size. Ids whose insert failed end up in
+    `failed`.
+    """
+
+    def __init__(self, max_pending_bytes: Optional[int] = None):
+        self.max_pending_bytes = max_pending_bytes
+        self.failed: set[str] = set()
+        self._rows: dict[str, BlobMetadata] = {}
+        self._pending_bytes = 0
+
+    def add(self, blob_metadata: BlobMetadata, payload_size: int = 0) -> None:
+        self._rows[str(blob_metadata.id)] = blob_metadata
+        self._pending_bytes += payload_size
+
+    @property
+    def full(self) -> bool:
+        return self.max_pending_bytes is not None and self._pending_bytes >= self.max_pending_bytes
+
+    def get(self, blob_id: str) -> Optional[BlobMetadata]:
+        return self._rows.get(str(blob_id))
+
+    def __contains__(self, blob_id: str) -> bool:
+        return str(blob_id) in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def flush(self, db: Optional[AsyncSession] = None) -> bool:
+        """Insert every pending row (in one statement per few thousand); False on failure."""
+        rows = list(self._rows.values())
+        if not rows:
+            return True
+        # rows added while this insert runs are left to the next flush
+        self._rows = {}
+        self._pending_bytes = 0
+        async with use_session(db) as session:
+            if not await create_blob_metadata_many(db=session, blobs=rows):
+                self.failed.update(str(blob_metadata.id) for blob_metadata in rows)
+                return False
+
+        for blob_metadata in rows:
+            locator.remember(str(blob_metadata.id), BlobLocation.from_metadata(blob_metadata))
+        return True
+
+
+class BlobLocator:
+    """
+    Index of blob id -> storage key, so retrieves are one primary key lookup
+    instead of a scan of the storage backend.
+
+    Recent locations are kept in a small LRU cache and served without
+    touching the database. The cache is per worker: a blob deleted by
+    another worker is only forgotten here once its entry is `ttl` seconds
+    old. Packed blobs keep their storage key when compaction moves them.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache: OrderedDict[str, tuple[BlobLocation, float]] = OrderedDict()  # -> expiry
+
+    def remember(self, blob_id: str, location: BlobLocation) -> None:
+        self._cache[blob_id] = (location, time.monotonic() + self.ttl)
+        self._cache.move_to_end(blob_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def forget(self, blob_id: str) -> None:
+        self._cache.pop(blob_id, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    async def record(
+        self,
+        blob_id: str,
+        backend: StorageBackend,
+        storage_path: str,
+        size: int,
+        name: Optional[str] = None,
+        path: Optional[str] = None,
+        content_encoding: ContentEncoding = ContentEncoding.IDENTITY,
+        db: Optional[AsyncSession] = None,
+        batch: Optional[MetadataBatch] = None,
+        shared_content: bool = False,
+    ) -> Optional[BlobLocation]:
+        """
+        Store the location of a freshly written blob, None on failure.
+        With a `batch`, the row is left to it and only indexed once flushed.
+        """
+        location = BlobLocation(
+            backend=backend,
+            storage_path=storage_path,
+            size=size,
+            created_at=datetime.now(timezone.utc),
+            name=name,
+            path=path,
+            content_encoding=content_encoding,
+            shared_content=shared_content,
+        )
+
+        blob_metadata = BlobMetadata(
+            id=blob_id,
+            size=location.size,
+            created_at=location.created_at,
+            storage_backend=location.backend,
+            storage_path=location.storage_path,
+            name=location.name,
+            path=location.path,
+            content_encoding=location.content_encoding,
+            shared_content=location.shared_content,
+        )
+        if batch is not None:
+            batch.add(blob_metadata)
+            return location
+
+        async with use_session(db) as session:
+            blob_metadata = await create_blob_metadata(db=session, blob_metadata=blob_metadata)
+
+        if not blob_metadata:
+            logger.warning(f"Failed to index location of blob_id: {blob_id}")
+            return None
+
+        self.remember(blob_id, location)
+        return location
+
+    async def mark_compressed(
+        self,
+        blob_id: str,
+        content_encoding: ContentEncoding,
+        uncompressed_size: int,
+        db: Optional[AsyncSession] = None,
+        batch: Optional[MetadataBatch] = None,
+    ) -> bool:
+        """Record that a blob was just stored compressed; False on failure."""
+        pending = batch.get(blob_id) if batch is not None else None
+        if pending is not None:
+            pending.content_encoding = content_encoding
+            pending.uncompressed_size = uncompressed_size
+            return True
+
+        async with use_session(db) as session:
+            updated = await update_blob_encoding(
+                db=session,
+                blob_id=blob_id,
+                content_encoding=content_encoding,
+                uncompressed_size=uncompressed_size,
+            )
+
+        location = self._cached(blob_id)
+        if not updated:
+            self.forget(blob_id)
+        elif location is not None:
+            self.remember(
+                blob_id,
+                replace(location, content_encoding=content_encoding, uncompressed_size=uncompressed_size),
+            )
+        return updated
+
+    async def discard(
+        self, blob_id: str, db: Optional[AsyncSession] = None, shared_content: bool = False
+    ) -> bool:
+        """Remove a blob from the index; False if it had no row."""
+        self.forget(blob_id)
+        async with use_session(db) as session:
+            return await delete_blob_metadata(
+                db=session, blob_id=blob_id, shared_content=shared_content
+            )
+
+    def _cached(self, blob_id: str) -> Optional[BlobLocation]:
+        entry = self._cache.get(blob_id)
+        if entry is None:
+            return None
+        location, expires_at = entry
+        if expires_at <= time.monotonic():
+            # maybe deleted by another worker since: read the row again
+            del self._cache[blob_id]
+            return None
+        self._cache.move_to_end(blob_id)
+        return location
+
+    async def _get(self, blob_id: str, db: Optional[AsyncSession]) -> Optional[BlobLocation]:
+        location = self._cached(blob_id)
+        if location is not None:
+            return location
+
+        async with use_session(db) as session:
+            blob_metadata = await get_blob_metadata(db=session, blob_id=blob_id)
+
+        if not blob_metadata:
+            return None
+
+        location = BlobLocation.from_metadata(blob_metadata)
+        if not (location.storage_path or location.deduplicated):
+            return None
+        self.remember(blob_id, location)
+        return location
+
+    async def lookup(
+        self,
+        blob_id: str,
+        backend: StorageBackend,
+        db: Optional[AsyncSession] = None,
+        shared_content: bool = False,
+    ) -> Optional[BlobLocation]:
+        """
+        Location of a blob kept by `backend`, None if it is not indexed.
+        Shared content objects are only found with `shared_content`, and
+        only them.
+        """
+        location = await self._get(blob_id, db)
+
+        # deduplicated blobs are not stored under their own id
+        if location is None or location.backend != backend or location.deduplicated:
+            return None
+        if location.shared_content != shared_content:
+            return None
+
+        return location
+
+    async def indexed(self, blob_id: str, db: Optional[AsyncSession] = None) -> bool:
+        """
+        Whether a blob has a usable row, whatever it is stored as. Objects
+        found by scanning a backend are only served when it has none.
+        """
+        return await self._get(blob_id, db) is not None
+
+    async def lookup_reference(
+        self,
+        blob_id: str,
+        backend: StorageBackend,
+        db: Optional[AsyncSession] = None,
+    ) -> Optional[BlobLocation]:
+        """Row of a deduplicated (or chunked) blob of `backend`, None for any other blob."""
+        location = await self._get(blob_id, db)
+
+        if location is None or location.backend != backend or not location.deduplicated:
+            return None
+
+        return location
+
+
+locator = BlobLocator(settings.LOCATOR_CACHE_SIZE, settings.LOCATOR_CACHE_TTL)
@@ -0,0 +1,146 @@
+"""
+Offline migration of a LocalStorage root from the flat layout
+(`<timestamp>__<blob_id>.bin` files side by side) to the sharded layout.
+
+    python -m app.storage.migrate_local_layout [--dry-run] [--batch-size N]
+
+Run it with the service stopped. Files are renamed in place (same file
+system, so nothing is copied) and their blob_metadata rows are pointed at
+the new path; blobs that predate the metadata index get a row. A batch
+whose commit fails is moved back, so the store is never left pointing at
+missing files.
+"""
+import argparse
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from app.blob_crud import get_blob_metadata
+from app.blob_models import BlobMetadata
+from app.core.config import ContentEncoding, StorageBackend, settings
+from app.core.database import AsyncSession, async_session
+from app.core.logger import setup_logger
+from app.storage.local_storage import sharded_path
+from app.storage.streaming import b64_decoded_size
+
+logger = setup_logger(__name__)
+
+
+def _parse_flat_name(file_path: Path) -> tuple[str, datetime] | None:
+    """Blob id and creation time of `<timestamp>__<id>.bin` (or `<id>.bin`)."""
+    ts, sep, blob_id = file_path.stem.rpartition("__")
+    try:
+        uuid.UUID(blob_id)
+        if sep:
+            created_at = datetime.strptime(ts, "%Y%m%dT%H%M%S%fZ")
+            return blob_id, created_at.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+    return blob_id, datetime.fromtimestamp(file_path.stat().st_mtime, timezone.utc)
+
+
+def _base64_size(file_path: Path) -> int:
+    encoded_size = file_path.stat().st_size
+    with open(file_path, "rb") as f:
+        f.seek(max(encoded_size - 2, 0))
+        return b64_decoded_size(encoded_size, f.read())
+
+
+async def _index(
+    db: AsyncSession, root: Path, blob_id: str, created_at: datetime, target: Path
+) -> None:
+    storage_path = target.relative_to(root).as_posix()
+    blob_metadata = await get_blob_metadata(db=db, blob_id=blob_id)
+
+    if blob_metadata:
+        blob_metadata.storage_path = storage_path
+        return
+
+    # unindexed flat files predate the binary format: Base64 at rest
+    db.add(
+        BlobMetadata(
+            id=blob_id,
+            size=_base64_size(target),
+            created_at=created_at,
+            storage_backend=StorageBackend.LOCAL,
+            storage_path=storage_path,
+            content_encoding=ContentEncoding.BASE64,
+        )
+    )
+
+
+async def migrate(
+    root: Path, db: AsyncSession, dry_run: bool = False, batch_size: int = 500
+) -> int:
+    """Move every flat-layout blob under `root` into its shard; returns how many."""
+    moved = 0
+    batch: list[tuple[Path, Path]] = []
+
+    async def commit_batch() -> None:
+        nonlocal moved
+        try:
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for source, target in reversed(batch):
+                os.replace(target, source)
+            raise
+        moved += len(batch)
+        logger.info(f"Migrated {moved} blobs")
+        batch.clear()
+
+    for file_path in sorted(root.glob("*.bin")):
+        parsed = _parse_flat_name(file_path)
+        if not parsed:
+            logger.warning(f"Skipping {file_path.name}: not a blob file name")
+            continue
+
+        blob_id, created_at = parsed
+        target = sharded_path(root, blob_id)
+        if target.exists():
+            logger.warning(f"Skipping {file_path.name}: {target} already exists")
+            continue
+
+        if dry_run:
+            logger.info(f"Would move {file_path.name} -> {target.relative_to(root)}")
+            moved += 1
+            continue
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(file_path, target)
+        batch.append((file_path, target))
+
+        try:
+            await _index(db, root, blob_id, created_at, target)
+        except Exception:
+            await db.rollback()
+            for source, moved_target in reversed(batch):
+                os.replace(moved_target, source)
+            raise
+
+        if len(batch) >= batch_size:
+            await commit_batch()
+
+    if batch:
+        await commit_batch()
+
+    return moved
+
+
+async def _main(dry_run: bool, batch_size: int) -> None:
+    root = Path(settings.LOCAL_STORAGE_PATH)
+    async with async_session() as db:
+        moved = await migrate(root, db, dry_run=dry_run, batch_size=batch_size)
+    logger.info(f"{'Would move' if dry_run else 'Moved'} {moved} blobs under {root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only report what would move")
+    parser.add_argument("--batch-size", type=int, default=500, help="blobs per commit")
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.dry_run, args.batch_size))
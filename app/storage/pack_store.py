@@ -0,0 +1,365 @@
+import fcntl
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from app.core.logger import setup_logger
+from app.storage.group_commit import fsync_dir
+
+logger = setup_logger(__name__)
+
+# storage_path of a packed blob: its position lives in the pack index, so
+# compaction can move it without touching blob_metadata
+PACK_PREFIX = "pack:"
+
+# record header in a segment: blob id length, payload length
+_HEADER = struct.Struct(">HI")
+
+
+@dataclass(frozen=True)
+class PackEntry:
+    """Position of a packed blob's payload"""
+    segment: int
+    offset: int     # of the payload (past the record header) in the segment
+    length: int
+
+    def record_size(self, blob_id: str) -> int:
+        return _HEADER.size + len(blob_id.encode()) + self.length
+
+
+class PackStore:
+    """
+    Small blobs appended to rolling segment files instead of one file each.
+
+    `<directory>/<n>.pack` segments hold self-describing records (header,
+    blob id, payload); a segment is sealed once it reaches `segment_size`.
+    `index.log` maps blob id -> (segment, offset, length): an append-only log
+    of `put` and `del` lines replayed on open, the last line for an id wins.
+    Payloads are written before their index line, so a crash can only lose
+    the index line of a blob that was never acknowledged.
+
+    Every worker of the host opens its own store over the same directory.
+    Appends, deletes and compaction hold an flock on `.lock`, and each
+    store catches up on the index lines the others appended (or reloads the
+    index once a compaction rewrote it) before it uses its copy, so offsets
+    always come from the segment's real end and blobs packed by one worker
+    are found by all of them.
+
+    Reads are one pread on a cached descriptor; a descriptor keeps serving a
+    segment another worker compacted until this one drops it. Deleted
+    payloads stay in their segment until compact() copies the live records
+    of mostly dead sealed segments forward and drops them. Thread safe;
+    every method blocks and is meant for the local I/O threads.
+    """
+
+    def __init__(self, directory: Path, segment_size: int):
+        self.directory = directory
+        self.segment_size = segment_size
+
+        self._lock = threading.Lock()
+        self._entries: dict[str, PackEntry] = {}
+        self._live: dict[int, int] = {}      # segment -> bytes of live records
+        self._readers: dict[int, int] = {}   # segment -> read-only descriptor
+        # descriptors of compacted segments, closed at the next compaction
+        # so reads that already looked them up can finish
+        self._retired: list[int] = []
+
+        directory.mkdir(parents=True, exist_ok=True)
+        # shared by the stores of every worker: see _exclusive()
+        self._flock_fd = os.open(directory / ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+        self._index_path = directory / "index.log"
+        self._index_inode: Optional[int] = None
+        self._index_pos = 0     # end of the last index line applied
+        self._index = None
+
+        with self._exclusive():
+            self._catch_up()
+            self._active = max(self._segments(), default=1)
+            self._writer = open(self._segment_path(self._active), "ab")
+
+    # ---------- blobs ----------
+
+    def put(self, blob_id: str, data: bytes) -> PackEntry:
+        """Append a blob to the active segment and index it."""
+        with self._exclusive():
+            self._catch_up()
+            return self._append(blob_id, data)
+
+    def lookup(self, blob_id: str) -> Optional[PackEntry]:
+        with self._lock:
+            self._catch_up()
+            return self._entries.get(blob_id)
+
+    def read(self, blob_id: str, start: int = 0, stop: Optional[int] = None) -> Optional[bytes]:
+        """Payload bytes [start, stop) of a packed blob, None if it is not packed."""
+        with self._lock:
+            self._catch_up()
+            entry = self._entries.get(blob_id)
+            if entry is None:
+                return None
+            try:
+                fd = self._reader(entry.segment)
+            except FileNotFoundError:
+                # compacted by another worker: its index lines say where to
+                self._catch_up()
+                entry = self._entries.get(blob_id)
+                if entry is None:
+                    return None
+                fd = self._reader(entry.segment)
+
+        stop = entry.length if stop is None else min(stop, entry.length)
+        return os.pread(fd, max(stop - start, 0), entry.offset + start)
+
+    def delete(self, blob_id: str) -> bool:
+        """Drop a blob from the index; its bytes are reclaimed by compact()."""
+        with self._exclusive():
+            self._catch_up()
+            if blob_id not in self._entries:
+                return False
+            self._set(blob_id, None)
+            self._log(f"del {blob_id}")
+            return True
+
+    def sync(self) -> None:
+        """fsync the active segment and the index: every put so far is durable."""
+        with self._lock:
+            os.fsync(self._writer.fileno())
+            os.fsync(self._index.fileno())
+
+    # ---------- maintenance ----------
+
+    def compact(self, garbage_ratio: float) -> int:
+        """
+        Rewrite sealed segments whose dead bytes reach `garbage_ratio` of
+        their size: live records are appended to the active segment, then
+        the segment is removed. Returns the number of bytes reclaimed.
+        """
+        # the other workers wait for it: compaction is what moves records
+        with self._exclusive():
+            for fd in self._retired:
+                os.close(fd)
+            self._retired.clear()
+            self._catch_up()
+
+            segments = self._segments()
+            candidates = []
+            for segment in segments:
+                # the newest segment is where every worker appends
+                if segment == segments[-1]:
+                    continue
+                size = self._segment_path(segment).stat().st_size
+                if size and (size - self._live.get(segment, 0)) / size >= garbage_ratio:
+                    candidates.append((segment, size))
+
+            if candidates and self._active != segments[-1]:
+                # copies must not land in a segment about to be dropped
+                self._roll()
+
+            reclaimed = 0
+            for segment, size in candidates:
+                live = [(b, e) for b, e in self._entries.items() if e.segment == segment]
+                fd = self._reader(segment)
+                for blob_id, entry in live:
+                    self._append(blob_id, os.pread(fd, entry.length, entry.offset))
+
+                reclaimed += size - sum(e.record_size(b) for b, e in live)
+                logger.info(f"Compacted pack segment {segment}: {len(live)} live blobs moved")
+
+            if not candidates:
+                return reclaimed
+
+            # the copies and an index pointing at them (both fsynced) must be
+            # on disk before the originals go
+            self._rewrite_index()
+            for segment, _size in candidates:
+                self._retired.append(self._readers.pop(segment))
+                self._live.pop(segment, None)
+                self._segment_path(segment).unlink()
+            fsync_dir(self.directory)
+            return reclaimed
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._catch_up()
+            segments = self._segments()
+            total = sum(self._segment_path(s).stat().st_size for s in segments)
+            live = sum(self._live.values())
+            return {
+                "segments": len(segments),
+                "blobs": len(self._entries),
+                "live_bytes": live,
+                "total_bytes": total,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+            self._index.close()
+            os.close(self._flock_fd)
+            for fd in [*self._readers.values(), *self._retired]:
+                os.close(fd)
+            self._readers.clear()
+            self._retired.clear()
+
+    # ---------- helpers ----------
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """This store's lock plus the flock every worker's store takes."""
+        with self._lock:
+            fcntl.flock(self._flock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._flock_fd, fcntl.LOCK_UN)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:06d}.pack"
+
+    def _segments(self) -> list[int]:
+        return sorted(int(p.stem) for p in self.directory.glob("*.pack"))
+
+    def _reader(self, segment: int) -> int:
+        fd = self._readers.get(segment)
+        if fd is None:
+            fd = self._readers[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def _append(self, blob_id: str, data: bytes) -> PackEntry:
+        """Under _exclusive(), so the segment's end is where this record goes."""
+        key = blob_id.encode()
+        stat = os.fstat(self._writer.fileno())
+        # full, or already compacted away by another worker
+        if stat.st_size >= self.segment_size or stat.st_nlink == 0:
+            self._roll()
+            stat = os.fstat(self._writer.fileno())
+
+        offset = stat.st_size + _HEADER.size + len(key)
+        self._writer.write(_HEADER.pack(len(key), len(data)))
+        self._writer.write(key)
+        self._writer.write(data)
+        self._writer.flush()
+
+        entry = PackEntry(self._active, offset, len(data))
+        self._set(blob_id, entry)
+        self._log(f"put {blob_id} {entry.segment} {entry.offset} {entry.length}")
+        return entry
+
+    def _roll(self) -> None:
+        # sync() only covers the active segment
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+
+        # another worker may have rolled already: join its segment if it has room
+        self._active = max(self._segments(), default=self._active)
+        segment_path = self._segment_path(self._active)
+        if not segment_path.exists() or segment_path.stat().st_size < self.segment_size:
+            self._writer = open(segment_path, "ab")
+            return
+
+        self._active += 1
+        self._writer = open(self._segment_path(self._active), "ab")
+        # the new segment's directory entry must survive a crash too
+        fsync_dir(self.directory)
+
+    def _set(self, blob_id: str, entry: Optional[PackEntry]) -> None:
+        old = self._entries.pop(blob_id, None)
+        if old is not None:
+            self._live[old.segment] -= old.record_size(blob_id)
+        if entry is not None:
+            self._entries[blob_id] = entry
+            self._live[entry.segment] = self._live.get(entry.segment, 0) + entry.record_size(blob_id)
+
+    def _log(self, line: str) -> None:
+        """Under _exclusive(), after _catch_up()."""
+        # bytes past the last whole line: a worker died writing them
+        if os.fstat(self._index.fileno()).st_size != self._index_pos:
+            os.ftruncate(self._index.fileno(), self._index_pos)
+        record = (line + "\n").encode("ascii")
+        self._index.write(record)
+        self._index.flush()
+        self._index_pos += len(record)
+
+    def _catch_up(self) -> None:
+        """Apply the index lines other workers appended since the last call."""
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or (stat.st_ino == self._index_inode and stat.st_size == self._index_pos):
+            if self._index is None:
+                self._reopen_index()
+            return
+
+        with open(self._index_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._index_inode:
+                # new, or rewritten by a compaction: replay it whole
+                self._entries.clear()
+                self._live.clear()
+                self._index_inode = stat.st_ino
+                self._index_pos = 0
+                self._reopen_index()
+
+            f.seek(self._index_pos)
+            for line in f:
+                # a torn last line is a put being written, or never acknowledged
+                if not line.endswith(b"\n"):
+                    break
+                self._index_pos += len(line)
+                op, blob_id, *position = line.decode("ascii").split()
+                if op == "put":
+                    self._set(blob_id, PackEntry(*map(int, position)))
+                else:
+                    self._set(blob_id, None)
+
+        # segments emptied by another worker's compaction
+        for segment in [s for s in self._readers if not self._live.get(s)]:
+            self._retired.append(self._readers.pop(segment))
+
+    def _reopen_index(self) -> None:
+        if self._index is not None:
+            self._index.close()
+        self._index = open(self._index_path, "ab")
+        self._index_inode = os.fstat(self._index.fileno()).st_ino
+
+    def _rewrite_index(self) -> None:
+        """Replace the index log with one `put` line per live blob; under _exclusive()."""
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="ascii") as f:
+            for blob_id, e in self._entries.items():
+                f.write(f"put {blob_id} {e.segment} {e.offset} {e.length}\n")
+            f.flush()
+            os.fsync(f.fileno())
+            size = os.fstat(f.fileno()).st_size
+
+        # segments hold the payloads the new index points at
+        os.fsync(self._writer.fileno())
+        os.replace(tmp_path, self._index_path)
+        fsync_dir(self.directory)
+        self._reopen_index()
+        self._index_pos = size
+
+
+_stores: dict[Path, PackStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_pack_store(directory: Path, segment_size: int) -> PackStore:
+    """The process-wide PackStore of `directory`, opened on first use."""
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = PackStore(directory, segment_size)
+        return store
+
+
+def close_pack_stores() -> None:
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
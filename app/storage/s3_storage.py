@@ -1,15 +1,54 @@
 from datetime import datetime, timezone
+from collections import deque
+from typing import AsyncIterator
+import asyncio
+import base64
+import hashlib
+import tempfile
 import xml.etree.ElementTree as ET
 
-from app.storage.base import StorageBackendInterface
-from app.core.config import StorageBackend
-from app.blob_schemas import BlobResponse ,  BlobCreate
-from app.s3_client import s3_request
+from app.storage.base import (
+    StorageBackendInterface,
+    BlobStream,
+    RangeNotSatisfiable,
+    StoredBlob,
+    resolve_range,
+)
+from app.core.config import PayloadSigning, StorageBackend
+from app.blob_schemas import BlobCreate
+from app import s3_client
+from app.storage.locator import BlobLocation, locator
+from app.storage.streaming import (
+    PayloadMeter,
+    b64_decoded_size,
+    decode_stored,
+    rechunk,
+    stored_span,
+)
+from app.core.config import settings
 from app.core.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
+class S3TransferError(Exception):
+    """An S3 request kept failing after its retries"""
+
+
+def _streamed_payload_hash() -> str:
+    """Payload hash sent for bodies that are not hashed up front"""
+    if settings.S3_PAYLOAD_SIGNING == PayloadSigning.STREAMING:
+        return s3_client.STREAMING_PAYLOAD
+    return s3_client.UNSIGNED_PAYLOAD
+
+
+def _buffered_payload_hash() -> str | None:
+    """Payload hash for bodies held in memory, None lets s3_request hash them"""
+    if settings.S3_PAYLOAD_SIGNING == PayloadSigning.SIGNED:
+        return None
+    return _streamed_payload_hash()
+
+
 class S3Storage(StorageBackendInterface):
 
     PREFIX = ""
@@ -26,86 +65,455 @@ class S3Storage(StorageBackendInterface):
         )
 
     # ✅ LIST FILES
-    def _list_objects(self) -> list[str]:
+    async def _list_objects(self) -> AsyncIterator[str]:
         params = {"list-type": "2", "prefix": self.PREFIX}
-        resp = s3_request("GET", params=params)
 
-        if resp.status_code != 200:
-            return []
+        while True:
+            resp = await s3_client.s3_request("GET", params=params)
+
+            if resp.status_code != 200:
+                return
 
-        root = ET.fromstring(resp.content)
-        keys = []
+            root = ET.fromstring(resp.content)
 
-        for contents in root.findall(".//{*}Contents"):
-            key = contents.find("{*}Key").text
-            keys.append(key)
+            for contents in root.findall(".//{*}Contents"):
+                yield contents.find("{*}Key").text
 
-        return keys
+            # ListObjectsV2 returns at most 1000 keys per page
+            token = root.findtext("{*}NextContinuationToken")
+            if root.findtext("{*}IsTruncated") != "true" or not token:
+                return
+            params = {**params, "continuation-token": token}
 
     # ✅ FIND REAL OBJECT KEY
-    def _find_key(self, blob_id: str) -> str | None:
+    async def _find_key(self, blob_id: str) -> str | None:
         safe_id = blob_id.replace("/", "_")
         suffix = f"__{safe_id}.bin"
 
-        for key in self._list_objects():
+        async for key in self._list_objects():
             if key.endswith(suffix):
                 return key
 
         return None
 
-    async def save(
+    async def _stored_size(self, storage_path: str) -> int | None:
+        # The last bytes carry the Base64 padding of legacy objects,
+        # Content-Range the stored size: together they give the exact raw size.
+        tail_resp = await s3_client.s3_request("GET", storage_path, headers={"Range": "bytes=-2"})
+        if tail_resp.status_code == 416:
+            # nothing to satisfy the range: the object is empty
+            return 0
+        if tail_resp.status_code not in (200, 206):
+            return None
+
+        tail = tail_resp.content
+        content_range = tail_resp.headers.get("Content-Range")
+        if content_range:
+            encoded_size = int(content_range.rsplit("/", 1)[1])
+        else:
+            encoded_size = len(tail)
+
+        if not settings.LEGACY_BASE64_READS:
+            return encoded_size
+        return b64_decoded_size(encoded_size, tail)
+
+    async def _locate(self, blob_id: str, **kwargs) -> BlobLocation | None:
+        location = await locator.lookup(
+            blob_id,
+            StorageBackend.S3,
+            db=kwargs.get("db"),
+            shared_content=kwargs.get("shared_content", False),
+        )
+        if location:
+            return location
+
+        # blobs written before the locator index existed: list the bucket once
+        if not settings.LEGACY_LOCATION_SCANS:
+            return None
+        storage_path = await self._find_key(blob_id)
+        if not storage_path:
+            return None
+
+        # indexed as something else, e.g. shared content: not this blob
+        if await locator.indexed(blob_id, db=kwargs.get("db")):
+            return None
+
+        size = await self._stored_size(storage_path)
+        if size is None:
+            return None
+
+        location = BlobLocation(
+            backend=StorageBackend.S3,
+            storage_path=storage_path,
+            size=size,
+            created_at=self._extract_created_at(storage_path),
+        )
+        locator.remember(blob_id, location)
+        return location
+
+    async def _put_object(
+        self, object_key: str, chunks: AsyncIterator[bytes], size: int | None = None
+    ):
+        signing = settings.S3_PAYLOAD_SIGNING
+        unsigned_hash = _streamed_payload_hash()
+
+        if size is not None and signing != PayloadSigning.SIGNED:
+            # length known up front: stream straight from the upload
+            return await s3_client.s3_request(
+                "PUT", object_key, chunks, payload_hash=unsigned_hash, content_length=size
+            )
+
+        # A PUT needs its length (and a signed payload its hash) up front, so
+        # spool the upload to disk instead of holding it in memory.
+        digest = hashlib.sha256()
+        with tempfile.TemporaryFile() as spool:
+            async for chunk in chunks:
+                if signing == PayloadSigning.SIGNED:
+                    digest.update(chunk)
+                spool.write(chunk)
+            spool.seek(0)
+
+            payload_hash = (
+                digest.hexdigest() if signing == PayloadSigning.SIGNED else unsigned_hash
+            )
+            return await s3_client.s3_request("PUT", object_key, spool, payload_hash=payload_hash)
+
+    async def _request_with_retries(
+        self, description: str, expected_status: int, *args, **kwargs
+    ):
+        """s3_request() retried with exponential backoff until it answers `expected_status`."""
+        for attempt in range(settings.S3_MAX_RETRIES + 1):
+            try:
+                resp = await s3_client.s3_request(*args, **kwargs)
+                if resp.status_code == expected_status:
+                    return resp
+                error = f"status {resp.status_code}"
+            except Exception as e:
+                error = e
+
+            logger.warning(f"{description} failed (attempt {attempt + 1}): {error}")
+            if attempt < settings.S3_MAX_RETRIES:
+                await asyncio.sleep(settings.S3_RETRY_BACKOFF * 2 ** attempt)
+
+        raise S3TransferError(f"{description} failed: {error}")
+
+    async def _upload_part(
+        self, object_key: str, upload_id: str, part_number: int, part: bytes
+    ) -> str:
+        """Upload one part, retrying on its own, and return its ETag."""
+        resp = await self._request_with_retries(
+            f"S3 part {part_number} of {object_key}",
+            200,
+            "PUT",
+            object_key,
+            part,
+            params={"partNumber": str(part_number), "uploadId": upload_id},
+            payload_hash=_buffered_payload_hash(),
+        )
+        return resp.headers["ETag"]
+
+    async def _multipart_upload(
+        self, object_key: str, parts: AsyncIterator[bytes]
+    ) -> bool:
+        resp = await s3_client.s3_request("POST", object_key, params={"uploads": ""})
+        if resp.status_code != 200:
+            return False
+        upload_id = ET.fromstring(resp.content).findtext("{*}UploadId")
+
+        # at most S3_MULTIPART_CONCURRENCY parts are read and in flight at once
+        slots = asyncio.Semaphore(settings.S3_MULTIPART_CONCURRENCY)
+        tasks: list[asyncio.Task] = []
+
+        try:
+            async for part in parts:
+                await slots.acquire()
+                for task in tasks:
+                    # a part that ran out of retries fails the whole upload
+                    if task.done() and task.exception():
+                        raise task.exception()
+
+                task = asyncio.create_task(
+                    self._upload_part(object_key, upload_id, len(tasks) + 1, part)
+                )
+                task.add_done_callback(lambda _: slots.release())
+                tasks.append(task)
+
+            etags = await asyncio.gather(*tasks)
+
+            body = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, start=1)
+            )
+            resp = await s3_client.s3_request(
+                "POST",
+                object_key,
+                f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode(),
+                params={"uploadId": upload_id},
+            )
+            # CompleteMultipartUpload can fail with a 200 and an <Error> body
+            if resp.status_code != 200 or b"<Error>" in resp.content:
+                raise S3TransferError(f"Completing upload of {object_key} failed")
+
+            return True
+
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # don't leave billed, invisible parts behind
+            try:
+                await s3_client.s3_request("DELETE", object_key, params={"uploadId": upload_id})
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload of {object_key}: {e}")
+            raise
+
+    async def _upload(
+        self, object_key: str, chunks: AsyncIterator[bytes], size: int | None = None
+    ) -> bool:
+        """Store an object with one PUT, or as a parallel multipart upload when large."""
+        if size is not None and size < settings.S3_MULTIPART_THRESHOLD:
+            resp = await self._put_object(object_key, chunks, size)
+            return resp.status_code in (200, 201)
+
+        parts = rechunk(chunks, settings.S3_MULTIPART_PART_SIZE)
+        first = await anext(parts, b"")
+        second = await anext(parts, None)
+
+        if second is None:
+            # unknown size but fits in one part: no multipart round trips
+            resp = await s3_client.s3_request(
+                "PUT", object_key, first, payload_hash=_buffered_payload_hash()
+            )
+            return resp.status_code in (200, 201)
+
+        async def all_parts():
+            yield first
+            yield second
+            async for part in parts:
+                yield part
+
+        return await self._multipart_upload(object_key, all_parts())
+
+    async def save_stream(
         self,
         blob_id: str,
-        data: bytes,
+        chunks: AsyncIterator[bytes],
         filename: str,
         path: str,
         **kwargs,
     ) -> BlobCreate | None:
         try:
-
             object_key = self._object_key(blob_id)
-            resp = s3_request("PUT", object_key, data)
+            meter = PayloadMeter()
 
-            if resp.status_code not in (200, 201):
+            stored = await self._upload(
+                object_key, meter.track(chunks), size=kwargs.get("size")
+            )
+
+            if not stored:
                 logger.warning("Failed to save blob to S3")
                 return None
 
-            logger.info(f"Blob saved successfully blob_id {blob_id}")
-            return BlobCreate(
-                id=blob_id,
-                data=data
+            location = await locator.record(
+                blob_id,
+                StorageBackend.S3,
+                storage_path=object_key,
+                size=meter.size,
+                name=filename,
+                path=path,
+                db=kwargs.get("db"),
+                batch=kwargs.get("metadata_batch"),
+                shared_content=kwargs.get("shared_content", False),
             )
-        
-        except  Exception as e:
+            if not location:
+                await s3_client.s3_request("DELETE", object_key)
+                return None
+
+            logger.info(f"Blob saved successfully blob_id {blob_id}")
+            return BlobCreate(id=blob_id)
+
+        except Exception as e:
             logger.error(f"Exception error {e}")
-            return  None
+            return None
 
-    async def retrieve(self, blob_id: str, **kwargs) -> BlobResponse | None:
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
 
         try:
-            storage_path = self._find_key(blob_id)
-            if not storage_path:
+            location = await self._locate(blob_id, **kwargs)
+            if not location:
                 return None
 
-            resp = s3_request("GET", storage_path)
-            if resp.status_code != 200:
-                return None
+            stop = 0
+            if location.size:
+                _start, stop, _skip = stored_span(0, location.size - 1, location.base64_at_rest)
 
-            data = resp.content
+            if stop >= settings.S3_PARALLEL_GET_THRESHOLD:
+                data = bytearray()
+                async for part in self._parallel_get(location.storage_path, 0, stop):
+                    data += part
+            else:
+                resp = await s3_client.s3_request("GET", location.storage_path)
+                if resp.status_code != 200:
+                    return None
+                data = resp.content
 
-            return BlobResponse(
+            if location.base64_at_rest:
+                data = base64.b64decode(data)
+
+            return StoredBlob(
                 id=blob_id,
                 data=data,
-                size=len(data),
-                created_at=self._extract_created_at(storage_path),
-                # name="unknown", # Optional
-                # path=storage_path, # Optional
-                # storage_backend=StorageBackend.S3,
-                # storage_path=storage_path,
+                size=location.size,
+                created_at=location.created_at,
+                name=location.name,
+                path=location.path,
+                storage_backend=StorageBackend.S3,
+                storage_path=location.storage_path,
+            )
+        except Exception as e:
+            logger.error(f"Expetion Error :{e}")
+            return None
+
+    async def _iter_body(self, resp) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in resp.aiter_bytes(chunk_size=settings.DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await resp.aclose()
+
+    async def _get_part(self, storage_path: str, start: int, stop: int) -> bytes:
+        resp = await self._request_with_retries(
+            f"S3 range {start}-{stop - 1} of {storage_path}",
+            206,
+            "GET",
+            storage_path,
+            headers={"Range": f"bytes={start}-{stop - 1}"},
+        )
+        return resp.content
+
+    async def _parallel_get(
+        self, storage_path: str, start: int, stop: int
+    ) -> AsyncIterator[bytes]:
+        """
+        Fetch stored bytes [start, stop) as concurrent ranged GETs, yielded in
+        order. At most S3_DOWNLOAD_CONCURRENCY parts are buffered at a time.
+        """
+        offsets = iter(range(start, stop, settings.S3_DOWNLOAD_PART_SIZE))
+        pending: deque[asyncio.Task] = deque()
+
+        def schedule_next() -> None:
+            offset = next(offsets, None)
+            if offset is not None:
+                part_stop = min(offset + settings.S3_DOWNLOAD_PART_SIZE, stop)
+                pending.append(
+                    asyncio.create_task(self._get_part(storage_path, offset, part_stop))
+                )
+
+        try:
+            for _ in range(settings.S3_DOWNLOAD_CONCURRENCY):
+                schedule_next()
+
+            while pending:
+                part = await pending.popleft()
+                schedule_next()
+                view = memoryview(part)
+                for i in range(0, len(view), settings.DOWNLOAD_CHUNK_SIZE):
+                    yield view[i:i + settings.DOWNLOAD_CHUNK_SIZE]
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _stream(
+        self,
+        blob_id: str,
+        byte_range: tuple[int, int | None] | None = None,
+        **kwargs,
+    ) -> BlobStream | None:
+
+        try:
+            location = await self._locate(blob_id, **kwargs)
+            if not location:
+                return None
+
+            storage_path = location.storage_path
+            size = location.size
+
+            if byte_range:
+                first, last = resolve_range(*byte_range, size)
+            else:
+                first, last = 0, size - 1
+
+            # only fetch the stored bytes holding the requested range
+            start, stop, skip = 0, 0, 0
+            if size:
+                start, stop, skip = stored_span(first, last, location.base64_at_rest)
+
+            if stop - start >= settings.S3_PARALLEL_GET_THRESHOLD:
+                # large spans: several connections instead of one TCP window
+                stored_chunks = self._parallel_get(storage_path, start, stop)
+            else:
+                if byte_range:
+                    resp = await s3_client.s3_request(
+                        "GET",
+                        storage_path,
+                        headers={"Range": f"bytes={start}-{stop - 1}"},
+                        stream=True,
+                    )
+                    expected_status = 206
+                else:
+                    resp = await s3_client.s3_request("GET", storage_path, stream=True)
+                    expected_status = 200
+
+                if resp.status_code != expected_status:
+                    await resp.aclose()
+                    return None
+                stored_chunks = self._iter_body(resp)
+
+            chunks = decode_stored(
+                stored_chunks, location.base64_at_rest, skip, last - first + 1
             )
+
+            return BlobStream(
+                id=blob_id,
+                size=size,
+                chunks=chunks,
+                created_at=location.created_at,
+                name=location.name,
+                start=first,
+                end=last,
+            )
+        except RangeNotSatisfiable:
+            raise
         except Exception as e:
             logger.error(f"Expetion Error :{e}")
             return None
 
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self._stream(blob_id, **kwargs)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        return await self._stream(blob_id, (start, end), **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        location = await self._locate(blob_id, **kwargs)
+        if not location:
+            return False
+
+        # the row goes first: a failure after it leaves garbage, not a
+        # row pointing at nothing
+        await locator.discard(
+            blob_id, db=kwargs.get("db"), shared_content=kwargs.get("shared_content", False)
+        )
+
+        resp = await s3_client.s3_request("DELETE", location.storage_path)
+        if resp.status_code not in (200, 204):
+            logger.warning(
+                f"Failed to delete S3 object {location.storage_path}: status {resp.status_code}"
+            )
+        return True
+
     def get_backend_type(self) -> StorageBackend:
         return StorageBackend.S3
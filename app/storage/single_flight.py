@@ -0,0 +1,123 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+from app.blob_schemas import BlobCreate
+from app.core.config import StorageBackend, settings
+from app.storage.base import BlobStream, StorageBackendInterface, StoredBlob
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0    # callers sharing the task beyond the one that started it
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one.
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight await the same result, or the same exception. Nothing is
+    kept once it completes, so the next call after that starts afresh. At
+    most `max_waiters` callers share a flight; the rest make their own call.
+    The call runs as a task of its own, so a caller that gives up does not
+    cancel it for the others.
+    """
+
+    def __init__(self, max_waiters: int):
+        self.max_waiters = max_waiters
+        self._flights: dict[Hashable, _Flight] = {}
+
+        # metrics
+        self._calls = 0
+        self._shared = 0
+        self._overflows = 0
+        self._errors = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is not None and flight.task.get_loop() is not loop:
+            # left behind by an event loop that is gone
+            flight = None
+
+        if flight is not None and not flight.task.done():
+            if flight.waiters < self.max_waiters:
+                flight.waiters += 1
+                self._shared += 1
+                return await asyncio.shield(flight.task)
+            self._overflows += 1
+            return await call()
+
+        self._calls += 1
+        task = asyncio.ensure_future(call())
+        self._flights[key] = _Flight(task)
+        task.add_done_callback(lambda done: self._land(key, done))
+        return await asyncio.shield(task)
+
+    def _land(self, key: Hashable, task: asyncio.Task) -> None:
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "calls_total": self._calls,
+            "shared_total": self._shared,
+            "overflows_total": self._overflows,
+            "errors_total": self._errors,
+        }
+
+
+class SingleFlightStorage(StorageBackendInterface):
+    """
+    Coalesces concurrent `retrieve` calls for the same blob.
+
+    A popular blob requested by many clients at once costs one backend
+    fetch whose StoredBlob every caller shares (read only). Streams cannot
+    be shared and are passed through, like writes.
+    """
+
+    def __init__(self, backend: StorageBackendInterface, flights: SingleFlight):
+        self.backend = backend
+        self.flights = flights
+
+    async def save_stream(
+        self,
+        blob_id: str,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        path: str,
+        **kwargs,
+    ) -> BlobCreate | None:
+        return await self.backend.save_stream(blob_id, chunks, filename, path, **kwargs)
+
+    async def delete(self, blob_id: str, **kwargs) -> bool:
+        return await self.backend.delete(blob_id, **kwargs)
+
+    async def retrieve(self, blob_id: str, **kwargs) -> StoredBlob | None:
+        if kwargs:
+            # a caller's own session must not serve other requests
+            return await self.backend.retrieve(blob_id, **kwargs)
+        return await self.flights.do(
+            (self.get_backend_type(), blob_id), lambda: self.backend.retrieve(blob_id)
+        )
+
+    async def retrieve_stream(self, blob_id: str, **kwargs) -> BlobStream | None:
+        return await self.backend.retrieve_stream(blob_id, **kwargs)
+
+    async def retrieve_range(
+        self, blob_id: str, start: int, end: int | None = None, **kwargs
+    ) -> BlobStream | None:
+        return await self.backend.retrieve_range(blob_id, start, end, **kwargs)
+
+    def get_backend_type(self) -> StorageBackend:
+        return self.backend.get_backend_type()
+
+
+blob_flights = SingleFlight(settings.SINGLE_FLIGHT_MAX_WAITERS)
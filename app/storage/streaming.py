@@ -0,0 +1,116 @@
+import base64
+from typing import AsyncIterator
+
+
+class PayloadMeter:
+    """Measures a stream of chunks as it is consumed"""
+
+    def __init__(self):
+        self.size = 0
+
+    async def track(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            self.size += len(chunk)
+            yield chunk
+
+
+async def b64decode_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Decode a stream of base64 chunks split at arbitrary boundaries.
+    """
+    remainder = b""
+
+    async for chunk in chunks:
+        if remainder:
+            chunk = remainder + chunk
+
+        # only whole 4-char groups can be decoded on their own
+        cut = len(chunk) - len(chunk) % 4
+        remainder = bytes(chunk[cut:])
+
+        if cut:
+            yield base64.b64decode(memoryview(chunk)[:cut], validate=True)
+
+    if remainder:
+        raise ValueError("Invalid base64 data")
+
+
+async def rechunk(chunks: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """
+    Regroup a stream into pieces of exactly `size` bytes (the last one may be
+    shorter).
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def b64_decoded_size(encoded_size: int, tail: bytes) -> int:
+    """
+    Raw size of a base64 document, given its length and its last bytes.
+    """
+    return encoded_size // 4 * 3 - tail[-2:].count(b"=")
+
+
+def b64_span(first: int, last: int) -> tuple[int, int, int]:
+    """
+    Base64 span holding raw bytes `first`..`last` (inclusive).
+
+    Returns the encoded [start, stop) offsets, aligned on 4-char groups, and
+    how many decoded bytes precede `first`.
+    """
+    return first // 3 * 4, (last // 3 + 1) * 4, first % 3
+
+
+def stored_span(first: int, last: int, base64_at_rest: bool) -> tuple[int, int, int]:
+    """
+    Stored [start, stop) offsets holding raw bytes `first`..`last` (inclusive)
+    and how many decoded bytes precede `first`.
+    """
+    if base64_at_rest:
+        return b64_span(first, last)
+    return first, last + 1, 0
+
+
+def decode_stored(
+    chunks: AsyncIterator[bytes], base64_at_rest: bool, skip: int, length: int
+) -> AsyncIterator[bytes]:
+    """
+    Raw bytes of a span read with stored_span(); raw objects pass through.
+    """
+    if not base64_at_rest:
+        return chunks
+    return slice_chunks(b64decode_chunks(chunks), skip, length)
+
+
+async def slice_chunks(
+    chunks: AsyncIterator[bytes], skip: int, length: int
+) -> AsyncIterator[bytes]:
+    """
+    Drop the first `skip` bytes of a stream, then yield exactly `length` bytes.
+
+    The source is closed as soon as the slice is complete.
+    """
+    try:
+        if length <= 0:
+            return
+        async for chunk in chunks:
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            if len(chunk) > length:
+                chunk = chunk[:length]
+            length -= len(chunk)
+            yield chunk
+            if not length:
+                break
+    finally:
+        await chunks.aclose()
@@ -0,0 +1,98 @@
+"""
+Dedup ratio and throughput of content-defined chunking on versioned data.
+
+    python -m benchmarks.chunk_dedup [--size BYTES] [--versions N] [--edits N]
+                                     [--min BYTES] [--avg BYTES] [--max BYTES]
+
+Builds a random file and a series of versions of it, each made from the
+previous one by a few small inserts, deletes and overwrites. Every version
+is split with the Chunker (as chunked uploads are) and with fixed-size
+blocks of the average chunk size for comparison. The dedup ratio is
+logical bytes over the bytes of distinct chunks. Throughput covers
+splitting and hashing, not the backend writes.
+"""
+import argparse
+import hashlib
+import os
+import random
+import time
+
+from app.core.config import settings
+from app.storage.chunking import Chunker
+
+
+def make_versions(size: int, versions: int, edits: int, seed: int) -> list[bytes]:
+    rng = random.Random(seed)
+    data = bytearray(os.urandom(size))
+    result = [bytes(data)]
+    for _ in range(versions - 1):
+        for _ in range(edits):
+            at = rng.randrange(len(data))
+            span = rng.randrange(1, 4096)
+            kind = rng.choice(("insert", "delete", "overwrite"))
+            if kind == "insert":
+                data[at:at] = os.urandom(span)
+            elif kind == "delete":
+                del data[at:at + span]
+            else:
+                data[at:at + span] = os.urandom(len(data[at:at + span]))
+        result.append(bytes(data))
+    return result
+
+
+def content_defined(chunker: Chunker, data: bytes):
+    offset = 0
+    while offset < len(data):
+        size = chunker.cut(data[offset:offset + chunker.max_size])
+        yield data[offset:offset + size]
+        offset += size
+
+
+def fixed_size(block: int, data: bytes):
+    for offset in range(0, len(data), block):
+        yield data[offset:offset + block]
+
+
+def measure(versions: list[bytes], split) -> tuple[float, float, int]:
+    """Dedup ratio, MB/s and chunk count of splitting + hashing every version."""
+    seen = {}
+    chunks = 0
+    started = time.perf_counter()
+    for data in versions:
+        for chunk in split(data):
+            seen[hashlib.sha256(chunk).digest()] = len(chunk)
+            chunks += 1
+    elapsed = time.perf_counter() - started
+
+    logical = sum(len(data) for data in versions)
+    return logical / sum(seen.values()), logical / elapsed / 1e6, chunks
+
+
+def main(args) -> None:
+    chunker = Chunker(args.min, args.avg, args.max)
+    versions = make_versions(args.size, args.versions, args.edits, args.seed)
+    logical = sum(len(data) for data in versions)
+    print(
+        f"{args.versions} versions of ~{args.size / 2**20:.0f} MiB, {args.edits} edits each "
+        f"({logical / 2**20:.0f} MiB logical)"
+    )
+    print(f"{'chunking':<26}{'dedup ratio':>12}{'MB/s':>10}{'avg chunk':>12}")
+
+    for label, split in (
+        (f"content-defined ({args.avg // 1024} KiB)", lambda d: content_defined(chunker, d)),
+        (f"fixed ({args.avg // 1024} KiB)", lambda d: fixed_size(args.avg, d)),
+    ):
+        ratio, rate, chunks = measure(versions, split)
+        print(f"{label:<26}{ratio:>12.2f}{rate:>10.1f}{logical / chunks / 1024:>9.0f} KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64 * 1024 * 1024, help="bytes of the first version")
+    parser.add_argument("--versions", type=int, default=8)
+    parser.add_argument("--edits", type=int, default=10, help="edits between versions")
+    parser.add_argument("--min", type=int, default=settings.DEDUP_CHUNK_MIN_SIZE)
+    parser.add_argument("--avg", type=int, default=settings.DEDUP_CHUNK_AVG_SIZE)
+    parser.add_argument("--max", type=int, default=settings.DEDUP_CHUNK_MAX_SIZE)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
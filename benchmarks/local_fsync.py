@@ -0,0 +1,94 @@
+"""
+Throughput of durable LocalStorage writes: an fsync per write versus
+group commit.
+
+    python -m benchmarks.local_fsync [--path DIR] [--blobs N] [--concurrency C]
+                                     [--size BYTES] [--window SECONDS]
+
+Writes go through the same code path as uploads (temp file, fsync,
+rename, directory fsync, or pack append + sync) but skip blob_metadata, so
+no database is needed. Point --path at the disk the store lives on:
+fsync is close to free on tmpfs, which makes the comparison meaningless.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from app.core.config import settings
+from app.storage.group_commit import local_commit
+from app.storage.local_storage import LocalStorage
+from app.storage.pack_store import PackStore
+
+
+async def _chunks(data: bytes):
+    yield data
+
+
+async def _run(write, blobs: int, concurrency: int) -> float:
+    """Blobs per second of `blobs` writes, `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await write(str(uuid.uuid4()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(blobs)))
+    return blobs / (time.perf_counter() - started)
+
+
+async def bench_files(root: Path, payload: bytes, blobs: int, concurrency: int) -> float:
+    settings.LOCAL_STORAGE_PATH = str(root)
+    storage = LocalStorage()
+
+    async def write(blob_id: str):
+        await storage._write_file(storage._path_for(blob_id), _chunks(payload))
+
+    return await _run(write, blobs, concurrency)
+
+
+async def bench_packs(root: Path, payload: bytes, blobs: int, concurrency: int) -> float:
+    store = PackStore(root / "packs", settings.LOCAL_PACK_SEGMENT_SIZE)
+
+    async def write(blob_id: str):
+        await local_commit.io.run(store.put, blob_id, payload)
+        await local_commit.sync(store.sync)
+
+    try:
+        return await _run(write, blobs, concurrency)
+    finally:
+        store.close()
+
+
+async def main(args) -> None:
+    payload = os.urandom(args.size)
+    print(f"{args.blobs} blobs of {args.size} bytes, {args.concurrency} concurrent writers")
+    print(f"{'layout':<8}{'fsync':<22}{'blobs/s':>10}")
+
+    for layout, bench in (("files", bench_files), ("packs", bench_packs)):
+        for label, window in (("per write", 0.0), (f"group ({args.window * 1000:g} ms)", args.window)):
+            local_commit.window = window
+            root = Path(tempfile.mkdtemp(prefix="fsync-bench-", dir=args.path))
+            try:
+                rate = await bench(root, payload, args.blobs, args.concurrency)
+            finally:
+                shutil.rmtree(root)
+            print(f"{layout:<8}{label:<22}{rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default=settings.LOCAL_STORAGE_PATH, help="directory on the disk to test")
+    parser.add_argument("--blobs", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--size", type=int, default=4096, help="payload bytes per blob")
+    parser.add_argument("--window", type=float, default=settings.LOCAL_FSYNC_WINDOW)
+    args = parser.parse_args()
+
+    Path(args.path).mkdir(parents=True, exist_ok=True)
+    asyncio.run(main(args))
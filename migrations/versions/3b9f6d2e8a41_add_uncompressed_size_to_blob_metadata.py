@@ -0,0 +1,32 @@
+"""Add uncompressed_size to blob_metadata
+
+Blobs compressed at rest are marked with their codec in content_encoding
+('zlib' or 'zstd'); their size column holds the stored (compressed) size
+and uncompressed_size the size of the payload itself.
+
+Revision ID: 3b9f6d2e8a41
+Revises: e7a05b3d9c18
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9f6d2e8a41'
+down_revision: Union[str, Sequence[str], None] = 'e7a05b3d9c18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("blob_metadata", sa.Column("uncompressed_size", sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("blob_metadata", "uncompressed_size")
@@ -0,0 +1,74 @@
+"""Index blob locations for all backends
+
+blob_metadata becomes the parent table: every backend records the exact
+storage key of a blob there, and blob_data (database backend payloads)
+references it instead of the other way round.
+
+Revision ID: 5d1e7c9a4b20
+Revises: a2bc11ff8c48
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1e7c9a4b20'
+down_revision: Union[str, Sequence[str], None] = 'a2bc11ff8c48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_constraint("blob_metadata_id_fkey", "blob_metadata", type_="foreignkey")
+
+    # payloads saved without their metadata row need one before the new FK
+    op.execute(
+        """
+        INSERT INTO blob_metadata (id, size, created_at, storage_backend, storage_path)
+        SELECT d.id, length(d.data), now(), 'DATABASE', 'blob_data/' || d.id
+        FROM blob_data d
+        WHERE NOT EXISTS (SELECT 1 FROM blob_metadata m WHERE m.id = d.id)
+        """
+    )
+    op.execute(
+        """
+        UPDATE blob_metadata SET storage_path = 'blob_data/' || id
+        WHERE storage_backend = 'DATABASE'
+        """
+    )
+
+    op.create_foreign_key(
+        "blob_data_id_fkey",
+        "blob_data",
+        "blob_metadata",
+        ["id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("blob_data_id_fkey", "blob_data", type_="foreignkey")
+
+    # rows of other backends have no blob_data to point to
+    op.execute(
+        """
+        DELETE FROM blob_metadata m
+        WHERE NOT EXISTS (SELECT 1 FROM blob_data d WHERE d.id = m.id)
+        """
+    )
+
+    op.create_foreign_key(
+        "blob_metadata_id_fkey",
+        "blob_metadata",
+        "blob_data",
+        ["id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
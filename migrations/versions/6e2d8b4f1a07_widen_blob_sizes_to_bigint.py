@@ -0,0 +1,44 @@
+"""Widen blob sizes to bigint
+
+blob_metadata.size is the authoritative size of blobs in every backend,
+and streamed and multipart uploads can exceed 2 GiB, past what an
+integer column holds. blob_metadata.size and blob_chunk.size become
+bigint, like blob_content.size and uncompressed_size already are.
+
+Revision ID: 6e2d8b4f1a07
+Revises: 9a4c7e1b5d32
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6e2d8b4f1a07'
+down_revision: Union[str, Sequence[str], None] = '9a4c7e1b5d32'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        "blob_metadata", "size", existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=False
+    )
+    op.alter_column(
+        "blob_chunk", "size", existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # fails if a blob over 2 GiB was stored meanwhile
+    op.alter_column(
+        "blob_chunk", "size", existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=False
+    )
+    op.alter_column(
+        "blob_metadata", "size", existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=False
+    )
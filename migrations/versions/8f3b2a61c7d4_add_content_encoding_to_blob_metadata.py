@@ -0,0 +1,41 @@
+"""Add content_encoding to blob_metadata
+
+New objects are stored as raw bytes in every backend and are marked
+'identity'. Rows left NULL are legacy objects that may still be Base64
+encoded at rest. Database backend payloads have always been raw.
+
+Revision ID: 8f3b2a61c7d4
+Revises: 5d1e7c9a4b20
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3b2a61c7d4'
+down_revision: Union[str, Sequence[str], None] = '5d1e7c9a4b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "blob_metadata",
+        sa.Column("content_encoding", sa.String(length=16), nullable=True),
+    )
+    op.execute(
+        """
+        UPDATE blob_metadata SET content_encoding = 'identity'
+        WHERE storage_backend = 'DATABASE'
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("blob_metadata", "content_encoding")
@@ -0,0 +1,44 @@
+"""Mark shared content rows in blob_metadata
+
+The content objects of deduplicated blobs are stored like blobs, under
+an id derived from their digest, with a blob_metadata row of their own.
+blob_metadata.shared_content flags those rows so the public blob routes
+never serve or delete them. Existing content rows are flagged from
+blob_content.
+
+Revision ID: 9a4c7e1b5d32
+Revises: 3b9f6d2e8a41
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4c7e1b5d32'
+down_revision: Union[str, Sequence[str], None] = '3b9f6d2e8a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "blob_metadata",
+        sa.Column("shared_content", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+    # content ids are the first 32 hex digits of the digest (content_id_for)
+    op.execute(
+        """
+        UPDATE blob_metadata SET shared_content = true
+        WHERE id IN (SELECT CAST(substr(digest, 1, 32) AS uuid) FROM blob_content)
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("blob_metadata", "shared_content")
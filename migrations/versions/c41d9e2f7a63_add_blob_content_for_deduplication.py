@@ -0,0 +1,50 @@
+"""Add blob_content for content-addressed deduplication
+
+Deduplicated blobs share one stored content object per sha256 digest.
+blob_content counts the blob_metadata rows referencing each digest
+through the new blob_metadata.content_digest column.
+
+Revision ID: c41d9e2f7a63
+Revises: 8f3b2a61c7d4
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d9e2f7a63'
+down_revision: Union[str, Sequence[str], None] = '8f3b2a61c7d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "blob_content",
+        sa.Column("digest", sa.String(length=64), primary_key=True),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column("refcount", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.add_column(
+        "blob_metadata",
+        sa.Column(
+            "content_digest",
+            sa.String(length=64),
+            sa.ForeignKey("blob_content.digest"),
+            nullable=True,
+        ),
+    )
+    op.create_index("idx_content_digest", "blob_metadata", ["content_digest"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("idx_content_digest", table_name="blob_metadata")
+    op.drop_column("blob_metadata", "content_digest")
+    op.drop_table("blob_content")
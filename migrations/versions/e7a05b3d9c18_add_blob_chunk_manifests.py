@@ -0,0 +1,53 @@
+"""Add blob_chunk manifests for chunked deduplication
+
+Chunked blobs are split into content-defined chunks stored once per
+sha256 digest (refcounted in blob_content). blob_chunk lists the chunks
+of each blob in order; blob_metadata.chunk_count marks chunked blobs.
+
+Revision ID: e7a05b3d9c18
+Revises: c41d9e2f7a63
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a05b3d9c18'
+down_revision: Union[str, Sequence[str], None] = 'c41d9e2f7a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("blob_metadata", sa.Column("chunk_count", sa.Integer(), nullable=True))
+    op.create_table(
+        "blob_chunk",
+        sa.Column(
+            "blob_id",
+            sa.UUID(),
+            sa.ForeignKey("blob_metadata.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("position", sa.Integer(), primary_key=True),
+        sa.Column(
+            "digest",
+            sa.String(length=64),
+            sa.ForeignKey("blob_content.digest"),
+            nullable=False,
+        ),
+        sa.Column("offset", sa.BigInteger(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+    )
+    op.create_index("idx_chunk_digest", "blob_chunk", ["digest"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("idx_chunk_digest", table_name="blob_chunk")
+    op.drop_table("blob_chunk")
+    op.drop_column("blob_metadata", "chunk_count")
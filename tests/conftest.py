@@ -1,21 +1,232 @@
+import asyncio
+import re
+import httpx
 import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
 
 from app.main import app
+from app.core.config import settings
 from app.core.security import verify_token
+from app import s3_client
+from app.blob_schemas import BlobCreate
+from app.storage.base import BlobStream, StoredBlob, resolve_range
+from app.storage.locator import locator
 
 # 🔐 Override auth
 async def fake_verify_token():
     return {"sub": "test-user"}
 
-app.dependency_overrides[verify_token] = fake_verify_token
-
 @pytest.fixture
 def client():
-    return TestClient(app)
+    app.dependency_overrides[verify_token] = fake_verify_token
+    yield TestClient(app)
+    app.dependency_overrides.pop(verify_token, None)
 
 @pytest.fixture
 async def async_client():
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
+
+@pytest.fixture
+def auth_headers():
+    return {"Authorization": f"Bearer {settings.AUTH_TOKEN}"}
+
+@pytest.fixture
+def mock_storage(monkeypatch):
+    """Replace the configured storage backend with an in-memory mock."""
+    storage = MagicMock()
+
+    async def side_effect_save_stream(blob_id, chunks, filename, path, **kwargs):
+        storage.saved = b"".join([chunk async for chunk in chunks])
+        return BlobCreate(id=blob_id)
+
+    async def side_effect_retrieve(blob_id, **kwargs):
+        return StoredBlob(
+            id=blob_id,
+            data=b"testdata",
+            size=len(b"testdata"),
+            created_at=datetime.now(timezone.utc),
+            name="test.txt",
+            path="media/test.txt",
+            storage_backend="local",
+            storage_path=f"{blob_id}.bin",
+        )
+
+    async def side_effect_retrieve_stream(blob_id, **kwargs):
+        async def chunks():
+            yield b"test"
+            yield b"data"
+        return BlobStream(id=blob_id, size=len(b"testdata"), chunks=chunks(), name="test.txt")
+
+    async def side_effect_retrieve_range(blob_id, start, end=None, **kwargs):
+        payload = b"testdata"
+        first, last = resolve_range(start, end, len(payload))
+        async def chunks():
+            yield payload[first:last + 1]
+        return BlobStream(
+            id=blob_id, size=len(payload), chunks=chunks(), name="test.txt", start=first, end=last
+        )
+
+    storage.save = AsyncMock()
+    storage.save_stream = AsyncMock(side_effect=side_effect_save_stream)
+    storage.retrieve = AsyncMock(side_effect=side_effect_retrieve)
+    storage.retrieve_stream = AsyncMock(side_effect=side_effect_retrieve_stream)
+    storage.retrieve_range = AsyncMock(side_effect=side_effect_retrieve_range)
+    storage.delete = AsyncMock(return_value=True)
+
+    monkeypatch.setattr("app.api.endpoints.get_storage_backend", lambda: storage)
+    return storage
+
+@pytest.fixture
+def metadata_store(monkeypatch):
+    """In-memory stand-in for the blob_metadata table used by the locator."""
+    rows = {}
+
+    async def fake_create_blob_metadata(db, blob_metadata):
+        rows[str(blob_metadata.id)] = blob_metadata
+        return blob_metadata
+
+    async def fake_get_blob_metadata(db, blob_id):
+        return rows.get(str(blob_id))
+
+    async def fake_delete_blob_metadata(db, blob_id, shared_content=False):
+        row = rows.get(str(blob_id))
+        if row is None or bool(row.shared_content) != shared_content:
+            return False
+        return rows.pop(str(blob_id)) is not None
+
+    async def fake_update_blob_encoding(db, blob_id, content_encoding, uncompressed_size):
+        row = rows.get(str(blob_id))
+        if row is None:
+            return False
+        row.content_encoding, row.uncompressed_size = content_encoding, uncompressed_size
+        return True
+
+    monkeypatch.setattr("app.storage.locator.create_blob_metadata", fake_create_blob_metadata)
+    monkeypatch.setattr("app.storage.locator.delete_blob_metadata", fake_delete_blob_metadata)
+    monkeypatch.setattr("app.storage.locator.get_blob_metadata", fake_get_blob_metadata)
+    monkeypatch.setattr("app.storage.locator.update_blob_encoding", fake_update_blob_encoding)
+    locator.clear()
+    yield rows
+    locator.clear()
+
+
+class FakeS3:
+    """In-memory S3 bucket served through httpx.MockTransport."""
+
+    def __init__(self, latency: float = 0):
+        self.objects = {}
+        self.requests = []
+        self.latency = latency
+        self.in_flight = self.max_in_flight = 0
+        self.uploads = {}       # multipart uploads in progress: id -> {part number: data}
+        self.aborted = []
+        self.fail_parts = {}    # part number -> how many attempts to reject
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return self._respond(request)
+        finally:
+            self.in_flight -= 1
+
+    def _respond(self, request: httpx.Request) -> httpx.Response:
+        # path-style URL: /<bucket>/<key>
+        key = request.url.path.split("/", 2)[2]
+        params = request.url.params
+
+        if request.method == "PUT":
+            body = request.content
+            assert int(request.headers["Content-Length"]) == len(body)
+            if request.headers.get("Content-Encoding") == "aws-chunked":
+                body = _decode_aws_chunked(body)
+                assert int(request.headers["x-amz-decoded-content-length"]) == len(body)
+
+            if "uploadId" in params:
+                number = int(params["partNumber"])
+                if self.fail_parts.get(number):
+                    self.fail_parts[number] -= 1
+                    return httpx.Response(500)
+                self.uploads[params["uploadId"]][number] = body
+                return httpx.Response(200, headers={"ETag": f'"etag-{number}"'})
+
+            self.objects[key] = body
+            return httpx.Response(200)
+
+        if request.method == "POST" and "uploads" in params:
+            upload_id = f"upload-{len(self.uploads) + len(self.aborted) + 1}"
+            self.uploads[upload_id] = {}
+            return httpx.Response(
+                200, content=f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+
+        if request.method == "POST":
+            parts = self.uploads.pop(params["uploadId"])
+            numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", request.content)]
+            self.objects[key] = b"".join(parts[n] for n in numbers)
+            return httpx.Response(200, content=b"<CompleteMultipartUploadResult/>")
+
+        if request.method == "DELETE":
+            if "uploadId" in params:
+                self.uploads.pop(params["uploadId"], None)
+                self.aborted.append(params["uploadId"])
+            else:
+                self.objects.pop(key, None)
+            return httpx.Response(204)
+
+        if not key:
+            contents = "".join(f"<Contents><Key>{k}</Key></Contents>" for k in self.objects)
+            return httpx.Response(200, content=f"<ListBucketResult>{contents}</ListBucketResult>")
+
+        if key not in self.objects:
+            return httpx.Response(404)
+
+        body = self.objects[key]
+        byte_range = request.headers.get("Range")
+        if not byte_range:
+            return httpx.Response(200, content=body)
+
+        first, last = resolve_range(*_parse_range(byte_range), len(body))
+        return httpx.Response(
+            206,
+            content=body[first:last + 1],
+            headers={"Content-Range": f"bytes {first}-{last}/{len(body)}"},
+        )
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    payload = bytearray()
+    while True:
+        header, body = body.split(b"\r\n", 1)
+        size = int(header.split(b";", 1)[0], 16)
+        payload += body[:size]
+        body = body[size + 2:]
+        if not size:
+            return bytes(payload)
+
+
+def _parse_range(value: str):
+    first, _, last = value.split("=", 1)[1].partition("-")
+    if not first:
+        return -int(last), None
+    return int(first), int(last) if last else None
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    """Point the shared S3 client at an in-memory bucket."""
+    monkeypatch.setattr(s3_client, "ACCESS_KEY", "test-access-key")
+    monkeypatch.setattr(s3_client, "SECRET_KEY", "test-secret-key")
+    monkeypatch.setattr(s3_client, "BUCKET", "test-bucket")
+
+    bucket = FakeS3()
+    asyncio.run(s3_client.close_client())
+    s3_client.open_client(httpx.MockTransport(bucket.handler))
+    yield bucket
+    asyncio.run(s3_client.close_client())
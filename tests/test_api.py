@@ -39,3 +39,238 @@ def test_create_blob_contract(client: TestClient, auth_headers, mock_storage):
     
     assert "name" not in json_data
     assert "size" not in json_data
+
+def test_get_blob_content_streams_raw_bytes(client: TestClient, auth_headers, mock_storage):
+    blob_id = str(uuid.uuid4())
+
+    response = client.get(f"/api/v1/blobs/{blob_id}/content", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.content == b"testdata"
+    assert response.headers["content-length"] == "8"
+    assert response.headers["content-type"].startswith("text/plain")
+    mock_storage.retrieve_stream.assert_called_with(blob_id)
+
+def test_get_blob_content_not_found(client: TestClient, auth_headers, mock_storage):
+    mock_storage.retrieve_stream.side_effect = None
+    mock_storage.retrieve_stream.return_value = None
+
+    response = client.get(f"/api/v1/blobs/{uuid.uuid4()}/content", headers=auth_headers)
+
+    assert response.status_code == 404
+
+def test_get_blob_content_range(client: TestClient, auth_headers, mock_storage):
+    blob_id = str(uuid.uuid4())
+
+    response = client.get(
+        f"/api/v1/blobs/{blob_id}/content",
+        headers={**auth_headers, "Range": "bytes=2-5"},
+    )
+
+    assert response.status_code == 206
+    assert response.content == b"stda"
+    assert response.headers["content-range"] == "bytes 2-5/8"
+    assert response.headers["content-length"] == "4"
+    mock_storage.retrieve_range.assert_called_with(blob_id, 2, 5)
+
+def test_get_blob_content_suffix_range(client: TestClient, auth_headers, mock_storage):
+    response = client.get(
+        f"/api/v1/blobs/{uuid.uuid4()}/content",
+        headers={**auth_headers, "Range": "bytes=-3"},
+    )
+
+    assert response.status_code == 206
+    assert response.content == b"ata"
+    assert response.headers["content-range"] == "bytes 5-7/8"
+
+def test_get_blob_content_range_not_satisfiable(client: TestClient, auth_headers, mock_storage):
+    response = client.get(
+        f"/api/v1/blobs/{uuid.uuid4()}/content",
+        headers={**auth_headers, "Range": "bytes=100-"},
+    )
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */8"
+
+def test_get_blob_content_stale_if_range_sends_everything(client: TestClient, auth_headers, mock_storage):
+    response = client.get(
+        f"/api/v1/blobs/{uuid.uuid4()}/content",
+        headers={**auth_headers, "Range": "bytes=0-1", "If-Range": '"some-other-etag"'},
+    )
+
+    assert response.status_code == 200
+    assert response.content == b"testdata"
+    mock_storage.retrieve_range.assert_not_called()
+
+def test_get_blob_encodes_base64_only_in_json(client: TestClient, auth_headers, mock_storage):
+    response = client.get(f"/api/v1/blobs/{uuid.uuid4()}", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json()["data"] == "dGVzdGRhdGE="  # b"testdata"
+    assert response.headers["vary"] == "Accept"
+
+def test_get_blob_serves_raw_bytes_when_asked_for_octet_stream(client: TestClient, auth_headers, mock_storage):
+    headers = {**auth_headers, "Accept": "application/octet-stream, application/json;q=0.5"}
+
+    response = client.get(f"/api/v1/blobs/{uuid.uuid4()}", headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == b"testdata"
+    assert response.headers["vary"] == "Accept"
+    mock_storage.retrieve.assert_not_called()
+
+def _local_file_stream(mock_storage, tmp_path, payload=b"testdata"):
+    from app.storage.base import BlobStream, resolve_range
+
+    file_path = tmp_path / "blob.bin"
+    file_path.write_bytes(payload)
+
+    async def retrieve_range(blob_id, start, end=None, **kwargs):
+        first, last = resolve_range(start, end, len(payload))
+        async def chunks():
+            raise AssertionError("file-backed blobs must not be read through chunks")
+            yield
+        return BlobStream(
+            id=blob_id, size=len(payload), chunks=chunks(), name="test.txt",
+            start=first, end=last, file_path=str(file_path),
+        )
+
+    async def retrieve_stream(blob_id, **kwargs):
+        return await retrieve_range(blob_id, 0)
+
+    mock_storage.retrieve_range.side_effect = retrieve_range
+    mock_storage.retrieve_stream.side_effect = retrieve_stream
+    return file_path
+
+def test_get_blob_content_serves_local_files_directly(client: TestClient, auth_headers, mock_storage, tmp_path):
+    _local_file_stream(mock_storage, tmp_path)
+
+    response = client.get(f"/api/v1/blobs/{uuid.uuid4()}/content", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.content == b"testdata"
+    assert response.headers["content-length"] == "8"
+
+    response = client.get(
+        f"/api/v1/blobs/{uuid.uuid4()}/content",
+        headers={**auth_headers, "Range": "bytes=2-5"},
+    )
+    assert response.status_code == 206
+    assert response.content == b"stda"
+    assert response.headers["content-range"] == "bytes 2-5/8"
+    assert response.headers["content-length"] == "4"
+
+def test_get_blob_content_is_404_when_the_file_is_gone(client: TestClient, auth_headers, mock_storage, tmp_path):
+    file_path = _local_file_stream(mock_storage, tmp_path)
+    # deleted after the backend located it, before the response started
+    file_path.unlink()
+
+    response = client.get(f"/api/v1/blobs/{uuid.uuid4()}/content", headers=auth_headers)
+    assert response.status_code == 404
+
+def test_file_range_response_uses_pathsend_for_whole_files(tmp_path):
+    import asyncio
+    from app.api.responses import FileRangeResponse
+
+    file_path = tmp_path / "blob.bin"
+    file_path.write_bytes(b"testdata")
+
+    async def call(start, length):
+        messages = []
+        async def send(message):
+            messages.append(message)
+        scope = {"type": "http", "extensions": {"http.response.pathsend": {}}}
+        await FileRangeResponse(str(file_path), start, length)(scope, None, send)
+        return [m["type"] for m in messages], messages
+
+    types, messages = asyncio.run(call(0, 8))
+    assert types == ["http.response.start", "http.response.pathsend"]
+    assert messages[1]["path"] == str(file_path)
+
+    # a slice cannot be pathsent: it is cut from the mapped file instead
+    types, messages = asyncio.run(call(2, 4))
+    assert "http.response.pathsend" not in types
+    assert b"".join(m.get("body", b"") for m in messages) == b"stda"
+
+def test_delete_blob(client: TestClient, auth_headers, mock_storage):
+    blob_id = str(uuid.uuid4())
+    mock_storage.delete.return_value = True
+
+    response = client.delete(f"/api/v1/blobs/{blob_id}", headers=auth_headers)
+    assert response.status_code == 204
+    assert mock_storage.delete.call_args.args == (blob_id,)
+
+    mock_storage.delete.return_value = False
+    response = client.delete(f"/api/v1/blobs/{blob_id}", headers=auth_headers)
+    assert response.status_code == 404
+
+    mock_storage.delete.side_effect = NotImplementedError
+    response = client.delete(f"/api/v1/blobs/{blob_id}", headers=auth_headers)
+    assert response.status_code == 501
+
+def test_batch_upload_writes_concurrently_and_reports_each_file(client: TestClient, auth_headers, mock_storage, monkeypatch):
+    import asyncio
+    from app.blob_schemas import BlobCreate
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "BATCH_UPLOAD_CONCURRENCY", 2)
+    writing = {"now": 0, "max": 0}
+
+    async def save_stream(blob_id, chunks, filename, path, **kwargs):
+        assert "metadata_batch" in kwargs and "db" not in kwargs
+        writing["now"] += 1
+        writing["max"] = max(writing["max"], writing["now"])
+        await asyncio.sleep(0.01)
+        writing["now"] -= 1
+        if filename == "bad.txt":
+            raise RuntimeError("backend down")
+        return BlobCreate(id=blob_id)
+    mock_storage.save_stream.side_effect = save_stream
+
+    names = ["a.txt", "bad.txt", "c.txt", "d.txt", "e.txt"]
+    files = [("files", (name, b"content of " + name.encode(), "text/plain")) for name in names]
+    response = client.post("/api/v1/blobs:batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (4, 1)
+    assert [item["filename"] for item in body["items"]] == names
+    assert [item["status"] for item in body["items"]] == [201, 500, 201, 201, 201]
+    assert body["items"][1]["id"] is None and all(
+        uuid.UUID(item["id"]) for i, item in enumerate(body["items"]) if i != 1
+    )
+    assert mock_storage.save_stream.await_count == 5
+    assert writing["max"] == 2
+
+
+def test_batch_upload_rejects_too_many_files(client: TestClient, auth_headers, mock_storage, monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "BATCH_UPLOAD_MAX_FILES", 2)
+    files = [("files", (f"{i}.txt", b"x", "text/plain")) for i in range(3)]
+    response = client.post("/api/v1/blobs:batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 413
+    mock_storage.save_stream.assert_not_called()
+
+def test_file_range_response_serves_the_mapping_once_the_path_is_gone(tmp_path):
+    import asyncio
+    from app.api.responses import FileRangeResponse
+
+    file_path = tmp_path / "blob.bin"
+    file_path.write_bytes(b"testdata")
+
+    async def call():
+        response = await FileRangeResponse.open(str(file_path), 0, 8)
+        file_path.unlink()
+        messages = []
+        async def send(message):
+            messages.append(message)
+        scope = {"type": "http", "extensions": {"http.response.pathsend": {}}}
+        await response(scope, None, send)
+        return messages
+
+    messages = asyncio.run(call())
+    assert "http.response.pathsend" not in [m["type"] for m in messages]
+    assert b"".join(m.get("body", b"") for m in messages) == b"testdata"
+
+    assert asyncio.run(FileRangeResponse.open(str(file_path), 0, 8)) is None
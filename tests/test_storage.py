@@ -1,14 +1,15 @@
 
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
+from pathlib import Path
 
 def test_storage_save_success(client: TestClient, auth_headers, mock_storage):
     files = {'file': ('test.txt', b"content", "text/plain")}
     response = client.post("/api/v1/blobs", headers=auth_headers, files=files)
     
     assert response.status_code == 201
-    mock_storage.save.assert_called_once()
+    mock_storage.save_stream.assert_called_once()
     data = response.json()
     assert data["id"] is not None
     # Check if data in response is what we expect (base64 of "content")
@@ -17,14 +18,15 @@ def test_storage_save_success(client: TestClient, auth_headers, mock_storage):
     # The endpoint passes "base64_data" to save.
     
     # Let's verify what was passed to save
-    args, kwargs = mock_storage.save.call_args
-    # blob_id, data, filename, path
+    args, kwargs = mock_storage.save_stream.call_args
+    # blob_id, chunks, filename, path
     assert kwargs["filename"] == "test.txt"
-    # assert kwargs["data"] == b'Y29udGVudA==' # b64 encoded "content"
+    # chunks are streamed raw, the backend decides how to store them
+    assert mock_storage.saved == b"content"
 
 def test_storage_save_failure(client: TestClient, auth_headers, mock_storage):
     # Simulate DB or Storage error
-    mock_storage.save.side_effect = Exception("Storage connection failed")
+    mock_storage.save_stream.side_effect = Exception("Storage connection failed")
     
     files = {'file': ('test.txt', b"content", "text/plain")}
     response = client.post("/api/v1/blobs", headers=auth_headers, files=files)
@@ -59,3 +61,1621 @@ def test_storage_retrieve_not_found(client: TestClient, auth_headers, mock_stora
     
     assert response.status_code == 404
     assert response.json()["detail"] == "Blob not found"
+
+def _chunks(*parts):
+    async def gen():
+        for part in parts:
+            yield part
+    return gen()
+
+def test_local_storage_save_stream(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import hashlib
+    import uuid
+    from app.core.config import settings
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_id = str(uuid.uuid4())
+
+    result = asyncio.run(
+        LocalStorage().save_stream(blob_id, _chunks(b"hello ", b"streamed ", b"world"), "f.txt", "f.txt")
+    )
+
+    assert str(result.id) == blob_id
+    assert result.data is None
+    stored = [p for p in tmp_path.rglob("*") if p.is_file()]
+    # sharded by the MD5 of the id, stored as raw bytes with no Base64 at rest
+    digest = hashlib.md5(blob_id.encode()).hexdigest()
+    assert stored == [tmp_path / digest[:2] / digest[2:4] / blob_id]
+    assert stored[0].read_bytes() == b"hello streamed world"
+    assert metadata_store[blob_id].content_encoding == "identity"
+
+def test_local_storage_retrieve_stream_round_trip(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "DOWNLOAD_CHUNK_SIZE", 5)
+    blob_id = str(uuid.uuid4())
+    payload = bytes(range(256)) * 3 + b"x"
+
+    async def run():
+        storage = LocalStorage()
+        await storage.save_stream(blob_id, _chunks(payload[:100], payload[100:]), "f.bin", "f.bin")
+        blob_stream = await storage.retrieve_stream(blob_id)
+        assert Path(blob_stream.file_path).read_bytes() == payload
+        return blob_stream.size, b"".join([c async for c in blob_stream.chunks])
+
+    assert asyncio.run(run()) == (len(payload), payload)
+
+def test_local_storage_retrieve_range_reads_only_requested_bytes(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.base import RangeNotSatisfiable
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "DOWNLOAD_CHUNK_SIZE", 7)
+    blob_id = str(uuid.uuid4())
+    payload = bytes(range(100))
+
+    async def read(start, end):
+        blob_stream = await LocalStorage().retrieve_range(blob_id, start, end)
+        data = b"".join([c async for c in blob_stream.chunks])
+        return blob_stream.start, blob_stream.end, data
+
+    async def run():
+        await LocalStorage().save_stream(blob_id, _chunks(payload), "f.bin", "f.bin")
+        results = [await read(s, e) for s, e in [(0, 0), (1, 4), (31, 65), (98, None), (-5, None), (90, 500)]]
+        with pytest.raises(RangeNotSatisfiable):
+            await LocalStorage().retrieve_range(blob_id, 100, None)
+        return results
+
+    assert asyncio.run(run()) == [
+        (0, 0, payload[0:1]),
+        (1, 4, payload[1:5]),
+        (31, 65, payload[31:66]),
+        (98, 99, payload[98:]),
+        (95, 99, payload[95:]),
+        (90, 99, payload[90:]),
+    ]
+
+def test_local_storage_indexes_location_instead_of_scanning(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.locator import locator
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_id = str(uuid.uuid4())
+
+    def no_scan(self, blob_id):
+        raise AssertionError("indexed blobs must not be looked up with a glob")
+
+    async def run():
+        await LocalStorage().save_stream(blob_id, _chunks(b"indexed"), "f.txt", "media/f.txt")
+        monkeypatch.setattr(LocalStorage, "_find_path", no_scan)
+        # also go through the database path, not only the in-process cache
+        locator.clear()
+        blob_stream = await LocalStorage().retrieve_stream(blob_id)
+        return blob_stream, b"".join([c async for c in blob_stream.chunks])
+
+    blob_stream, data = asyncio.run(run())
+
+    row = metadata_store[blob_id]
+    assert (tmp_path / row.storage_path).read_bytes() == b"indexed"
+    assert row.size == len(b"indexed")
+    assert (data, blob_stream.name) == (b"indexed", "f.txt")
+
+def test_local_storage_finds_blobs_saved_before_the_index(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import base64
+    import uuid
+    from app.core.config import settings
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_id = str(uuid.uuid4())
+    (tmp_path / f"20260101T034814343094Z__{blob_id}.bin").write_bytes(base64.b64encode(b"legacy!"))
+
+    # the flat layout is only scanned on request
+    assert asyncio.run(LocalStorage().retrieve_stream(blob_id)) is None
+    monkeypatch.setattr(settings, "LEGACY_LOCATION_SCANS", True)
+
+    async def run():
+        blob_stream = await LocalStorage().retrieve_stream(blob_id)
+        # Base64 at rest: must be decoded, never served as the file itself
+        assert blob_stream.file_path is None
+        return blob_stream.size, b"".join([c async for c in blob_stream.chunks])
+
+    assert asyncio.run(run()) == (7, b"legacy!")
+
+def test_local_storage_reads_base64_rows_only_in_legacy_mode(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import StorageBackend, settings
+    from app.storage.local_storage import LocalStorage
+    from app.storage.locator import BlobLocation, locator
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_id = str(uuid.uuid4())
+    # indexed before the binary format: no content encoding recorded
+    (tmp_path / "old.bin").write_bytes(b"b2xkIQ==")
+    locator.remember(blob_id, BlobLocation(StorageBackend.LOCAL, "old.bin", 4))
+
+    assert asyncio.run(LocalStorage().retrieve(blob_id)).data == b"old!"
+
+    monkeypatch.setattr(settings, "LEGACY_BASE64_READS", False)
+    locator.remember(blob_id, BlobLocation(StorageBackend.LOCAL, "old.bin", 8))
+
+    assert asyncio.run(LocalStorage().retrieve(blob_id)).data == b"b2xkIQ=="
+
+def test_blob_locator_cache_evicts_least_recently_used():
+    from app.core.config import StorageBackend
+    from app.storage.locator import BlobLocation, BlobLocator
+
+    cache = BlobLocator(max_entries=2, ttl=60)
+    for blob_id in ("a", "b"):
+        cache.remember(blob_id, BlobLocation(StorageBackend.LOCAL, f"{blob_id}.bin", 1))
+    cache._cache.move_to_end("a")  # "a" used more recently than "b"
+    cache.remember("c", BlobLocation(StorageBackend.LOCAL, "c.bin", 1))
+
+    assert list(cache._cache) == ["a", "c"]
+
+def test_blob_locator_cache_entries_expire(metadata_store):
+    import asyncio
+    from app.core.config import StorageBackend
+    from app.storage.locator import BlobLocation, BlobLocator
+
+    cache = BlobLocator(max_entries=2, ttl=0)
+    # deleted by another worker: its row is gone, this worker's entry is not
+    cache.remember("a", BlobLocation(StorageBackend.LOCAL, "a.bin", 1))
+
+    assert asyncio.run(cache.lookup("a", StorageBackend.LOCAL)) is None
+    assert list(cache._cache) == []
+
+def test_database_storage_saves_in_one_transaction_on_the_given_session():
+    import asyncio
+    import uuid
+    from app.storage.database_storage import DatabaseStorage
+
+    class RecordingSession:
+        def __init__(self):
+            self.added, self.commits = [], 0
+
+        def add(self, obj):
+            self.added.append(obj)
+
+        async def commit(self):
+            self.commits += 1
+
+        async def refresh(self, obj):
+            raise AssertionError("no refresh round trip expected")
+
+    db = RecordingSession()
+    blob_id = str(uuid.uuid4())
+
+    result = asyncio.run(
+        DatabaseStorage().save_stream(blob_id, _chunks(b"in ", b"one go"), "f.txt", "f.txt", db=db)
+    )
+
+    assert str(result.id) == blob_id
+    assert db.commits == 1
+    [blob_metadata] = db.added
+    assert blob_metadata.size == len(b"in one go")
+    assert bytes(blob_metadata.blob_data.data) == b"in one go"
+
+def test_database_storage_retrieve_is_a_single_query():
+    import asyncio
+    import uuid
+    from datetime import datetime, timezone
+    from app.blob_models import BlobData, BlobMetadata
+    from app.core.config import StorageBackend
+    from app.storage.database_storage import DatabaseStorage
+
+    blob_id = uuid.uuid4()
+    row = BlobMetadata(
+        id=blob_id,
+        size=5,
+        created_at=datetime.now(timezone.utc),
+        storage_backend=StorageBackend.DATABASE,
+        name="f.txt",
+    )
+    row.blob_data = BlobData(id=blob_id, data=b"bytes")
+
+    class OneQuerySession:
+        queries = 0
+
+        async def execute(self, statement):
+            self.queries += 1
+            result = MagicMock()
+            result.scalar_one_or_none.return_value = row
+            return result
+
+    db = OneQuerySession()
+    blob = asyncio.run(DatabaseStorage().retrieve(str(blob_id), db=db))
+
+    assert db.queries == 1
+    assert blob.data == b"bytes"
+    assert (blob.size, blob.name) == (5, "f.txt")
+
+def test_s3_storage_round_trip_through_the_shared_pool(fake_s3, metadata_store):
+    import asyncio
+    import uuid
+    from app.storage.s3_storage import S3Storage
+
+    fake_s3.latency = 0.01
+    payloads = {str(uuid.uuid4()): f"blob {i}".encode() * 100 for i in range(5)}
+
+    async def run():
+        storage = S3Storage()
+        await asyncio.gather(*(
+            storage.save_stream(blob_id, _chunks(payload), "f.bin", "f.bin")
+            for blob_id, payload in payloads.items()
+        ))
+        blob_id = next(iter(payloads))
+        blob_stream = await storage.retrieve_range(blob_id, 2, 9)
+        return blob_id, b"".join([c async for c in blob_stream.chunks])
+
+    blob_id, data = asyncio.run(run())
+
+    assert data == payloads[blob_id][2:10]
+    # uploads ran concurrently instead of blocking the event loop one by one
+    assert fake_s3.max_in_flight > 1
+    assert all(r.headers["Authorization"].startswith("AWS4-HMAC-SHA256") for r in fake_s3.requests)
+    assert sorted(fake_s3.objects.values()) == sorted(payloads.values())
+
+def test_s3_misses_are_not_scanned_until_backfilled(fake_s3, metadata_store, monkeypatch):
+    import asyncio
+    import base64
+    import uuid
+    from app.core.config import StorageBackend
+    from app.storage import backfill_locations
+    from app.storage.s3_storage import S3Storage
+
+    legacy_id, rowless_id = str(uuid.uuid4()), str(uuid.uuid4())
+    legacy_key = f"20260101T034814343094Z__{legacy_id}.bin"
+    rowless_key = f"20260101T035720725331Z__{rowless_id}.bin"
+    fake_s3.objects[legacy_key] = base64.b64encode(b"legacy!")
+    fake_s3.objects[rowless_key] = base64.b64encode(b"no row")
+    fake_s3.objects["notes.txt"] = b"not a blob"
+    # a row written before the index: no storage_path
+    metadata_store[legacy_id] = MagicMock(storage_path=None, storage_backend=StorageBackend.S3)
+
+    class Session:
+        added, commits = [], 0
+
+        def add(self, obj):
+            self.added.append(obj)
+
+        async def commit(self):
+            self.commits += 1
+            for row in self.added:
+                metadata_store[str(row.id)] = row
+
+    async def fake_get_blob_metadata(db, blob_id):
+        return metadata_store.get(blob_id)
+
+    monkeypatch.setattr(backfill_locations, "get_blob_metadata", fake_get_blob_metadata)
+
+    async def run():
+        storage = S3Storage()
+        # an unknown id is a miss straight away: no bucket listing
+        missing = await storage.retrieve(str(uuid.uuid4()))
+        listed = [r for r in fake_s3.requests if "list-type" in r.url.params]
+
+        db = Session()
+        indexed = await backfill_locations.backfill(StorageBackend.S3, db)
+        return missing, listed, indexed, db, await storage.retrieve(rowless_id)
+
+    missing, listed, indexed, db, backfilled = asyncio.run(run())
+    assert missing is None and listed == []
+    assert backfilled.data == b"no row"
+    assert indexed == 2 and db.commits == 1
+    assert metadata_store[legacy_id].storage_path == legacy_key
+    [row] = db.added
+    assert (str(row.id), row.size, row.storage_path, row.content_encoding) == (
+        rowless_id, 6, rowless_key, None
+    )
+
+
+def test_s3_chunk_signature_matches_aws_example():
+    from app.s3_client import chunk_signature, get_signature_key
+
+    # "Transferring Payload in Multiple Chunks" example from the SigV4 docs
+    signing_key = get_signature_key(
+        "wJalrXUtnFEMI/K7MDENG/bPxRfiCYEXAMPLEKEY", "20130524", "us-east-1", "s3"
+    )
+    args = (signing_key, "20130524T000000Z", "20130524/us-east-1/s3/aws4_request")
+
+    first = chunk_signature(
+        *args, "4f232c4386841ef735655705268965c44a0e4690baa4adea153f7db9fa80a0a9", b"a" * 65536
+    )
+    assert first == "ad80c730a21e5b8d04586a2213dd63b9a0e99e0e2307b0ade35a65485a288648"
+
+def test_s3_streaming_upload_signs_chunks_without_spooling(fake_s3, metadata_store, monkeypatch):
+    import asyncio
+    import tempfile
+    import uuid
+    from app import s3_client
+    from app.core.config import settings
+    from app.storage.s3_storage import S3Storage
+
+    monkeypatch.setattr(settings, "S3_SIGNED_CHUNK_SIZE", 8192)
+    monkeypatch.setattr(tempfile, "TemporaryFile", None)  # no spool expected
+    derivations = []
+    monkeypatch.setattr(
+        s3_client, "get_signature_key", lambda *args: derivations.append(args) or b"k" * 32
+    )
+    s3_client.cached_signature_key.cache_clear()
+    payload = bytes(range(256)) * 100
+
+    async def run():
+        storage = S3Storage()
+        for _ in range(2):
+            await storage.save_stream(
+                str(uuid.uuid4()), _chunks(payload[:1000], payload[1000:]), "f.bin", "f.bin",
+                size=len(payload),
+            )
+
+    asyncio.run(run())
+    s3_client.cached_signature_key.cache_clear()
+
+    put = fake_s3.requests[0]
+    assert put.headers["x-amz-content-sha256"] == s3_client.STREAMING_PAYLOAD
+    assert list(fake_s3.objects.values()) == [payload, payload]
+    # signing key derived once for the day, not per request
+    assert len(derivations) == 1
+
+def test_s3_multipart_upload_retries_parts_and_bounds_concurrency(fake_s3, metadata_store, monkeypatch):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.s3_storage import S3Storage
+
+    monkeypatch.setattr(settings, "S3_MULTIPART_THRESHOLD", 1000)
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 1000)
+    monkeypatch.setattr(settings, "S3_MULTIPART_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "S3_RETRY_BACKOFF", 0)
+    fake_s3.latency = 0.01
+    fake_s3.fail_parts = {3: 2}
+    payload = bytes(range(256)) * 30  # 8 parts
+
+    result = asyncio.run(
+        S3Storage().save_stream(str(uuid.uuid4()), _chunks(payload[:2500], payload[2500:]), "f.bin", "f.bin")
+    )
+
+    assert result is not None
+    assert list(fake_s3.objects.values()) == [payload]
+    assert fake_s3.max_in_flight <= 2
+    assert fake_s3.uploads == {}
+
+def test_s3_multipart_upload_is_aborted_when_a_part_keeps_failing(fake_s3, metadata_store, monkeypatch):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.s3_storage import S3Storage
+
+    monkeypatch.setattr(settings, "S3_MULTIPART_THRESHOLD", 1000)
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 1000)
+    monkeypatch.setattr(settings, "S3_RETRY_BACKOFF", 0)
+    fake_s3.fail_parts = {2: settings.S3_MAX_RETRIES + 1}
+
+    result = asyncio.run(
+        S3Storage().save_stream(str(uuid.uuid4()), _chunks(b"x" * 5000), "f.bin", "f.bin", size=5000)
+    )
+
+    assert result is None
+    assert fake_s3.objects == {}
+    assert fake_s3.aborted == ["upload-1"]
+    assert metadata_store == {}
+
+def test_s3_large_downloads_use_parallel_ranged_gets(fake_s3, metadata_store, monkeypatch):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.s3_storage import S3Storage
+
+    monkeypatch.setattr(settings, "S3_PARALLEL_GET_THRESHOLD", 1000)
+    monkeypatch.setattr(settings, "S3_DOWNLOAD_PART_SIZE", 1000)
+    monkeypatch.setattr(settings, "S3_DOWNLOAD_CONCURRENCY", 3)
+    blob_id = str(uuid.uuid4())
+    payload = bytes(range(256)) * 40
+
+    async def run():
+        storage = S3Storage()
+        await storage.save_stream(blob_id, _chunks(payload), "f.bin", "f.bin", size=len(payload))
+        fake_s3.latency = 0.01
+        fake_s3.requests.clear()
+        blob_stream = await storage.retrieve_range(blob_id, 500, 9000)
+        ranged = b"".join([bytes(c) async for c in blob_stream.chunks])
+        whole = await storage.retrieve(blob_id)
+        return ranged, bytes(whole.data)
+
+    ranged, whole = asyncio.run(run())
+
+    assert ranged == payload[500:9001]
+    assert whole == payload
+    assert all("Range" in r.headers for r in fake_s3.requests)
+    assert 1 < fake_s3.max_in_flight <= 3
+
+def _ftp_pool(**overrides):
+    from app.storage.executors import ftp_io
+    from app.storage.ftp_pool import FTPConnectionPool
+
+    connections = []
+
+    def connect():
+        connections.append(MagicMock())
+        return connections[-1]
+
+    options = dict(max_size=2, timeout=0.05, check_after=0, keepalive_interval=60, io=ftp_io)
+    options.update(overrides)
+    return FTPConnectionPool(connect, **options), connections
+
+def test_ftp_streams_check_out_on_the_loop_and_hold_no_thread_between_chunks(monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from io import BytesIO
+    from app.core.config import ContentEncoding, StorageBackend, settings
+    from app.storage import ftp_storage
+    from app.storage.executors import ftp_io
+    from app.storage.ftp_pool import FTPConnectionPool
+    from app.storage.locator import BlobLocation, locator
+
+    monkeypatch.setattr(settings, "DOWNLOAD_CHUNK_SIZE", 4)
+    payload = b"0123456789abcdef"
+
+    def transfercmd(cmd, rest=None):
+        data = BytesIO(payload[rest or 0:])
+        conn = MagicMock()
+        conn.recv.side_effect = data.read
+        return conn
+
+    # replies after ABOR + NOOP: the transfer's, ABOR's, then NOOP's; the
+    # second range read gets a reply the abort cannot make sense of
+    replies = iter(["426 Transfer aborted", "226 ABOR successful", "200 NOOP ok", "500 Confused"])
+
+    def connect():
+        ftps = MagicMock()
+        ftps.transfercmd.side_effect = transfercmd
+        ftps.getmultiline.side_effect = lambda: next(replies)
+        return ftps
+
+    pool = FTPConnectionPool(
+        connect, max_size=1, timeout=0.05, check_after=60, keepalive_interval=60, io=ftp_io
+    )
+    monkeypatch.setattr(ftp_storage, "ftp_pool", pool)
+    blob_id = str(uuid.uuid4())
+    locator.remember(blob_id, BlobLocation(
+        backend=StorageBackend.FTP,
+        storage_path="20260101T000000000000Z__blob.bin",
+        size=len(payload),
+        content_encoding=ContentEncoding.IDENTITY,
+    ))
+
+    async def run():
+        storage = ftp_storage.FTPStorage()
+        blob_stream = await storage.retrieve_stream(blob_id)
+        received, busy = [], []
+        async for chunk in blob_stream.chunks:
+            received.append(bytes(chunk))
+            # a slow consumer holds the session, not an ftp_io thread
+            busy.append(ftp_io.stats()["pending"])
+        parts = []
+        for _ in range(2):
+            blob_range = await storage.retrieve_range(blob_id, 2, 5)
+            parts.append(b"".join([bytes(c) async for c in blob_range.chunks]))
+            stats = pool.stats()
+            parts.append((stats["reused_total"], stats["discarded_total"], stats["idle"]))
+        return received, busy, parts
+
+    received, busy, parts = asyncio.run(run())
+    assert received == [b"0123", b"4567", b"89ab", b"cdef"]
+    assert busy == [0, 0, 0, 0]
+    # a range read cut short aborts its transfer and gives the session back;
+    # one whose abort goes wrong drops it
+    assert parts == [b"2345", (1, 0, 1), b"2345", (2, 1, 0)]
+    assert pool.stats()["created_total"] == 1
+
+
+def test_ftp_pool_reuses_sessions_and_reconnects_stale_ones():
+    pool, connections = _ftp_pool()
+
+    with pool.connection():
+        pass
+    with pool.connection() as ftps:
+        assert ftps is connections[0]
+    ftps.voidcmd.assert_called_with("NOOP")  # health check on checkout
+
+    ftps.voidcmd.side_effect = EOFError()  # server dropped the session
+    with pool.connection() as ftps:
+        assert ftps is connections[1]
+
+    assert len(connections) == 2
+    assert pool.stats()["reused_total"] == 1
+    assert pool.stats()["discarded_total"] == 1
+
+def test_ftp_pool_is_bounded_and_counts_waits():
+    from app.storage.ftp_pool import FTPPoolTimeout
+
+    pool, connections = _ftp_pool()
+    held = [pool.acquire(), pool.acquire()]
+
+    with pytest.raises(FTPPoolTimeout):
+        pool.acquire()
+
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["waits_total"], stats["timeouts_total"]) == (2, 2, 1, 1)
+
+    pool.release(held[0], reusable=False)  # broken session frees its slot
+    pool.release(held[1])
+    pool.close()
+
+    held[1].quit.assert_called_once()
+    held[0].close.assert_called_once()
+    assert pool.stats()["size"] == 0
+
+def test_ftp_pool_takes_back_sessions_of_cancelled_checkouts():
+    import asyncio
+    import time
+    from app.storage.executors import ftp_io
+    from app.storage.ftp_pool import FTPConnectionPool
+
+    def slow_connect():
+        time.sleep(0.3)
+        return MagicMock()
+
+    pool = FTPConnectionPool(
+        slow_connect, max_size=1, timeout=0.05, check_after=60, keepalive_interval=60, io=ftp_io
+    )
+
+    async def checkout():
+        async with pool.async_connection():
+            pass
+
+    async def run():
+        # e.g. the client disconnected while the session was connecting
+        task = asyncio.create_task(checkout())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.4)
+        in_use = pool.stats()["in_use"]
+        await checkout()
+        return in_use
+
+    assert asyncio.run(run()) == 0
+    assert pool.stats()["timeouts_total"] == 0
+
+def test_ftp_pool_async_waits_hold_no_thread():
+    import asyncio
+    from app.storage.executors import ftp_io
+
+    pool, connections = _ftp_pool(max_size=1, timeout=1)
+
+    async def run():
+        held = await pool.async_acquire()
+        waiter = asyncio.create_task(pool.async_acquire())
+        await asyncio.sleep(0.05)
+        # queued for the session on the loop, not in a thread
+        waiting = (pool.stats()["waiting"], ftp_io.stats()["pending"])
+        pool.release(held)
+        return waiting, held, await waiter
+
+    waiting, held, handed_over = asyncio.run(run())
+    assert waiting == (1, 0)
+    assert handed_over is held and len(connections) == 1
+    assert pool.stats()["waits_total"] == 1
+
+def test_ftp_pool_keepalive_drops_dead_idle_sessions():
+    pool, connections = _ftp_pool(keepalive_interval=0)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    second.voidcmd.side_effect = EOFError()
+
+    pool.keepalive()
+
+    first.voidcmd.assert_called_with("NOOP")
+    assert (pool.stats()["size"], pool.stats()["idle"]) == (1, 1)
+
+def test_storage_stats_endpoint(client: TestClient, auth_headers):
+    response = client.get("/api/v1/storage/stats", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert {"size", "idle", "in_use", "waiting", "waits_total"} <= response.json()["ftp"].keys()
+
+def test_slow_local_disk_does_not_stall_the_event_loop(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import threading
+    import time
+    import uuid
+    from app.core.config import settings
+    from app.storage import local_storage
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_id = str(uuid.uuid4())
+    read_at = local_storage._read_at
+    reader_threads = set()
+
+    def slow_read_at(f, offset, size):
+        reader_threads.add(threading.current_thread().name)
+        time.sleep(0.2)
+        return read_at(f, offset, size)
+
+    async def run():
+        storage = LocalStorage()
+        await storage.save_stream(blob_id, _chunks(b"slow disk"), "f.txt", "f.txt")
+        monkeypatch.setattr(local_storage, "_read_at", slow_read_at)
+
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        blob_stream = await storage.retrieve_stream(blob_id)
+        data = b"".join([c async for c in blob_stream.chunks])
+        task.cancel()
+        return data, ticks
+
+    data, ticks = asyncio.run(run())
+
+    assert data == b"slow disk"
+    assert ticks >= 5  # the loop kept serving other work during the read
+    assert all(name.startswith("local-io") for name in reader_threads)
+
+def test_local_layout_migrator_moves_flat_blobs_into_shards(tmp_path, monkeypatch):
+    import asyncio
+    import base64
+    import uuid
+    from app.core.config import StorageBackend, settings
+    from app.storage import migrate_local_layout
+    from app.storage.local_storage import LocalStorage, sharded_path
+
+    indexed_id, legacy_id = str(uuid.uuid4()), str(uuid.uuid4())
+    (tmp_path / f"20260101T034814343094Z__{indexed_id}.bin").write_bytes(b"raw bytes")
+    (tmp_path / f"20260101T035720725331Z__{legacy_id}.bin").write_bytes(base64.b64encode(b"legacy"))
+    (tmp_path / "notes.bin").write_bytes(b"not a blob")
+
+    indexed_row = MagicMock(storage_path=f"20260101T034814343094Z__{indexed_id}.bin")
+    rows = {indexed_id: indexed_row}
+
+    async def fake_get_blob_metadata(db, blob_id):
+        return rows.get(blob_id)
+
+    class Session:
+        added, commits = [], 0
+
+        def add(self, obj):
+            self.added.append(obj)
+
+        async def commit(self):
+            self.commits += 1
+
+    monkeypatch.setattr(migrate_local_layout, "get_blob_metadata", fake_get_blob_metadata)
+    db = Session()
+
+    assert asyncio.run(migrate_local_layout.migrate(tmp_path, db, dry_run=True)) == 2
+    assert (tmp_path / f"20260101T034814343094Z__{indexed_id}.bin").exists()
+
+    assert asyncio.run(migrate_local_layout.migrate(tmp_path, db)) == 2
+
+    assert sharded_path(tmp_path, indexed_id).read_bytes() == b"raw bytes"
+    assert indexed_row.storage_path == sharded_path(tmp_path, indexed_id).relative_to(tmp_path).as_posix()
+    [legacy_row] = db.added
+    assert (legacy_row.size, legacy_row.content_encoding, legacy_row.storage_backend) == (
+        6, "base64", StorageBackend.LOCAL
+    )
+    assert db.commits == 1
+    assert sorted(p.name for p in tmp_path.glob("*.bin")) == ["notes.bin"]
+
+def test_pack_store_survives_reopen_and_compacts_deleted_blobs(tmp_path):
+    from app.storage.pack_store import PackStore
+
+    store = PackStore(tmp_path, segment_size=100)
+    payloads = {f"blob-{i}": bytes([i]) * 40 for i in range(6)}
+    for blob_id, data in payloads.items():
+        store.put(blob_id, data)
+    assert store.read("blob-3", 10, 15) == payloads["blob-3"][10:15]
+    assert store.stats()["segments"] > 1
+
+    for blob_id in ["blob-0", "blob-1", "blob-2"]:
+        assert store.delete(blob_id)
+    store.close()
+
+    # the index log is replayed on open
+    store = PackStore(tmp_path, segment_size=100)
+    assert store.read("blob-0") is None
+    assert store.read("blob-4") == payloads["blob-4"]
+
+    total_before = store.stats()["total_bytes"]
+    assert store.compact(garbage_ratio=0.5) > 0
+    assert store.stats()["total_bytes"] < total_before
+    for blob_id in ["blob-3", "blob-4", "blob-5"]:
+        assert store.read(blob_id) == payloads[blob_id]
+    store.close()
+
+    store = PackStore(tmp_path, segment_size=100)
+    assert store.stats()["blobs"] == 3
+    assert store.read("blob-3") == payloads["blob-3"]
+    store.close()
+
+def test_pack_compaction_makes_the_index_durable_before_dropping_segments(tmp_path, monkeypatch):
+    import os
+    from pathlib import Path
+    from app.storage.pack_store import PackStore
+
+    store = PackStore(tmp_path, segment_size=100)
+    for i in range(6):
+        store.put(f"blob-{i}", bytes([i]) * 40)
+    for i in range(4):
+        store.delete(f"blob-{i}")
+
+    events = []
+    replace, unlink = os.replace, Path.unlink
+
+    def record_replace(src, dst):
+        replace(src, dst)
+        events.append(("replace", Path(dst).name))
+
+    def record_unlink(self, *args, **kwargs):
+        events.append(("unlink", self.name))
+        return unlink(self, *args, **kwargs)
+
+    monkeypatch.setattr(os, "replace", record_replace)
+    monkeypatch.setattr(Path, "unlink", record_unlink)
+    assert store.compact(garbage_ratio=0.5) > 0
+    store.close()
+
+    # a crash at any point leaves an index whose segments all exist
+    dropped = [name for op, name in events if op == "unlink" and name.endswith(".pack")]
+    assert dropped and events.index(("replace", "index.log")) < events.index(("unlink", dropped[0]))
+
+def test_pack_stores_of_several_workers_share_their_segments(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.storage.pack_store import PackStore
+
+    # one store per worker process, over the same directory
+    workers = [PackStore(tmp_path, segment_size=200) for _ in range(2)]
+    payloads = {f"w{w}-{i}": bytes([w * 50 + i]) * (10 + i) for w in range(2) for i in range(40)}
+
+    def put_all(w):
+        for i in range(40):
+            workers[w].put(f"w{w}-{i}", payloads[f"w{w}-{i}"])
+
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(put_all, range(2)))
+
+    # interleaved appends got their real offsets, and each sees the other's blobs
+    for store in workers:
+        assert all(store.read(b) == data for b, data in payloads.items())
+
+    for i in range(30):
+        assert workers[i % 2].delete(f"w0-{i}")
+    assert workers[1].read("w0-0") is None
+
+    # worker 0 compacts segments worker 1 already reads from
+    assert workers[0].compact(garbage_ratio=0.3) > 0
+    live = {b: d for b, d in payloads.items() if b not in {f"w0-{i}" for i in range(30)}}
+    assert all(workers[1].read(b) == d for b, d in live.items())
+
+    # appends after the rewrite land in the new index
+    workers[1].put("late", b"late blob")
+    assert workers[0].read("late") == b"late blob"
+    for store in workers:
+        store.close()
+
+    store = PackStore(tmp_path, segment_size=200)
+    assert store.stats()["blobs"] == len(live) + 1
+    assert all(store.read(b) == d for b, d in live.items())
+    store.close()
+
+def test_local_storage_packs_small_blobs_only(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.local_storage import LocalStorage
+    from app.storage.pack_store import close_pack_stores
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_PACK_ENABLED", True)
+    monkeypatch.setattr(settings, "LOCAL_PACK_MAX_BLOB_SIZE", 16)
+    small_id, large_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def run():
+        storage = LocalStorage()
+        # sizes unknown up front: decided by buffering up to the limit
+        await storage.save_stream(small_id, _chunks(b"tiny ", b"blob"), "s.txt", "s.txt")
+        await storage.save_stream(large_id, _chunks(b"0123456789", b"abcdefghij"), "l.txt", "l.txt")
+
+        blob_stream = await storage.retrieve_range(small_id, 2, 6)
+        ranged = b"".join([c async for c in blob_stream.chunks])
+        small = (await storage.retrieve(small_id)).data
+        large = (await storage.retrieve(large_id)).data
+
+        assert await storage.delete(small_id)
+        assert not await storage.delete(small_id)
+        return ranged, small, large, await storage.retrieve(small_id)
+
+    try:
+        ranged, small, large, deleted = asyncio.run(run())
+    finally:
+        close_pack_stores()
+
+    assert (ranged, small, large, deleted) == (b"ny bl", b"tiny blob", b"0123456789abcdefghij", None)
+    assert large_id in metadata_store and small_id not in metadata_store
+    assert metadata_store[large_id].storage_path.endswith(large_id)
+    assert list(tmp_path.glob(f"*/*/{small_id}")) == []
+
+def test_group_commit_shares_fsyncs_within_the_window():
+    import asyncio
+    from app.storage.executors import local_io
+    from app.storage.group_commit import GroupCommit
+
+    synced = []
+    def sync_a():
+        synced.append("a")
+    def sync_b():
+        synced.append("b")
+
+    async def run():
+        commit = GroupCommit(window=0.05, io=local_io)
+        await asyncio.gather(*(commit.sync(sync_a) for _ in range(5)), commit.sync(sync_b, sync_a))
+        return commit.stats()
+
+    stats = asyncio.run(run())
+    assert sorted(synced) == ["a", "b"]
+    assert (stats["writes_total"], stats["batches_total"], stats["fsyncs_total"]) == (6, 1, 2)
+
+def test_local_storage_writes_are_atomic_and_group_committed(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.group_commit import local_commit
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(local_commit, "window", 0.05)
+    blob_ids = [str(uuid.uuid4()) for _ in range(4)]
+
+    async def broken_upload():
+        yield b"half of a "
+        raise RuntimeError("upload cancelled")
+
+    async def run():
+        storage = LocalStorage()
+        batches = local_commit.stats()["batches_total"]
+        await asyncio.gather(
+            *(storage.save_stream(b, _chunks(b"payload ", b.encode()), "f", "f") for b in blob_ids)
+        )
+        with pytest.raises(RuntimeError):
+            await storage.save_stream(str(uuid.uuid4()), broken_upload(), "f", "f")
+        return local_commit.stats()["batches_total"] - batches
+
+    assert asyncio.run(run()) == 1
+    files = [p for p in tmp_path.rglob("*") if p.is_file()]
+    assert sorted(p.name for p in files) == sorted(blob_ids)
+    for blob_id in blob_ids:
+        assert list(tmp_path.rglob(blob_id))[0].read_bytes() == b"payload " + blob_id.encode()
+
+def test_blob_cache_evicts_by_bytes_and_expires(monkeypatch):
+    from app.storage.base import StoredBlob
+    from app.storage.cache import BlobCache
+
+    clock = [0.0]
+    monkeypatch.setattr("app.storage.cache.time.monotonic", lambda: clock[0])
+    cache = BlobCache(max_bytes=10, max_object_size=6, ttl=60)
+
+    assert not cache.put(StoredBlob(id="big", data=b"x" * 7, size=7))
+    for blob_id in "abc":
+        assert cache.put(StoredBlob(id=blob_id, data=b"xxxx", size=4))
+    # c pushed out a, the least recently used
+    assert cache.get("a") is None and cache.get("b") is not None
+
+    cache.invalidate("b")
+    assert cache.get("b") is None
+    clock[0] = 61
+    assert cache.get("c") is None
+
+    stats = cache.stats()
+    assert (stats["hits_total"], stats["misses_total"], stats["evictions_total"]) == (1, 3, 1)
+    assert (stats["expirations_total"], stats["invalidations_total"], stats["bytes"]) == (1, 1, 0)
+
+def test_cached_storage_reads_through_and_invalidates(mock_storage):
+    import asyncio
+    from app.storage.cache import BlobCache, CachedStorage
+
+    storage = CachedStorage(mock_storage, BlobCache(max_bytes=1024, max_object_size=1024, ttl=60))
+
+    async def run():
+        first = await storage.retrieve("blob")
+        second = await storage.retrieve("blob")
+        blob_stream = await storage.retrieve_range("blob", 2, 5)
+        ranged = b"".join([bytes(c) async for c in blob_stream.chunks])
+
+        await storage.delete("blob")
+        await storage.retrieve("blob")
+        return first, second, ranged
+
+    first, second, ranged = asyncio.run(run())
+    assert second is first and ranged == b"stda"
+    assert mock_storage.retrieve.await_count == 2
+    mock_storage.retrieve_range.assert_not_called()
+
+def test_cached_storage_fills_from_full_streams(mock_storage):
+    import asyncio
+    from app.storage.cache import BlobCache, CachedStorage
+
+    storage = CachedStorage(mock_storage, BlobCache(max_bytes=1024, max_object_size=1024, ttl=60))
+
+    async def read():
+        blob_stream = await storage.retrieve_stream("blob")
+        return b"".join([bytes(c) async for c in blob_stream.chunks])
+
+    async def run():
+        return await read(), await read()
+
+    assert asyncio.run(run()) == (b"testdata", b"testdata")
+    assert mock_storage.retrieve_stream.await_count == 1
+
+def test_cached_storage_fills_survive_writes_to_other_blobs(mock_storage):
+    import asyncio
+    import uuid
+    from app.storage.cache import BlobCache, CachedStorage
+
+    cache = BlobCache(max_bytes=1024, max_object_size=1024, ttl=60)
+    storage = CachedStorage(mock_storage, cache)
+    upload_id = str(uuid.uuid4())
+    slow_retrieve = mock_storage.retrieve.side_effect
+
+    async def retrieve(blob_id, **kwargs):
+        await asyncio.sleep(0.05)
+        return await slow_retrieve(blob_id, **kwargs)
+    mock_storage.retrieve.side_effect = retrieve
+
+    async def run():
+        # a fresh upload and a delete of another blob race the fills
+        await asyncio.gather(
+            storage.retrieve("hot"),
+            storage.save_stream(upload_id, _chunks(b"x"), "f", "f"),
+            storage.retrieve("warm"),
+            storage.delete("other"),
+        )
+        # an invalidation of the blob itself still drops its fill
+        await asyncio.gather(storage.retrieve("stale"), storage.delete("stale"))
+
+    asyncio.run(run())
+    assert "hot" in cache and "warm" in cache
+    assert "stale" not in cache and upload_id not in cache
+
+def test_cached_storage_passes_file_backed_streams_through(mock_storage, tmp_path):
+    import asyncio
+    from app.storage.base import BlobStream
+    from app.storage.cache import BlobCache, CachedStorage
+
+    file_path = tmp_path / "blob.bin"
+    file_path.write_bytes(b"testdata")
+
+    async def retrieve_stream(blob_id, **kwargs):
+        return BlobStream(id=blob_id, size=8, chunks=_chunks(b"testdata"), file_path=str(file_path))
+    mock_storage.retrieve_stream.side_effect = retrieve_stream
+
+    cache = BlobCache(max_bytes=1024, max_object_size=1024, ttl=60)
+    storage = CachedStorage(mock_storage, cache)
+
+    async def run():
+        blob_stream = await storage.retrieve_stream("blob")
+        await blob_stream.chunks.aclose()
+        return blob_stream
+
+    assert asyncio.run(run()).file_path == str(file_path)
+    assert "blob" not in cache
+
+def test_disk_cache_fetches_a_cold_blob_once_per_host(tmp_path, metadata_store):
+    import asyncio
+    import uuid
+    from datetime import datetime, timezone
+    from app.blob_models import BlobMetadata
+    from app.core.config import StorageBackend
+    from app.storage.base import BlobStream
+    from app.storage.disk_cache import DiskCache, DiskCachedStorage
+
+    blob_id = str(uuid.uuid4())
+    payload = b"remote payload"
+    metadata_store[blob_id] = BlobMetadata(
+        id=blob_id, size=len(payload), created_at=datetime.now(timezone.utc),
+        storage_backend=StorageBackend.S3, storage_path=blob_id, content_encoding="identity",
+    )
+
+    remote = MagicMock()
+    remote.get_backend_type.return_value = StorageBackend.S3
+
+    async def retrieve_stream(blob_id, **kwargs):
+        await asyncio.sleep(0.1)   # slow enough for the other worker to miss too
+        return BlobStream(id=blob_id, size=len(payload), chunks=_chunks(payload[:6], payload[6:]))
+    remote.retrieve_stream = AsyncMock(side_effect=retrieve_stream)
+
+    # two workers: separate DiskCache objects over the same directory
+    workers = [
+        DiskCachedStorage(remote, DiskCache(tmp_path, max_bytes=1024, max_object_size=1024))
+        for _ in range(2)
+    ]
+
+    async def read(storage):
+        blob_stream = await storage.retrieve_stream(blob_id)
+        return b"".join([c async for c in blob_stream.chunks]), blob_stream.file_path
+
+    async def run():
+        results = await asyncio.gather(*(read(w) for w in workers))
+        blob_stream = await workers[0].retrieve_range(blob_id, 7, 10)
+        ranged = b"".join([c async for c in blob_stream.chunks])
+        return results, ranged
+
+    results, ranged = asyncio.run(run())
+    assert [data for data, _path in results] == [payload, payload]
+    # the worker that fetched streamed the remote, the other one the file it filled
+    assert sorted(path is None for _data, path in results) == [False, True]
+    assert all(Path(path).read_bytes() == payload for _data, path in results if path)
+    assert ranged == b"payl"
+    assert remote.retrieve_stream.await_count == 1
+
+def test_disk_cache_streams_a_cold_blob_while_filling(tmp_path, metadata_store):
+    import asyncio
+    import uuid
+    from datetime import datetime, timezone
+    from app.blob_models import BlobMetadata
+    from app.core.config import StorageBackend
+    from app.storage.base import BlobStream
+    from app.storage.disk_cache import DiskCache, DiskCachedStorage
+
+    blob_id = str(uuid.uuid4())
+    metadata_store[blob_id] = BlobMetadata(
+        id=blob_id, size=8, created_at=datetime.now(timezone.utc),
+        storage_backend=StorageBackend.S3, storage_path=blob_id, content_encoding="identity",
+    )
+    rest_sent = asyncio.Event()
+
+    async def remote_chunks():
+        yield b"head"
+        await rest_sent.wait()
+        yield b"tail"
+
+    remote = MagicMock()
+    remote.get_backend_type.return_value = StorageBackend.S3
+    remote.retrieve_stream = AsyncMock(
+        side_effect=lambda blob_id, **kwargs: BlobStream(id=blob_id, size=8, chunks=remote_chunks())
+    )
+    cache = DiskCache(tmp_path, max_bytes=1024, max_object_size=1024)
+    storage = DiskCachedStorage(remote, cache)
+
+    async def run():
+        # a client that goes away after the first chunk caches nothing
+        blob_stream = await asyncio.wait_for(storage.retrieve_stream(blob_id), 1)
+        assert await asyncio.wait_for(blob_stream.chunks.__anext__(), 1) == b"head"
+        await blob_stream.chunks.aclose()
+        assert not cache.path_for(blob_id).exists()
+
+        # the first bytes arrive before the remote has sent the rest
+        blob_stream = await asyncio.wait_for(storage.retrieve_stream(blob_id), 1)
+        first = await asyncio.wait_for(blob_stream.chunks.__anext__(), 1)
+        rest_sent.set()
+        return first + b"".join([c async for c in blob_stream.chunks])
+
+    assert asyncio.run(run()) == b"headtail"
+    assert cache.path_for(blob_id).read_bytes() == b"headtail"
+    assert not list(tmp_path.glob("*/*/.*"))
+
+def test_disk_cache_fetches_run_outside_the_stripe_lock(tmp_path, monkeypatch):
+    import asyncio
+    import sys
+    from app.storage.base import BlobStream
+    from app.storage.disk_cache import DiskCache
+
+    # every blob shares one stripe (app.storage.disk_cache is also the instance's name)
+    monkeypatch.setattr(sys.modules["app.storage.disk_cache"], "_LOCK_STRIPES", 1)
+    cache = DiskCache(tmp_path, max_bytes=1024, max_object_size=1024)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def slow_fetch():
+            await release.wait()
+            return BlobStream(id="slow", size=4, chunks=_chunks(b"slow"))
+
+        async def fast_fetch():
+            return BlobStream(id="fast", size=4, chunks=_chunks(b"fast"))
+
+        slow = asyncio.create_task(cache.get_or_fill("slow", 4, slow_fetch))
+        await asyncio.sleep(0.05)
+        # the slow fetch is in flight: another blob of its stripe still fills
+        fast_path = await asyncio.wait_for(cache.get_or_fill("fast", 4, fast_fetch), 1)
+        assert not slow.done()
+        release.set()
+        return fast_path, await slow
+
+    fast_path, slow_path = asyncio.run(run())
+    assert fast_path.read_bytes() == b"fast" and slow_path.read_bytes() == b"slow"
+    # markers are gone once the fills are done
+    assert not list(tmp_path.glob("*/*/.*.fill"))
+
+def test_disk_cache_evicts_least_recently_read(tmp_path):
+    import os
+    from app.storage.disk_cache import DiskCache
+
+    cache = DiskCache(tmp_path, max_bytes=25, max_object_size=25)
+    for age, blob_id in enumerate(["newest", "middle", "oldest"]):
+        file_path = cache.path_for(blob_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(b"x" * 10)
+        os.utime(file_path, (1_000_000 - age * 100, 1_000_000))
+
+    assert cache.evict() == 1
+    assert not cache.path_for("oldest").exists()
+    assert cache.path_for("middle").exists() and cache.path_for("newest").exists()
+
+def test_single_flight_shares_one_call_and_its_errors():
+    import asyncio
+    from app.storage.single_flight import SingleFlight
+
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.05)
+        return call
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ConnectionError("backend down")
+
+    async def run():
+        flights = SingleFlight(max_waiters=3)
+        shared = await asyncio.gather(*(flights.do("blob", fetch) for _ in range(5)))
+        # the flight landed: the next call fetches again
+        again = await flights.do("blob", fetch)
+        errors = await asyncio.gather(
+            *(flights.do("other", failing) for _ in range(3)), return_exceptions=True
+        )
+        return shared, again, errors, flights.stats()
+
+    shared, again, errors, stats = asyncio.run(run())
+    # 1 leader + 3 waiters share the first call, the 5th overflows into its own
+    assert sorted(shared.count(r) for r in set(shared)) == [1, 4]
+    assert again == 3
+    assert all(isinstance(e, ConnectionError) for e in errors)
+    assert (stats["calls_total"], stats["shared_total"], stats["overflows_total"]) == (3, 5, 1)
+    assert (stats["errors_total"], stats["in_flight"]) == (1, 0)
+
+def test_single_flight_storage_coalesces_concurrent_retrieves(mock_storage):
+    import asyncio
+    from app.storage.single_flight import SingleFlight, SingleFlightStorage
+
+    retrieve = mock_storage.retrieve.side_effect
+
+    async def slow_retrieve(blob_id, **kwargs):
+        await asyncio.sleep(0.05)
+        return await retrieve(blob_id, **kwargs)
+    mock_storage.retrieve.side_effect = slow_retrieve
+
+    storage = SingleFlightStorage(mock_storage, SingleFlight(max_waiters=100))
+
+    async def run():
+        return await asyncio.gather(*(storage.retrieve("blob") for _ in range(10)))
+
+    blobs = asyncio.run(run())
+    assert all(b is blobs[0] for b in blobs) and blobs[0].data == b"testdata"
+    assert mock_storage.retrieve.await_count == 1
+
+def test_dedup_stores_each_content_once_and_refcounts_deletes(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import hashlib
+    import uuid
+    from types import SimpleNamespace
+    from app.core.config import settings
+    from app.storage import dedup
+    from app.storage.dedup import DedupStorage, chunker, content_id_for
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "DEDUP_SPOOL_MEMORY", 4)   # spills to disk
+    contents = {}
+
+    async def fake_lock_content(db, digest):
+        return contents.get(digest)
+
+    async def fake_add_content_reference(db, content, digest, size, blob_metadata):
+        contents.setdefault(digest, SimpleNamespace(refcount=0)).refcount += 1
+        blob_metadata.content_digest = digest
+        metadata_store[str(blob_metadata.id)] = blob_metadata
+
+    async def fake_release_content_reference(db, blob_id):
+        digest = metadata_store.pop(blob_id).content_digest
+        contents[digest].refcount -= 1
+        if contents[digest].refcount == 0:
+            del contents[digest]
+            return digest, 0
+        return digest, contents[digest].refcount
+
+    monkeypatch.setattr(dedup, "lock_content", fake_lock_content)
+    monkeypatch.setattr(dedup, "add_content_reference", fake_add_content_reference)
+    monkeypatch.setattr(dedup, "release_content_reference", fake_release_content_reference)
+
+    first, second, other = (str(uuid.uuid4()) for _ in range(3))
+
+    async def run():
+        storage = DedupStorage(LocalStorage(), chunker)
+        await storage.save_stream(first, _chunks(b"same ", b"bytes"), "a.txt", "a.txt")
+        await storage.save_stream(second, _chunks(b"same bytes"), "b.txt", "b.txt")
+        await storage.save_stream(other, _chunks(b"other bytes"), "c.txt", "c.txt")
+        stored_files = sorted(p.name for p in tmp_path.rglob("*") if p.is_file())
+
+        # shared content is not a blob of its own, with or without dedup in front
+        content_id = content_id_for(hashlib.sha256(b"other bytes").hexdigest())
+        for public in (storage, LocalStorage()):
+            assert await public.retrieve(content_id) is None
+            assert await public.retrieve_stream(content_id) is None
+            assert not await public.delete(content_id)
+        assert (await storage.retrieve(other)).data == b"other bytes"
+
+        blob = await storage.retrieve(second)
+        blob_range = await storage.retrieve_range(first, 5, 9)
+        range_data = b"".join([c async for c in blob_range.chunks])
+
+        assert await storage.delete(first)
+        still_there = await storage.retrieve(second)
+        assert await storage.delete(second)
+        gone = await storage.retrieve(second)
+        return stored_files, blob, range_data, still_there, gone
+
+    stored_files, blob, range_data, still_there, gone = asyncio.run(run())
+    digest = next(d for d in contents)   # only "other bytes" is left
+    assert len(stored_files) == 2 and content_id_for(digest) in stored_files
+    assert (blob.id, blob.name, blob.data) == (second, "b.txt", b"same bytes")
+    assert range_data == b"bytes"
+    # the shared content outlives the first delete, not the last one
+    assert still_there.data == b"same bytes" and gone is None
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [content_id_for(digest)]
+
+def test_chunker_cuts_are_content_defined():
+    import os
+    from app.storage.chunking import Chunker
+
+    chunker = Chunker(2 * 1024, 8 * 1024, 32 * 1024)
+
+    def split(data):
+        sizes = []
+        while data:
+            sizes.append(chunker.cut(data))
+            data = data[sizes[-1]:]
+        return sizes
+
+    original = os.urandom(512 * 1024)
+    edited = original[:100_000] + b"an edit" + original[100_000:]
+    before, after = split(original), split(edited)
+
+    assert sum(before) == len(original) and max(before) <= 32 * 1024
+    assert 4 * 1024 < len(original) / len(before) < 16 * 1024
+    # only the chunk holding the edit differs
+    assert len(set(after) - set(before)) <= 2
+    assert before[-10:] == after[-10:]
+
+
+def test_chunked_dedup_stores_shared_chunks_once(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import os
+    import uuid
+    from types import SimpleNamespace
+    from app.core.config import settings
+    from app.storage import dedup
+    from app.storage.chunking import Chunker
+    from app.storage.dedup import DedupStorage
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "DEDUP_CHUNKING", True)
+    contents, manifests = {}, {}
+
+    async def fake_lock_content(db, digest):
+        return contents.get(digest)
+
+    async def fake_reference_content(db, content, digest, size):
+        contents.setdefault(digest, SimpleNamespace(refcount=0)).refcount += 1
+
+    async def fake_release_content(db, digest):
+        contents[digest].refcount -= 1
+        if contents[digest].refcount == 0:
+            del contents[digest]
+            return 0
+        return contents[digest].refcount
+
+    async def fake_create_chunked_blob(db, blob_metadata, chunks):
+        blob_metadata.chunk_count = len(chunks)
+        metadata_store[str(blob_metadata.id)] = blob_metadata
+        manifests[str(blob_metadata.id)] = chunks
+        return blob_metadata
+
+    async def fake_get_blob_chunks(db, blob_id):
+        return manifests[blob_id]
+
+    async def fake_release_blob_chunks(db, blob_id):
+        del metadata_store[blob_id]
+        digests = sorted(c.digest for c in manifests.pop(blob_id))
+        return [(d, await fake_release_content(db, d)) for d in digests]
+
+    for name, fake in (
+        ("lock_content", fake_lock_content),
+        ("reference_content", fake_reference_content),
+        ("release_content", fake_release_content),
+        ("create_chunked_blob", fake_create_chunked_blob),
+        ("get_blob_chunks", fake_get_blob_chunks),
+        ("release_blob_chunks", fake_release_blob_chunks),
+    ):
+        monkeypatch.setattr(dedup, name, fake)
+
+    version_1 = os.urandom(256 * 1024)
+    version_2 = version_1[:50_000] + b"an edit" + version_1[50_000:]
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+
+    def stored_bytes():
+        return sum(p.stat().st_size for p in tmp_path.rglob("*") if p.is_file())
+
+    async def run():
+        storage = DedupStorage(LocalStorage(), Chunker(2 * 1024, 8 * 1024, 32 * 1024))
+        await storage.save_stream(first, _chunks(version_1[:100_000], version_1[100_000:]), "v1", "v1")
+        await storage.save_stream(second, _chunks(version_2), "v2", "v2")
+        stored = stored_bytes()
+
+        blob = await storage.retrieve(second)
+        blob_range = await storage.retrieve_range(second, 49_990, 50_016)
+        range_data = b"".join([bytes(c) async for c in blob_range.chunks])
+
+        await storage.delete(first)
+        after_first = await storage.retrieve(second)
+        await storage.delete(second)
+        return stored, blob, range_data, after_first
+
+    stored, blob, range_data, after_first = asyncio.run(run())
+    # the edit only rewrites the chunk(s) around it, each at most 32 KiB
+    assert len(version_1) < stored <= len(version_1) + 2 * 32 * 1024
+    assert blob.data == version_2 and after_first.data == version_2
+    assert range_data == version_2[49_990:50_017]
+    assert contents == {} and stored_bytes() == 0
+
+def test_compressed_storage_round_trips_and_skips_compressed_payloads(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import os
+    import uuid
+    from app.core.config import Compression, settings
+    from app.storage.compression import CompressedStorage
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.ZLIB)
+    monkeypatch.setattr(settings, "COMPRESSION_SAMPLE_SIZE", 1024)
+    text = b"".join(b"line %d of a text-heavy blob\n" % i for i in range(20_000))
+    noise = os.urandom(100_000)
+    text_id, noise_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def run():
+        storage = CompressedStorage(LocalStorage())
+        await storage.save_stream(text_id, _chunks(text[:500], text[500:]), "t", "t", size=len(text))
+        await storage.save_stream(noise_id, _chunks(noise), "n", "n", size=len(noise))
+
+        blob = await storage.retrieve(text_id)
+        stream = await storage.retrieve_stream(text_id)
+        streamed = b"".join([bytes(c) async for c in stream.chunks])
+        blob_range = await storage.retrieve_range(text_id, 100_000, 100_099)
+        range_data = b"".join([bytes(c) async for c in blob_range.chunks])
+        noise_stream = await storage.retrieve_stream(noise_id)
+        return blob, stream, streamed, blob_range, range_data, noise_stream
+
+    blob, stream, streamed, blob_range, range_data, noise_stream = asyncio.run(run())
+    text_row, noise_row = metadata_store[text_id], metadata_store[noise_id]
+    assert text_row.content_encoding == "zlib" and text_row.uncompressed_size == len(text)
+    assert text_row.size < len(text) // 5
+    # random bytes are stored as they are, and keep their sendfile shortcut
+    assert noise_row.content_encoding == "identity" and noise_stream.file_path
+
+    assert blob.data == text and blob.size == len(text)
+    assert streamed == text and stream.size == len(text) and stream.file_path is None
+    assert range_data == text[100_000:100_100]
+    assert (blob_range.start, blob_range.end, blob_range.size) == (100_000, 100_099, len(text))
+
+
+def test_factory_only_wraps_dedup_while_enabled(monkeypatch):
+    from app.core.config import Compression, StorageBackend, settings
+    from app.storage import get_storage_backend
+    from app.storage.compression import CompressedStorage
+    from app.storage.dedup import DedupStorage
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", False)
+    monkeypatch.setattr(settings, "BLOB_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.NONE)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", False)
+    # compressed blobs stay decodable with the codec turned off
+    storage = get_storage_backend(StorageBackend.LOCAL)
+    assert type(storage) is CompressedStorage
+    assert type(storage.backend) is LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.ZLIB)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    storage = get_storage_backend(StorageBackend.LOCAL)
+    assert type(storage) is DedupStorage
+    assert type(storage.backend) is CompressedStorage
+    assert type(storage.backend.backend) is LocalStorage
+
+def test_compressed_blobs_stay_readable_once_the_codec_is_off(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import Compression, StorageBackend, settings
+    from app.storage import get_storage_backend
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", False)
+    monkeypatch.setattr(settings, "BLOB_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", False)
+    text = b"".join(b"line %d of a text-heavy blob\n" % i for i in range(1000))
+    blob_id = str(uuid.uuid4())
+
+    async def save():
+        monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.ZLIB)
+        storage = get_storage_backend(StorageBackend.LOCAL)
+        await storage.save_stream(blob_id, _chunks(text), "t", "t", size=len(text))
+
+    async def read():
+        monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.NONE)
+        storage = get_storage_backend(StorageBackend.LOCAL)
+        blob_stream = await storage.retrieve_stream(blob_id)
+        streamed = b"".join([bytes(c) async for c in blob_stream.chunks])
+        return streamed, blob_stream.size, (await storage.retrieve(blob_id)).data
+
+    asyncio.run(save())
+    assert metadata_store[blob_id].content_encoding == "zlib"
+    assert asyncio.run(read()) == (text, len(text), text)
+
+def test_decompression_yields_at_most_a_download_chunk_per_step(monkeypatch):
+    import asyncio
+    import zlib
+    from app.core.config import ContentEncoding, settings
+    from app.storage.compression import decompress_chunks
+
+    monkeypatch.setattr(settings, "DOWNLOAD_CHUNK_SIZE", 1024 * 1024)
+    payload = bytes(16 * 1024 * 1024)
+    # a run of zeros: its first few KiB expand to all 16 MiB
+    compressed = zlib.compress(payload)
+
+    async def run():
+        return [c async for c in decompress_chunks(_chunks(compressed), ContentEncoding.ZLIB)]
+
+    out = asyncio.run(run())
+    assert b"".join(out) == payload
+    assert max(map(len, out)) == settings.DOWNLOAD_CHUNK_SIZE
+
+def test_compressed_range_read_closes_the_backend_stream(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import Compression, settings
+    from app.storage.compression import CompressedStorage
+    from app.storage.local_storage import LocalStorage
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    monkeypatch.setattr(settings, "LOCAL_COMPRESSION", Compression.ZLIB)
+    text = b"".join(b"line %d of a text-heavy blob\n" % i for i in range(50_000))
+    blob_id = str(uuid.uuid4())
+    closed = []
+
+    class TrackingStorage(LocalStorage):
+        async def retrieve_stream(self, blob_id, **kwargs):
+            blob_stream = await super().retrieve_stream(blob_id, **kwargs)
+
+            async def chunks(source):
+                try:
+                    async for chunk in source:
+                        yield chunk
+                finally:
+                    closed.append(blob_id)
+
+            blob_stream.chunks = chunks(blob_stream.chunks)
+            return blob_stream
+
+    async def run():
+        storage = CompressedStorage(TrackingStorage())
+        await storage.save_stream(blob_id, _chunks(text), "t", "t", size=len(text))
+        blob_range = await storage.retrieve_range(blob_id, 10, 19)
+        data = b"".join([bytes(c) async for c in blob_range.chunks])
+        # closed by the range read itself, not by the loop shutting down
+        return data, list(closed)
+
+    data, closed_by_read = asyncio.run(run())
+    assert data == text[10:20]
+    assert closed_by_read == [blob_id]
+
+def test_metadata_batch_defers_rows_until_flushed(tmp_path, monkeypatch, metadata_store):
+    import asyncio
+    import uuid
+    from app.core.config import settings
+    from app.storage.local_storage import LocalStorage
+    from app.storage.locator import MetadataBatch
+
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_FSYNC", False)
+    inserts = []
+
+    async def fake_create_blob_metadata_many(db, blobs):
+        inserts.append(len(blobs))
+        for blob_metadata in blobs:
+            metadata_store[str(blob_metadata.id)] = blob_metadata
+        return True
+
+    monkeypatch.setattr("app.storage.locator.create_blob_metadata_many", fake_create_blob_metadata_many)
+    blob_ids = [str(uuid.uuid4()) for _ in range(5)]
+
+    async def run():
+        storage = LocalStorage()
+        batch = MetadataBatch()
+        await asyncio.gather(*(
+            storage.save_stream(b, _chunks(b.encode()), "f", "f", metadata_batch=batch)
+            for b in blob_ids
+        ))
+        pending = (len(batch), dict(metadata_store))
+        assert await batch.flush()
+        return pending, await storage.retrieve(blob_ids[0])
+
+    (pending, rows_before), blob = asyncio.run(run())
+    assert pending == 5 and rows_before == {}
+    assert inserts == [5] and set(metadata_store) == set(blob_ids)
+    assert blob.data == blob_ids[0].encode()
+
+def test_database_batch_inserts_in_bounded_groups(monkeypatch):
+    import asyncio
+    import uuid
+    from app.storage.database_storage import DatabaseStorage
+    from app.storage.locator import MetadataBatch
+
+    inserts = []
+
+    async def fake_create_blob_metadata_many(db, blobs):
+        inserts.append(sorted(len(b.blob_data.data) for b in blobs))
+        # the second group fails to insert
+        return len(inserts) != 2
+
+    monkeypatch.setattr("app.storage.locator.create_blob_metadata_many", fake_create_blob_metadata_many)
+    blob_ids = [str(uuid.uuid4()) for _ in range(5)]
+
+    async def run():
+        storage = DatabaseStorage()
+        batch = MetadataBatch(max_pending_bytes=20)
+        saved = [
+            await storage.save_stream(b, _chunks(b"x" * 10), "f", "f", metadata_batch=batch)
+            for b in blob_ids
+        ]
+        pending = len(batch)
+        assert await batch.flush()
+        return saved, pending, batch.failed
+
+    saved, pending, failed = asyncio.run(run())
+    # at most 20 payload bytes were ever held; the rest went in early
+    assert pending == 1 and inserts == [[10, 10], [10, 10], [10]]
+    assert [s is not None for s in saved] == [True, True, True, False, True]
+    assert failed == set(blob_ids[2:4])
@@ -54,3 +54,22 @@ def test_blob_response_path_validation():
             created_at=datetime.now(timezone.utc),
             path="../sensitive/file.txt"
         )
+
+def test_blob_response_trusted_payload_skips_base64_check():
+    from app.blob_schemas import TRUSTED_PAYLOAD
+
+    fields = {
+        "id": uuid.uuid4(),
+        "data": b"not base64 at all",
+        "size": 4,
+        "created_at": datetime.now(timezone.utc),
+        "path": "/folder/file.txt",
+    }
+
+    with pytest.raises(ValueError):
+        BlobResponse.model_validate(fields)
+
+    blob = BlobResponse.model_validate(fields, context=TRUSTED_PAYLOAD)
+    assert blob.data == b"not base64 at all"
+    # the cheap checks still run
+    assert blob.path == "folder/file.txt"